@@ -156,7 +156,8 @@ def user():
     org.requires = IS_NULL_OR(IS_ONE_OF(db, "org_organisation.id",
                                         organisation_represent,
                                         orderby="org_organisation.name",
-                                        sort=True))
+                                        sort=True,
+                                        label_fields=["name", "acronym"]))
     org.represent = organisation_represent
     org.widget = S3OrganisationAutocompleteWidget()
     org.comment = DIV(_class="tooltip",
@@ -1384,48 +1384,141 @@ def budget_dupes(form):
 def budget_total(form):
     """ Calculate Totals for the budget specified by Form """
     if "budget_id" in form.vars:
-        # called by budget_staff_bundle()
+        # called by budget_staff_bundle() for a new line
         budget = form.vars.budget_id
+        if "staff_id" in form.vars:
+            table = db.budget_budget_staff
+            line = budget_costs(staff_query = (table.id == form.vars.id))
+        else:
+            table = db.budget_budget_bundle
+            line = budget_costs(bundle_query = (table.id == form.vars.id))
+        budget_totals_add(budget, line)
     else:
         # called by budget()
         budget = form.vars.id
-    budget_totals(budget)
+        budget_totals(budget)
+
+def budget_costs(staff_query=None, bundle_query=None, groupby=False):
+    """
+        Calculate the one-time & recurring costs of budget lines with
+        two aggregate join queries (staff and bundles)
+
+        @param staff_query: query for the budget_budget_staff lines
+        @param bundle_query: query for the budget_budget_bundle lines
+        @param groupby: group the costs by budget
+        @returns: dict {budget_id: [onetime, recurring]} if groupby,
+                  otherwise [onetime, recurring]
+    """
+
+    costs = {}
+    def add(budget, onetime, recurring):
+        if budget not in costs:
+            costs[budget] = [0, 0]
+        costs[budget][0] += onetime or 0
+        costs[budget][1] += recurring or 0
+
+    if staff_query is not None:
+        table = db.budget_budget_staff
+        stable = db.budget_staff
+        ltable = db.budget_location
+        query = staff_query & \
+                (stable.id == table.staff_id) & \
+                (ltable.id == table.location_id)
+        onetime = (stable.travel * table.quantity).sum()
+        recurring = ((stable.salary + ltable.subsistence + ltable.hazard_pay) * \
+                     table.quantity * table.months).sum()
+        if groupby:
+            rows = db(query).select(table.budget_id, onetime, recurring,
+                                    groupby=table.budget_id)
+        else:
+            rows = db(query).select(onetime, recurring)
+        for row in rows:
+            add(groupby and row[table.budget_id] or None,
+                row[onetime], row[recurring])
+
+    if bundle_query is not None:
+        table = db.budget_budget_bundle
+        btable = db.budget_bundle
+        query = bundle_query & \
+                (btable.id == table.bundle_id)
+        onetime = (btable.total_unit_cost * table.quantity).sum()
+        recurring = (btable.total_monthly_cost * table.quantity * table.months).sum()
+        if groupby:
+            rows = db(query).select(table.budget_id, onetime, recurring,
+                                    groupby=table.budget_id)
+        else:
+            rows = db(query).select(onetime, recurring)
+        for row in rows:
+            add(groupby and row[table.budget_id] or None,
+                row[onetime], row[recurring])
+
+    if groupby:
+        return costs
+    else:
+        return costs.get(None, [0, 0])
 
 def budget_totals(budget):
     """ Calculate Totals for a budget """
-    total_onetime_cost = 0
-    total_recurring_cost = 0
-
-    table = db.budget_budget_staff
-    query = (table.budget_id == budget)
-    staffs = db(query).select()
-    for staff in staffs:
-        query = (table.budget_id == budget) & (table.staff_id == staff.staff_id)
-        row = db(query).select(table.quantity, table.months, limitby=(0, 1)).first()
-        quantity = row.quantity
-        months = row.months
-        row2 = db(db.budget_staff.id == staff.staff_id).select(db.budget_staff.travel, db.budget_staff.salary, limitby=(0, 1)).first()
-        row3 = db(db.budget_location.id == staff.location_id).select(db.budget_location.subsistence, db.budget_location.hazard_pay, limitby=(0, 1)).first()
-        total_onetime_cost += row2.travel * quantity
-        total_recurring_cost += row2.salary * quantity * months
-        total_recurring_cost += row3.subsistence * quantity * months
-        total_recurring_cost += row3.hazard_pay * quantity * months
-
-    table = db.budget_budget_bundle
-    query = (table.budget_id == budget)
-    bundles = db(query).select()
-    for bundle in bundles:
-        query = (table.budget_id == budget) & (table.bundle_id == bundle.bundle_id)
-        row = db(query).select(table.quantity, table.months, limitby=(0, 1)).first()
-        quantity = row.quantity
-        months = row.months
-        row2 = db(db.budget_bundle.id == bundle.bundle_id).select(db.budget_bundle.total_unit_cost, db.budget_bundle.total_monthly_cost, limitby=(0, 1)).first()
-        total_onetime_cost += row2.total_unit_cost * quantity
-        total_recurring_cost += row2.total_monthly_cost * quantity * months
+    total_onetime_cost, total_recurring_cost = \
+        budget_costs(staff_query = (db.budget_budget_staff.budget_id == budget),
+                     bundle_query = (db.budget_budget_bundle.budget_id == budget))
 
     db(db.budget_budget.id == budget).update(total_onetime_costs=total_onetime_cost, total_recurring_costs=total_recurring_cost)
     s3_audit("update", module, "budget", record=budget, representation="html")
 
+def budget_totals_add(budget, costs):
+    """
+        Add the costs of changed lines to the Totals of a budget
+
+        @param budget: the budget ID
+        @param costs: the change of the [onetime, recurring] costs
+    """
+    table = db.budget_budget
+    record = db(table.id == budget).select(table.total_onetime_costs,
+                                           table.total_recurring_costs,
+                                           limitby=(0, 1)).first()
+    if not record or \
+       record.total_onetime_costs is None or \
+       record.total_recurring_costs is None:
+        # No Totals to add to yet
+        budget_totals(budget)
+        return
+    onetime, recurring = costs
+    if onetime or recurring:
+        db(table.id == budget).update(total_onetime_costs = table.total_onetime_costs + onetime,
+                                      total_recurring_costs = table.total_recurring_costs + recurring)
+    s3_audit("update", module, "budget", record=budget, representation="html")
+
+def budget_totals_all():
+    """
+        Recalculate the Totals of all budgets, e.g. after bulk price
+        updates of staff, locations or bundles
+    """
+    costs = budget_costs(staff_query = (db.budget_budget_staff.id > 0),
+                         bundle_query = (db.budget_budget_bundle.id > 0),
+                         groupby = True)
+    table = db.budget_budget
+    budgets = db(table.id > 0).select(table.id,
+                                      table.total_onetime_costs,
+                                      table.total_recurring_costs)
+    updated = 0
+    for budget in budgets:
+        onetime, recurring = costs.get(budget.id, [0, 0])
+        if budget.total_onetime_costs != onetime or \
+           budget.total_recurring_costs != recurring:
+            db(table.id == budget.id).update(total_onetime_costs=onetime,
+                                             total_recurring_costs=recurring)
+            updated += 1
+    return updated
+
+@auth.s3_requires_membership(1)
+def budget_recalculate():
+    """ Recalculate the Totals of all budgets (admin only) """
+
+    updated = budget_totals_all()
+    s3_audit("update", module, "budget", representation="html")
+    session.confirmation = T("Totals recalculated for %(count)s budgets") % dict(count=updated)
+    redirect(URL(f="budget"))
 
 def budget_update_items():
     """ Update a Budget's items (Quantity, Months & Delete) """
@@ -1439,6 +1532,23 @@ def budget_update_items():
     tables = [db.budget_budget_staff, db.budget_budget_bundle]
     authorised = s3_has_permission("update", tables[0]) and s3_has_permission("update", tables[1])
     if authorised:
+        # Costs of the lines before the changes
+        line_queries = []
+        for var in request.vars:
+            if "staff" in var:
+                staff = var.rsplit("_", 1)[-1]
+                line_queries.append(((tables[0].budget_id == budget) & (tables[0].staff_id == staff), None))
+            elif "bundle" in var:
+                bundle = var.rsplit("_", 1)[-1]
+                line_queries.append((None, (tables[1].budget_id == budget) & (tables[1].bundle_id == bundle)))
+        staff_query = bundle_query = None
+        for sq, bq in line_queries:
+            if sq is not None:
+                staff_query = staff_query is not None and staff_query | sq or sq
+            if bq is not None:
+                bundle_query = bundle_query is not None and bundle_query | bq or bq
+        before = budget_costs(staff_query, bundle_query)
+
         for var in request.vars:
             if "staff" in var:
                 if "qty" in var:
@@ -1472,8 +1582,10 @@ def budget_update_items():
                     bundle = var[7:]
                     query = (tables[1].budget_id == budget) & (tables[1].bundle_id == bundle)
                     db(query).delete()
-        # Update the Total values
-        budget_totals(budget)
+        # Update the Total values by the change of the lines
+        after = budget_costs(staff_query, bundle_query)
+        budget_totals_add(budget, [after[0] - before[0],
+                                   after[1] - before[1]])
         # Audit
         s3_audit("update", module, "staff_bundle", record=budget, representation="html")
         session.flash = T("Budget updated")
@@ -113,6 +113,7 @@ def one_of(options):
     return validator
 
 aggregation_names = ("Maximum", "Minimum", "Average")
+statistic_names = ClimateDataPortal.range_statistics.keys()
 
 def climate_overlay_data():
     kwargs = dict(request.vars)
@@ -122,7 +123,7 @@ def climate_overlay_data():
     errors = []
     for kwarg_name, converter in dict(
         data_type = one_of(sample_type_names),
-        statistic = one_of(aggregation_names),
+        statistic = one_of(statistic_names),
         parameter = one_of(variable_names),
         from_date = convert_date(default_month = 1),
         to_date = convert_date(default_month = 12),
@@ -145,6 +146,7 @@ def climate_overlay_data():
         raise HTTP(500, "<br />".join(errors))
     else:
         import gluon.contenttype
+        response.headers["Content-Type"] = gluon.contenttype.contenttype(".json")
         data_path = map_plugin.get_overlay_data(
             env = Storage(globals()),
             **arguments
@@ -63,7 +63,8 @@ _table_user.language.represent = lambda opt: s3_languages.get(opt, UNKNOWN_OPT)
 org_widget = IS_ONE_OF(db, "org_organisation.id",
                        organisation_represent,
                        orderby="org_organisation.name",
-                       sort=True)
+                       sort=True,
+                       label_fields=["name", "acronym"])
 if deployment_settings.get_auth_registration_organisation_mandatory():
     _table_user.organisation_id.requires = org_widget
 else:
@@ -1262,6 +1262,56 @@ def track():
 
     return s3_rest_controller(module, resourcename)
 
+# -----------------------------------------------------------------------------
+def track_history():
+
+    """
+        Track history of a trackable record as GPX, downsampled on the
+        server - to be used as URL for a GPX layer
+
+        URL args: tablename, record ID
+        URL vars: start, end (ISO format), points (target number of points)
+    """
+
+    import datetime
+
+    try:
+        tablename, record_id = request.args[:2]
+        record_id = int(record_id)
+    except ValueError:
+        raise HTTP(400, "Invalid trackable")
+
+    s3mgr.load(tablename)
+    if tablename not in db:
+        raise HTTP(404, "Invalid trackable")
+    table = db[tablename]
+    if not auth.s3_has_permission("read", table, record_id=record_id):
+        auth.permission.fail()
+
+    tfmt = s3mgr.xml.ISOFORMAT
+    window = {}
+    for name in ("start", "end"):
+        value = request.get_vars.get(name, None)
+        if value:
+            try:
+                window[name] = datetime.datetime.strptime(value, tfmt)
+            except ValueError:
+                raise HTTP(400, "Invalid %s" % name)
+    points = request.get_vars.get("points", None)
+    if points:
+        try:
+            points = int(points)
+        except ValueError:
+            raise HTTP(400, "Invalid points")
+    else:
+        points = None
+
+    trackable = s3base.S3Tracker()(table, record_id)
+    gpx = trackable.get_track_gpx(points=points, **window)
+
+    response.headers["Content-Type"] = "application/gpx+xml"
+    return gpx
+
 
 # =============================================================================
 # Common CRUD strings for all layers
@@ -275,13 +275,11 @@ def req_items_for_inv(site_id, quantity_type):
     # duplicate req_item, using the first record according to the orderby
     # req_items = req_items.as_dict( key = "req_req_item.item_id") <- doensn't work
     # @todo: web2py Rows.as_dict function could be extended to enable this functionality instead
-    req_item_ids = []
     unique_req_items = Storage()
     for req_item in req_items:
-        if req_item.item_id not in req_item_ids:
+        if req_item.item_id not in unique_req_items:
             # This item is not already in the dict
             unique_req_items[req_item.item_id] = Storage( req_item.as_dict() )
-            req_item_ids.append(req_item.item_id)
 
     return unique_req_items
 
@@ -291,8 +289,11 @@ def req_item_in_shipment( shipment_item,
                           req_items,
                          ):
     """
-        Checks if a shipment item is in a request and updates req_item
-        and the shipment.
+        Checks if a shipment item is in a request and adds its quantity
+        to the req_item in req_items - the changes are written to the
+        database by req_items_update()
+
+        @returns: tuple (req_id, req_item_id, shipment_item_id)
     """
 
     shipment_item_table = "inv_%s_item" % shipment_type
@@ -318,16 +319,71 @@ def req_item_in_shipment( shipment_item,
                     req_item.pack_quantity) * \
                     shipment_item[shipment_item_table].quantity
         quantity = min(quantity, req_item.quantity)  #Cap at req. quantity
-        db.req_req_item[req_item_id] = {quantity_req_type: quantity}
-
-        # Link the shipment_item to the req_item
-        db[shipment_item_table][shipment_item[shipment_item_table].id] = \
-            dict(req_item_id = req_item_id)
+        req_item[quantity_req_type] = quantity
 
-        # Flag req record to update status_fulfil
-        return req_item.req_id, req_item.id
+        # Flag req record to update status_fulfil, and the shipment_item
+        # to link to the req_item
+        return req_item.req_id, req_item.id, shipment_item[shipment_item_table].id
     else:
-        return None, None
+        return None, None, None
+
+# -----------------------------------------------------------------------------
+def req_items_update(shipment_type, req_items, update_req_id):
+    """
+        Writes the req_item quantities and the links of the shipment items
+        collected by req_item_in_shipment() with one UPDATE per distinct
+        value, and updates the status of each affected request once.
+        Everything happens in the transaction of the current request.
+
+        @param shipment_type: "recv" or "send"
+        @param req_items: the req_items as returned by req_items_for_inv()
+        @param update_req_id: list of (req_id, req_item_id, shipment_item_id)
+    """
+
+    shipment_to_req_type = dict(recv = "fulfil",
+                                send = "transit")
+    quantity_req_type = "quantity_%s" % shipment_to_req_type[shipment_type]
+
+    links = {}
+    reqs = {}
+    for req_id, req_item_id, shipment_item_id in update_req_id:
+        if req_id:
+            links.setdefault(req_item_id, []).append(shipment_item_id)
+            reqs[req_id] = req_item_id
+    if not reqs:
+        return
+
+    # Update the req quantities
+    quantities = {}
+    for req_item in req_items.values():
+        if req_item.id in links:
+            quantity = req_item[quantity_req_type]
+            quantities.setdefault(quantity, []).append(req_item.id)
+    table = db.req_req_item
+    for quantity, req_item_ids in quantities.items():
+        db(table.id.belongs(req_item_ids)).update(**{quantity_req_type: quantity})
+
+    # Link the shipment_items to the req_items
+    table = db["inv_%s_item" % shipment_type]
+    for req_item_id, shipment_item_ids in links.items():
+        db(table.id.belongs(shipment_item_ids)).update(req_item_id = req_item_id)
+
+    # Update status_fulfil of the req record(s)
+    req_status_update(reqs)
+
+# -----------------------------------------------------------------------------
+def req_status_update(reqs):
+    """
+        Updates the status of requests, once per request
+
+        @param reqs: dict {req_id: req_item_id} (any item of the request)
+    """
+
+    for req_id, req_item_id in reqs.items():
+        if req_id:
+            s3mgr.store_session("req", "req", req_id)
+            s3mgr.store_session("req", "req_item", req_item_id)
+            req_item_onaccept(None)
 
 
 # -----------------------------------------------------------------------------
@@ -412,12 +468,8 @@ def recv_process():
                                  owned_by_user = None,
                                  owned_by_role = ADMIN )
 
-    # Update status_fulfil of the req record(s)
-    for req_id, req_item_id in update_req_id:
-        if req_id:
-            s3mgr.store_session("req", "req", req_id)
-            s3mgr.store_session("req", "req_item", req_item_id)
-            req_item_onaccept(None)
+    # Update the req_items & status_fulfil of the req record(s)
+    req_items_update("recv", req_items, update_req_id)
 
     session.confirmation = T("Shipment Items received by Inventory")
 
@@ -512,7 +564,8 @@ def recv_cancel():
             table = db.req_req_item
             query = (table.id == recv_item.req_item_id) & \
                     (table.deleted == False)
-            r_req_item = db(query).select(table.quantity_fulfil,
+            r_req_item = db(query).select(table.req_id,
+                                          table.quantity_fulfil,
                                           table.item_pack_id, # required by pack_quantity virtualfield
                                           limitby = (0, 1)).first()
             if r_req_item:
@@ -532,11 +585,7 @@ def recv_cancel():
                                 owned_by_role = ADMIN)
 
     # Update status_fulfil of the req record(s)
-    for req_id, req_item_id in update_req_id:
-        if req_id:
-            s3mgr.store_session("req", "req", req_id)
-            s3mgr.store_session("req", "req_item", req_item_id)
-            req_item_onaccept(None)
+    req_status_update(dict(update_req_id))
 
     session.confirmation = T("Received Shipment canceled and items removed from Inventory")
 
@@ -647,12 +696,8 @@ def send_process():
                                      )
         session.confirmation = T("Shipment Items sent from Inventory")
 
-        # Update status_fulfil of the req record(s)
-        for req_id, req_item_id in update_req_id:
-            if req_id:
-                s3mgr.store_session("req", "req", req_id)
-                s3mgr.store_session("req", "req_item", req_item_id)
-                req_item_onaccept(None)
+        # Update the req_items & status_fulfil of the req record(s)
+        req_items_update("send", req_items, update_req_id)
 
         # Go to the Site which has sent these items
         (prefix, resourcename, id) = s3mgr.model.get_instance(db.org_site,
@@ -755,7 +800,8 @@ def send_cancel():
             table = db.req_req_item
             query = (table.id == req_item_id) & \
                     (table.deleted == False)
-            r_req_item = db(query).select(table.quantity_fulfil,
+            r_req_item = db(query).select(table.req_id,
+                                          table.quantity_fulfil,
                                           table.item_pack_id, # required by pack_quantity virtualfield
                                           limitby = (0, 1)).first()
             if r_req_item:
@@ -777,11 +823,7 @@ def send_cancel():
 
     if deployment_settings.has_module("req"):
         # Update status_fulfil of the req record(s)
-        for req_id, req_item_id in update_req_id:
-            if req_id:
-                s3mgr.store_session("req", "req", req_id)
-                s3mgr.store_session("req", "req_item", req_item_id)
-                req_item_onaccept(None)
+        req_status_update(dict(update_req_id))
 
     session.confirmation = T("Sent Shipment canceled and items returned to Inventory")
 
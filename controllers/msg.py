@@ -924,20 +924,63 @@ def get_criteria(id):
 
 
 # -----------------------------------------------------------------------------
-def check_updates(user_id):
-    #Check Updates for all the Saved Searches Subscribed by the User
+def check_updates(user_id, results=None):
+    """
+        Check Updates for all the Saved Searches Subscribed by the User
+
+        @param user_id: the user ID
+        @param results: dict of the search results evaluated so far in
+                        this batch, see search_updates()
+    """
+
+    s3mgr.load("pr_save_search")
+    table = db.pr_save_search
+    query = (table.user_id == user_id) & \
+            (table.subscribed == True)
+    rows = db(query).select(table.id,
+                            table.search_vars,
+                            table.modified_on)
+    return search_updates(rows, results)
+
+
+# -----------------------------------------------------------------------------
+def search_updates(rows, results=None):
+    """
+        Get the updates for subscribed Saved Searches and move their
+        high-water mark (modified_on) to the start of this check
+
+        Each saved search only looks at the records modified since its
+        high-water mark. Identical searches with the same mark (e.g. of
+        different users) are evaluated only once per batch.
+
+        @param rows: the pr_save_search rows (id, search_vars, modified_on)
+        @param results: dict of the search results evaluated so far in
+                        this batch, keyed by (search_vars, modified_on)
+        @returns: the message, or None if there are no updates
+    """
+
+    if results is None:
+        results = {}
+
     message = "<h2>Saved Searches' Update</h2>"
     flag = 0
-    s3mgr.load("pr_save_search")
-    rows = db(db.pr_save_search.user_id == user_id).select(db.pr_save_search.ALL)
-    for row in rows :
-        if row.subscribed:
+    for row in rows:
+        key = (row.search_vars, row.modified_on)
+        if key not in results:
             records = load_search(row.id)
-            #message = message + "<b>" + get_criteria(row.id) + "</b>"
-            if str(records["items"]) != "No Matching Records":
-                message = message + str(records["items"]) + "<br />" #Include the Saved Search details
-                flag = 1                
-            db.pr_save_search[row.id] = dict(modified_on = request.utcnow)
+            results[key] = str(records["items"])
+        items = results[key]
+        #message = message + "<b>" + get_criteria(row.id) + "</b>"
+        if items != "No Matching Records":
+            message = message + items + "<br />" #Include the Saved Search details
+            flag = 1
+
+    # Records modified while checking are newer than request.utcnow,
+    # so they will be found next time
+    ids = [row.id for row in rows]
+    if ids:
+        db(db.pr_save_search.id.belongs(ids)).update(modified_on = request.utcnow)
+
     if flag == 0:
         return
     else:
@@ -946,35 +989,60 @@ def check_updates(user_id):
 
 # -----------------------------------------------------------------------------
 def subscription_messages():
-    
-    subs = None
-    if request.args[0] == "daily":
-        subs = db(db.msg_subscription.subscription_frequency == "daily").select(
-                                                                                db.msg_subscription.ALL)
-    if request.args[0] == "weekly":
-        subs = db(db.msg_subscription.subscription_frequency=="weekly").select(
-                                                                               db.msg_subscription.ALL)
-    if request.args[0] == "monthly":
-        subs = db(db.msg_subscription.subscription_frequency=="monthly").select(
-                                                                                db.msg_subscription.ALL)
-    if subs:    
-        for sub in subs:
-            #check if the message is not empty
-            message = check_updates(sub.user_id)
-            if message == None:
-                return
-            person_id = auth.s3_user_to_person(sub.user_id)
-            rows = db(db.pr_person.id == person_id).select(db.pr_person.ALL)
-            for row in rows:
-                pe_id = row.pe_id
-                break
-            msg.send_by_pe_id(pe_id,
-                              subject="Subscription Updates",
-                              message=message,
-                              sender_pe_id = None,
-                              pr_message_method = "EMAIL",
-                              sender="noreply@sahana.com",
-                              fromaddress="sahana@sahana.com")
+    """
+        Send the updates of the subscribed Saved Searches to all users
+        with the subscription frequency in request.args[0], in one batch
+    """
+
+    frequency = request.args(0)
+    if frequency not in ("daily", "weekly", "monthly"):
+        return
+
+    stable = db.msg_subscription
+    subs = db(stable.subscription_frequency == frequency).select(stable.user_id)
+    user_ids = set([sub.user_id for sub in subs])
+    if not user_ids:
+        return
+
+    # Load the subscribed searches of all users at once
+    s3mgr.load("pr_save_search")
+    table = db.pr_save_search
+    query = (table.user_id.belongs(user_ids)) & \
+            (table.subscribed == True)
+    rows = db(query).select(table.id,
+                            table.user_id,
+                            table.search_vars,
+                            table.modified_on)
+    searches = {}
+    for row in rows:
+        searches.setdefault(row.user_id, []).append(row)
+    if not searches:
+        return
+
+    # Look up the pe_ids of all users at once
+    utable = auth.settings.table_user
+    ptable = db.pr_person
+    query = (utable.id.belongs(searches.keys())) & \
+            (utable.person_uuid == ptable.uuid)
+    persons = db(query).select(utable.id, ptable.pe_id)
+    pe_ids = dict([(row[utable.id], row[ptable.pe_id]) for row in persons])
+
+    results = {}
+    for user_id in searches:
+        #check if the message is not empty
+        message = search_updates(searches[user_id], results)
+        if message is None:
+            continue
+        pe_id = pe_ids.get(user_id, None)
+        if pe_id is None:
+            continue
+        msg.send_by_pe_id(pe_id,
+                          subject="Subscription Updates",
+                          message=message,
+                          sender_pe_id = None,
+                          pr_message_method = "EMAIL",
+                          sender="noreply@sahana.com",
+                          fromaddress="sahana@sahana.com")
     return
 
 
@@ -1,27 +1,16 @@
-
 # notes:
 
 # dependencies:
-# R
+# R (rpy2) or matplotlib, for charts
 
-# create folder for cache:
-# mkdir -p /tmp/climate_data_portal/images/recent/
-# mkdir -p /tmp/climate_data_portal/images/older/
+# generated files are cached in this folder (created if missing):
+# /tmp/climate_data_portal/images/
 
 MAX_CACHE_FOLDER_SIZE = 2**24 # 16 MiB
 
-class TwoStageCache(object):
-    def __init__(self, folder, max_size):
-        self.folder = folder
-        self.max_size
-    
-    def purge(self):
-        pass
-    
-    def retrieve(self, file_name, generate_if_not_found):
-        pass
-
-import os, errno
+import os, errno, threading
+from os.path import join, getsize
+from tempfile import mkstemp
 
 def mkdir_p(path):
     try:
@@ -31,91 +20,219 @@ def mkdir_p(path):
             pass
         else: raise
 
-def define(env, place, tables, date_to_month_number, sample_codes, exports):
-    # This starts an R interpreter.
-    # As we are sharing it (restarting it every time is inefficient), 
-    # we have to be somewhat careful to make sure objects are garbage collected
-    # better to just not stick anything in R's globals 
-    try:
-        import rpy2.robjects as robjects
-    except ImportError:
-        import logging
-        logging.getLogger().error(
-"""R is required by the climate data portal to generate charts
+class FileCache(object):
+    """
+    Cache of generated files, bounded by their total size.
+    
+    Least recently used files (by modification time, which is updated
+    on every hit) are evicted once the folder exceeds max_size.
+    Files are generated into a temporary file and renamed into place,
+    so a partially written file is never served, and only one thread
+    generates any given file at a time.
+    """
+    # fraction of max_size to purge down to, to avoid purging every write
+    LOW_WATER_MARK = 0.75
+    TEMPORARY_SUFFIX = ".tmp"
 
-To install R: refer to:
-http://cran.r-project.org/doc/manuals/R-admin.html
+    def __init__(self, folder, max_size):
+        self.folder = folder
+        self.max_size = max_size
+        mkdir_p(folder)
+        self.lock = threading.Lock()
+        # file_name: [lock, number of users]
+        self.file_locks = {}
+        self.size = None # unknown until the folder is scanned
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
+    @staticmethod
+    def key(*parameters):
+        """
+        Cache key for the parameters of a request, which should 
+        include a version of the data the file is generated from.
+        """
+        import json
+        from hashlib import md5
+        return md5(
+            json.dumps(parameters, sort_keys=True, default=str)
+        ).hexdigest()
 
-rpy2 is required to interact with python.
+    def retrieve(self, file_name, generate):
+        """
+        Path of the cached file, calling generate(file_path) 
+        to create it if it is not in the cache.
+        """
+        file_path = join(self.folder, file_name)
+        if self._touch(file_path):
+            self.hits += 1
+            return file_path
+        file_lock = self._acquire(file_name)
+        try:
+            # may have been generated while waiting for the lock
+            if self._touch(file_path):
+                self.hits += 1
+                return file_path
+            self.misses += 1
+            handle, temporary_path = mkstemp(
+                dir = self.folder,
+                suffix = self.TEMPORARY_SUFFIX
+            )
+            os.close(handle)
+            try:
+                generate(temporary_path)
+                try:
+                    os.rename(temporary_path, file_path)
+                except OSError:
+                    # Windows can't rename over an existing file
+                    os.remove(file_path)
+                    os.rename(temporary_path, file_path)
+            except:
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+                raise
+            self._add(getsize(file_path))
+        finally:
+            self._release(file_name, file_lock)
+        return file_path
 
-To install rpy2, refer to:
-http://rpy.sourceforge.net/rpy2/doc-dev/html/overview.html
-""")
-        raise
+    def purge(self, max_size = None):
+        """
+        Evict least recently used files until the folder size is 
+        under max_size (default: the low water mark).
+        """
+        if max_size is None:
+            max_size = int(self.max_size * self.LOW_WATER_MARK)
+        self.lock.acquire()
+        try:
+            files = []
+            size = 0
+            for file_name in os.listdir(self.folder):
+                if file_name.endswith(self.TEMPORARY_SUFFIX):
+                    continue
+                file_path = join(self.folder, file_name)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, file_path))
+                size += stat.st_size
+            files.sort()
+            for modified, file_size, file_path in files:
+                if size <= max_size:
+                    break
+                try:
+                    os.remove(file_path)
+                except OSError:
+                    continue
+                size -= file_size
+                self.evictions += 1
+            self.size = size
+        finally:
+            self.lock.release()
 
-    R = robjects.r
-    
-    from rpy2.robjects.packages import importr
+    def statistics(self):
+        return dict(
+            hits = self.hits,
+            misses = self.misses,
+            evictions = self.evictions,
+            size = self.size,
+            max_size = self.max_size,
+        )
 
-    base = importr("base")
-    
-    from math import fsum
-    def average(values):
-        "Safe float average"
-        l = len(values)
-        if l is 0:
-            return None
+    def _touch(self, file_path):
+        "Mark a cached file as recently used, False if it isn't cached"
+        try:
+            os.utime(file_path, None)
+        except OSError:
+            return False
         else:
-            return fsum(values)/l
-    
-    def Aggregation(name, SQL_function_name, field_type_name = None):
-        def __init__(self, column, add_query_term):
-            db = column.db
-            if field_type_name is None:
-                field_type_name = column.type
-            self.aggregation = aggregation = Expression(
-                db,
-                db._adapter.AGGREGATE,
-                column,
-                SQL_function_name,
-                field_type_name
-            )
-            add_query_term(aggregation)
-    
-        return type(
-            name,
-            (object,),
-            dict(
-                __init__ = __init__,
-                __call__ = lambda self, row: (
-                    return row._extra[self.aggregation]
-                )
-            )
+            return True
+
+    def _add(self, file_size):
+        self.lock.acquire()
+        try:
+            if self.size is not None:
+                self.size += file_size
+            size = self.size
+        finally:
+            self.lock.release()
+        if size is None or size > self.max_size:
+            # purge also scans the folder if its size is unknown
+            self.purge()
+
+    def _acquire(self, file_name):
+        self.lock.acquire()
+        try:
+            file_lock = self.file_locks.get(file_name)
+            if file_lock is None:
+                file_lock = self.file_locks[file_name] = [threading.Lock(), 0]
+            file_lock[1] += 1
+        finally:
+            self.lock.release()
+        file_lock[0].acquire()
+        return file_lock
+
+    def _release(self, file_name, file_lock):
+        file_lock[0].release()
+        self.lock.acquire()
+        try:
+            file_lock[1] -= 1
+            if not file_lock[1]:
+                del self.file_locks[file_name]
+        finally:
+            self.lock.release()
+
+from ..rworkers import render
+
+def define(
+    env,
+    place,
+    tables,
+    aggregate_tables,
+    date_to_month_number,
+    sample_codes,
+    exports
+):
+    from math import sqrt
+
+    # Range statistics, calculated from the monthly pre-aggregates:
+    # readings count, total, total of squares, minimum, maximum
+    def Maximum(count, total, total_squares, minimum, maximum):
+        return maximum
+
+    def Minimum(count, total, total_squares, minimum, maximum):
+        return minimum
+
+    def Average(count, total, total_squares, minimum, maximum):
+        if not count:
+            return None
+        return total / count
+
+    def Variance(count, total, total_squares, minimum, maximum):
+        "Sample variance"
+        if count < 2:
+            return None
+        # rounding can make this slightly negative for constant values
+        return max(
+            0.0,
+            (total_squares - (total * total) / count) / (count - 1)
         )
-    
-    Maximum = Aggregation("MAX")
-    Minimum = Aggregation("MIN")
-#    Sum = Aggregation("SUM")
-#    Count = Aggregation("COUNT", "integer")
-    Average = Aggregation("AVG")
-    StandardDeviation = Aggregation("STDEV")
 
-    class CoefficientOfVariation(object):
-        def __init__(self, column, add_query_term):
-            self.average = average = Average(
-                column,
-                add_query_term
-            )
-            self.standard_deviation = standard_deviation = StandardDeviation(
-                column,
-                add_query_term
-            )
-            
-        def __call__(self, row):
-            return self.standard_deviation(row) / self.average(row)
+    def StandardDeviation(*aggregates):
+        variance = Variance(*aggregates)
+        if variance is None:
+            return None
+        return sqrt(variance)
 
-    aggregators = {
+    def CoefficientOfVariation(*aggregates):
+        standard_deviation = StandardDeviation(*aggregates)
+        average = Average(*aggregates)
+        if standard_deviation is None or not average:
+            return None
+        return standard_deviation / average
+
+    range_statistics = {
         "Maximum": Maximum,
         "Minimum": Minimum,
         "Average": Average,
@@ -123,47 +240,16 @@ http://rpy.sourceforge.net/rpy2/doc-dev/html/overview.html
         "Coefficient Of Variation": CoefficientOfVariation,
     }
 
-    def get_cached_or_generated_file(cache_file_name, generate):
-        from os.path import join, exists
-        from os import stat, makedirs
-        # this needs to become a setting
-        climate_data_image_cache_path = join(
-            "/tmp","climate_data_portal","images"
-        )
-        recent_cache = join(climate_data_image_cache_path, "recent")
-        mkdir_p(recent_cache)
-        older_cache = join(climate_data_image_cache_path, "older")
-        mkdir_p(older_cache)
-        recent_cache_path = join(recent_cache, cache_file_name)
-        if not exists(recent_cache_path):
-            older_cache_path = join(older_cache, cache_file_name)
-            if exists(older_cache_path):
-                # move the older cache to the recent folder
-                rename(older_cache_path, recent_cache_path)
-            else:
-                generate(recent_cache_path)
-            file_path = recent_cache_path
-                
-            # update the folder size file (race condition?)
-            folder_size_file_path = join(climate_data_image_cache_path, "size")
-            folder_size_file = open(folder_size_file_path, "w+")
-            folder_size_file_contents = folder_size_file.read()
-            try:
-                folder_size = int(folder_size_file_contents)
-            except ValueError:
-                folder_size = 0
-            folder_size_file.seek(0)
-            folder_size_file.truncate()
-            folder_size += stat(file_path).st_size
-            if folder_size > MAX_CACHE_FOLDER_SIZE:
-                rmdir(older_cache)
+    # this needs to become a setting
+    file_cache = FileCache(
+        join("/tmp", "climate_data_portal", "images"),
+        MAX_CACHE_FOLDER_SIZE
+    )
 
-            folder_size_file.write(str(folder_size))
-            folder_size_file.close()
-        else:
-            # use the existing cached image
-            file_path = recent_cache_path
-        return file_path
+    def data_version(db, table):
+        "Changes whenever readings are (re)imported into the table"
+        maximum = table.id.max()
+        return db().select(maximum).first()[maximum]
 
     class MapPlugin(object):
         def __init__(
@@ -227,111 +313,82 @@ http://rpy.sourceforge.net/rpy2/doc-dev/html/overview.html
             from_month = date_to_month_number(from_date)
             to_month = date_to_month_number(to_date)
             def generate_map_overlay_data(file_path):
-                # generate the new file in the recent folder
-                
                 db = env.db
                 sample_table_name, sample_table = tables[parameter]
+                aggregate_table = aggregate_tables[sample_table_name]
                 place = db.place
-                #sample_table = db[sample_table_name]
+                calculate = range_statistics[statistic]
                 
-                query = [
-                    place.id,
-                    place.longitude,
-                    place.latitude,
-                ]
-                aggregator = aggregators[statistic](
-                    sample_table.value,
-                    query.append
+                # combine the monthly pre-aggregates over the range,
+                # rather than scanning the raw readings
+                aggregates = (
+                    aggregate_table.readings.sum(),
+                    aggregate_table.total.sum(),
+                    aggregate_table.total_squares.sum(),
+                    aggregate_table.minimum.min(),
+                    aggregate_table.maximum.max(),
                 )
-                
                 sample_rows = db(
-                    (sample_table.time_period >= from_month) &
-                    (sample_table.time_period <= to_month) & 
-                    (sample_table.sample_type == sample_codes[data_type]) & 
-                    (place.id == sample_table.place_id)
+                    (aggregate_table.time_period >= from_month) &
+                    (aggregate_table.time_period <= to_month) & 
+                    (aggregate_table.sample_type == sample_codes[data_type]) & 
+                    (place.id == aggregate_table.place_id)
                 ).select(
-                    *query,
-                    groupby=sample_table.place_id
+                    place.id,
+                    place.latitude,
+                    place.longitude,
+                    *aggregates,
+                    groupby = (place.id, place.latitude, place.longitude)
                 )
                 
-                # map positions to data
-                # find max and min value
-                positions = {}
+                places = []
                 aggregated_values = []
                 for row in sample_rows:
-                    place = row.place
-                    aggregated_value = aggregator(row)
+                    aggregated_value = calculate(
+                        *[row[aggregate] for aggregate in aggregates]
+                    )
+                    if aggregated_value is None:
+                        continue
                     aggregated_values.append(aggregated_value)
-                    positions[place.id] = (
-                        place.latitude,
-                        place.longitude,
+                    place_row = row.place
+                    places.append((
+                        place_row.id,
+                        place_row.latitude,
+                        place_row.longitude,
                         aggregated_value
-                    )
-                # these will be associated with the actual table
-                max_aggregated_value = max(aggregated_values)
-                min_aggregated_value = min(aggregated_values)
-                aggregated_range = max_aggregated_value - min_aggregated_value
+                    ))
                 
-                data_lines = []
-                write = data_lines.append
-                from colorsys import hsv_to_rgb
-                for id, (lat, lon, aggregated_value) in positions.iteritems():
-                    north = lat + 0.05
-                    south = lat - 0.05
-                    east = lon + 0.05
-                    west = lon - 0.05
-                    # only hue changes
-                    # hue range is from 2/3 (blue, low) to 0 (red, high) 
-                    normalised_value = 1.0-((aggregated_value - min_aggregated_value) / aggregated_range)
-                    r,g,b = hsv_to_rgb(normalised_value *(2.0/3.0), 1.0, 1.0)
-                    hex_colour = "%02x%02x%02x" % (r*255, g*255, b*255)
-                    write(
-                        "Vector("
-                            "Polygon(["
-                                "LinearRing(["
-                                    "Point(%(north)f,%(west)f),"
-                                    "Point(%(north)f,%(east)f),"
-                                    "Point(%(south)f,%(east)f),"
-                                    "Point(%(south)f,%(west)f)"
-                                "])"
-                            "]),"
-                            "{"
-                                "value:%(aggregated_value)f,"
-                                "id:%(id)i"
-                            "},"
-                            "{"
-                                "fillColor:'#%(hex_colour)s'"
-                            "}"
-                        ")," % locals()
-                    )
-                overlay_data_file = open(file_path, "w")
-                write = overlay_data_file.write
-                write("{")
-                if max_aggregated_value < 10:
-                    float_format = "%0.2f"
-                if max_aggregated_value < 100:
-                    float_format = "%0.1f"
-                elif max_aggregated_value < 10000:
-                    float_format = "%0.0f"
+                if aggregated_values:
+                    max_aggregated_value = max(aggregated_values)
+                    min_aggregated_value = min(aggregated_values)
                 else:
-                    float_format = "%0.2e"
-                write("max:%s," % float_format % max_aggregated_value)
-                write("min:%s," % float_format % min_aggregated_value)
-                write("features:[")
-                write("".join(data_lines))
-                overlay_data_file.seek(-1, 1) # delete last ",'
-                write("]}")
+                    max_aggregated_value = min_aggregated_value = None
+                
+                import json
+                overlay_data_file = open(file_path, "w")
+                json.dump(
+                    dict(
+                        max = max_aggregated_value,
+                        min = min_aggregated_value,
+                        # [id, latitude, longitude, value]
+                        places = places,
+                    ),
+                    overlay_data_file,
+                    separators = (",", ":")
+                )
                 overlay_data_file.close()
                 
-            return get_cached_or_generated_file(
-                "_".join((
+            sample_table_name, sample_table = tables[parameter]
+            return file_cache.retrieve(
+                file_cache.key(
+                    "overlay",
                     statistic,
                     data_type,
                     parameter,
-                    str(from_month),
-                    str(to_month),
-                    ".js"
-                )),
+                    from_month,
+                    to_month,
+                    data_version(env.db, aggregate_tables[sample_table_name])
+                ) + ".json",
                 generate_map_overlay_data
             )
         
@@ -385,67 +442,44 @@ http://rpy.sourceforge.net/rpy2/doc-dev/html/overview.html
                     return from_date, to_date, data_type, parameter, values
 
                 time_serieses = []
-                c = R("c")
                 for spec in specs:
                     from_date, to_date, data_type, parameter, values = render_plot(**spec)
                     time_serieses.append(
-                        R("ts")(
-                            robjects.FloatVector(values),
-                            start = c(from_date.year, from_date.month),
-                            end = c(to_date.year, to_date.month),
-                            frequency = 12
-                        )
+                        ((from_date.year, from_date.month), values)
                     )
                 
-                R("png(filename = '%s', width=640, height=480)" % file_path)
-                plot_chart = R(
-                    "function (xlab, ylab, n, ...) {"
-                        "ts.plot(...,"
-                            "gpars=list(xlab=xlab, ylab=ylab, col=c(1:n))"
-                        ")"
-                    "}"
-                )
-
-                plot_chart(
-                    "Date",
-                    "Combined %s %s" % (data_type, parameter),
-                    len(time_serieses),
-                    *time_serieses
+                # rendered by a persistent R worker process
+                # (or matplotlib if R is not installed)
+                image = render(
+                    "timeSeries",
+                    time_serieses,
+                    xlab = "Date",
+                    ylab = "Combined %s %s" % (data_type, parameter),
+                    format = "png"
                 )
-                R("dev.off()")
-
-            import md5
-            import gluon.contrib.simplejson as JSON
+                chart_file = open(file_path, "wb")
+                chart_file.write(image)
+                chart_file.close()
 
-            import datetime
-            def serialiseDate(obj):
-                if isinstance(
-                    obj,
-                    (
-                        datetime.date, 
-                        datetime.datetime, 
-                        datetime.time
-                    )
-                ): 
-                    return obj.isoformat()[:19].replace("T"," ") 
-                raise TypeError("%r is not JSON serializable" % (obj,)) 
-            
-            return get_cached_or_generated_file(
-                "_".join((
-                    md5.md5(
-                        JSON.dumps(
-                            specs,
-                            sort_keys=True,
-                            default=serialiseDate
-                        )
-                    ).hexdigest(),
-                    ".png"
-                )),
+            db = env.db
+            return file_cache.retrieve(
+                file_cache.key(
+                    "chart",
+                    specs,
+                    [
+                        data_version(db, tables[parameter][1])
+                        for parameter in sorted(set(
+                            spec["parameter"] for spec in specs
+                        ))
+                    ]
+                ) + ".png",
                 generate_chart
             )
             
     exports.update(
-        MapPlugin = MapPlugin
+        MapPlugin = MapPlugin,
+        range_statistics = range_statistics,
+        file_cache = file_cache,
     )
     
     del globals()["define"]
@@ -129,6 +129,47 @@ def define_models(env):
 
         return table
 
+    def aggregate_table(name):
+        # Monthly roll-up of a sample table: one row per
+        # (place, sample type, month) with enough moments
+        # to derive any statistic over a range of months
+        table = db.define_table(
+            name,
+            Field(
+                "sample_type",
+                "string",
+                length = 1,
+                notnull=True,
+                default="-1", 
+                required=True
+            ),
+            Field(
+                "time_period",
+                "integer",
+                notnull=True,
+                default=-1000,
+                required=True
+            ),
+            Field(
+                "place_id",
+                place,
+                notnull=True,
+                required=True
+            ),
+            Field(
+                "readings",
+                "integer",
+                notnull=True,
+                default=0,
+            ),
+            Field("total", "double"),
+            Field("total_squares", "double"),
+            Field("minimum", "double"),
+            Field("maximum", "double"),
+        )
+        # Indexed on (sample_type, time_period, place_id) at 1st_run
+        return table
+
     rainfall_mm = sample_table("climate_rainfall_mm", "double")
     min_temperature_celsius = sample_table("climate_min_temperature_celsius", "double")
     max_temperature_celsius = sample_table("climate_max_temperature_celsius", "double")
@@ -138,6 +179,46 @@ def define_models(env):
         "Max Temperature C": ("climate_max_temperature_celsius", max_temperature_celsius),
         "Min Temperature C": ("climate_min_temperature_celsius", min_temperature_celsius),
     }
+
+    # keyed by sample table name
+    aggregate_tables = {}
+    for table_name, table in tables.values():
+        aggregate_tables[table_name] = aggregate_table(
+            "%s_monthly" % table_name
+        )
+
+    def update_aggregates(sample_table, sample_type = None):
+        """Rebuild the monthly roll-up of a sample table.
+        
+        Call this after importing readings, optionally restricted to
+        the sample type which has been imported.
+        """
+        aggregate_table = aggregate_tables[sample_table._tablename]
+        if sample_type is None:
+            db(aggregate_table.id > 0).delete()
+            where = ""
+        else:
+            assert sample_type in sample_types, sample_type
+            db(aggregate_table.sample_type == sample_type).delete()
+            where = "WHERE sample_type = '%s'" % sample_type
+        db.executesql(
+            """
+            INSERT INTO %(aggregate_table)s
+            (sample_type, time_period, place_id,
+             readings, total, total_squares, minimum, maximum)
+            SELECT sample_type, time_period, place_id,
+                   COUNT(value), SUM(value), SUM(value * value),
+                   MIN(value), MAX(value)
+            FROM %(sample_table)s
+            %(where)s
+            GROUP BY sample_type, time_period, place_id;
+            """ % dict(
+                aggregate_table = aggregate_table._tablename,
+                sample_table = sample_table._tablename,
+                where = where
+            )
+        )
+        db.commit()
     
     def year_month_to_month_number(year, month):
         """Time periods are integers representing months in years, 
@@ -164,6 +245,7 @@ def define_models(env):
         env,
         place,
         tables,
+        aggregate_tables,
         date_to_month_number,
         sample_codes,
         globals()
@@ -177,6 +259,8 @@ def define_models(env):
         observation_station = observation_station,
         
         tables = tables,
+        aggregate_tables = aggregate_tables,
+        update_aggregates = update_aggregates,
         
         rainfall_mm = rainfall_mm,
         max_temperature_celsius = max_temperature_celsius,
@@ -196,4 +280,8 @@ def define_models(env):
             place = place,
             observation_station = observation_station,
         )
+        env.db.update(
+            (aggregate_table._tablename, aggregate_table)
+            for aggregate_table in aggregate_tables.values()
+        )
     globals()["define_models"] = redefine_models
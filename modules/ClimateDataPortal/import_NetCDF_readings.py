@@ -1,74 +1,135 @@
-
 ClimateDataPortal = local_import("ClimateDataPortal")
 
+import numpy
 
-def get_or_create(dict, key, creator):
-    try:
-        value = dict[key]
-    except KeyError:
-        value = dict[key] = creator()
-    return value
-
-def get_or_create_record(table, query):
-    query_terms = []
-    for key, value in query.iteritems():
-        query_terms.append(getattr(table, key) == value)
-    reduced_query = reduce(
-        (lambda left, right: left & right),
-        query_terms
+# readings per multi-row INSERT
+CHUNK_SIZE = 1000
+
+# decimal places to match coordinates on: NetCDF float32 values
+# and doubles read back from the database differ in the last digits
+PLACE_PRECISION = 6
+
+def place_key(latitude, longitude):
+    return (
+        round(float(latitude), PLACE_PRECISION),
+        round(float(longitude), PLACE_PRECISION)
+    )
+
+def get_place_ids(latitudes, longitudes):
+    """
+    Map each (latitude, longitude) of the grid (as place_key) to a
+    place id, creating all missing places with one bulk insert.
+    """
+    place = ClimateDataPortal.place
+    margin = 10 ** -PLACE_PRECISION
+    grid_query = (
+        (place.latitude >= float(min(latitudes)) - margin) &
+        (place.latitude <= float(max(latitudes)) + margin) &
+        (place.longitude >= float(min(longitudes)) - margin) &
+        (place.longitude <= float(max(longitudes)) + margin)
     )
-    records = db(reduced_query).select()
-    count = len(records)
-    assert count <= 1, "Multiple records for %s" % query
-    if count == 0:
-        record = table.insert(**query)
+    def select_place_ids():
+        place_ids = {}
+        for row in db(grid_query).select(
+            place.id,
+            place.latitude,
+            place.longitude
+        ):
+            place_ids[place_key(row.latitude, row.longitude)] = row.id
+        return place_ids
+    
+    place_ids = select_place_ids()
+    missing = []
+    for latitude in latitudes:
+        for longitude in longitudes:
+            if place_key(latitude, longitude) not in place_ids:
+                missing.append(dict(
+                    latitude = float(latitude),
+                    longitude = float(longitude)
+                ))
+    if missing:
+        place.bulk_insert(missing)
         db.commit()
-    else:
-        record = records.first()
-    return record.id
+        place_ids = select_place_ids()
+    return place_ids
 
 def nearly(expected_float, actual_float):
     difference_ratio = actual_float / expected_float
     return 0.999 < abs(difference_ratio) < 1.001
 
-def add_reading_if_none(
+def insert_readings(
     database_table,
     sample_type,
     time_period,
-    place_id,
-    value
+    readings
 ):
-    records = db(
-        (database_table.sample_type == sample_type) &
-        (database_table.time_period == time_period) &
-        (database_table.place_id == place_id)
-    ).select(database_table.value, database_table.id)
-    count = len(records)
-    assert count <= 1
-    if count == 0:
-        database_table.insert(
-            sample_type = sample_type,
-            time_period = time_period,
-            place_id = place_id,
-            value = value
+    """
+    Insert readings ({place_id: value}) with multi-row INSERTs 
+    of up to CHUNK_SIZE rows.
+    """
+    readings = readings.items()
+    for start in xrange(0, len(readings), CHUNK_SIZE):
+        db.executesql(
+            "INSERT INTO %s (sample_type, time_period, place_id, value) "
+            "VALUES %s;" % (
+                database_table._tablename,
+                ",".join([
+                    "('%s',%i,%i,%r)" % (
+                        sample_type,
+                        time_period,
+                        place_id,
+                        float(value)
+                    )
+                    for place_id, value in readings[start:start+CHUNK_SIZE]
+                ])
+            )
         )
-    else:
-        existing = records.first()
-        assert nearly(existing.value, value), (existing.value, value, place_id)
+    return len(readings)
 
+def add_readings_if_none(
+    database_table,
+    sample_type,
+    time_period,
+    readings
+):
+    """
+    Only insert readings for places which have none in this time period,
+    checking that existing readings agree.
+    """
+    existing_readings = {}
+    for row in db(
+        (database_table.sample_type == sample_type) &
+        (database_table.time_period == time_period)
+    ).select(database_table.place_id, database_table.value):
+        assert row.place_id not in existing_readings
+        existing_readings[row.place_id] = row.value
+    
+    new_readings = {}
+    for place_id, value in readings.iteritems():
+        try:
+            existing_value = existing_readings[place_id]
+        except KeyError:
+            new_readings[place_id] = value
+        else:
+            assert nearly(existing_value, value), (existing_value, value, place_id)
+    return insert_readings(
+        database_table,
+        sample_type,
+        time_period,
+        new_readings
+    )
 
-def just_add_reading_without_checking_for_existing_readings(
+def just_add_readings_without_checking_for_existing_readings(
     database_table,
     sample_type,
     time_period,
-    place_id,
-    value
+    readings
 ):
-    database_table.insert(
-        sample_type = sample_type,
-        time_period = time_period,
-        place_id = place_id,
-        value = value
+    return insert_readings(
+        database_table,
+        sample_type,
+        time_period,
+        readings
     )
 
 import datetime
@@ -76,62 +137,50 @@ import datetime
 def import_climate_readings(
     netcdf_file,
     database_table,
-    add_reading,
+    add_readings,
     start_time = datetime.date(1971,1,1),
-    is_undefined = lambda x: -99.900003 < x < -99.9
+    is_undefined = lambda x: (-99.900003 < x) & (x < -99.9)
 ):
     """
     Assumptions:
-        * there are no places
-        * the data is in order of places
+        * the value variable "tt" is indexed by [time][lat][lon]
+        * is_undefined works element-wise on arrays
     """
     variables = netcdf_file.variables
     
-    # create grid of places
-    place_ids = {}
-    
-    def to_list(variable):
-        result = []
-        for i in range(len(variable)):
-            result.append(variable[i])
-        return result
-    
-    def iter_pairs(list):
-        for index in range(len(list)):
-            yield index, list[index]
+    times = numpy.asarray(variables["time"][:])
+    lat = numpy.asarray(variables["lat"][:])
+    lon = numpy.asarray(variables["lon"][:])
     
-    times = to_list(variables["time"])
-    lat = to_list(variables["lat"])
-    lon = to_list(variables["lon"])
-    for latitude in lat:
-        for longitude in lon:
-            record = get_or_create_record(
-                ClimateDataPortal.place,
-                dict(
-                    longitude = longitude,
-                    latitude = latitude
-                )
-            )
-            place_ids[(latitude, longitude)] = record
-            #print longitude, latitude, record
+    # create grid of places
+    place_ids = get_place_ids(lat, lon)
+    grid_place_ids = numpy.array([
+        [place_ids[place_key(latitude, longitude)] for longitude in lon]
+        for latitude in lat
+    ])
     
     tt = variables["tt"]
-    print "up to:", len(times)
-    for time_index, time in iter_pairs(times):
-        print time_index, "%i%%" % int((time_index*100) / len(times)) 
-        time_period = start_time+datetime.timedelta(hours=time)
-        for latitude_index, latitude in iter_pairs(lat):
-            for longitude_index, longitude in iter_pairs(lon):
-                value = tt[time_index][latitude_index][longitude_index]
-                if not is_undefined(value):
-                    add_reading(
-                        database_table = database_table,
-                        sample_type = ClimateDataPortal.Gridded,
-                        time_period = ClimateDataPortal.date_to_month_number(time_period),
-                        place_id = place_ids[(latitude, longitude)],
-                        value = value
-                    )
-    db.commit()
+    time_count = len(times)
+    print "up to:", time_count
+    for time_index in xrange(time_count):
+        time_period = start_time+datetime.timedelta(hours=float(times[time_index]))
+        values = numpy.asarray(tt[time_index])
+        defined = ~is_undefined(values)
+        count = add_readings(
+            database_table = database_table,
+            sample_type = ClimateDataPortal.Gridded,
+            time_period = ClimateDataPortal.date_to_month_number(time_period),
+            readings = dict(zip(
+                grid_place_ids[defined].tolist(),
+                values[defined].tolist()
+            ))
+        )
+        db.commit()
+        print time_index, "%i%%" % int((time_index*100) / time_count), time_period, count, "readings"
+    ClimateDataPortal.update_aggregates(
+        database_table,
+        ClimateDataPortal.Gridded
+    )
     print 
 
 import sys
@@ -139,8 +188,8 @@ import sys
 from Scientific.IO import NetCDF
 
 styles = {
-    "quickly": just_add_reading_without_checking_for_existing_readings,
-    "safely": add_reading_if_none
+    "quickly": just_add_readings_without_checking_for_existing_readings,
+    "safely": add_readings_if_none
 }
 
 def show_usage():
@@ -129,6 +129,11 @@ representing year, month, day, rainfall(mm), minimum and maximum temperature
         db.commit()
     else:
         print "No stations!"
+    for variable in variables:
+        ClimateDataPortal.update_aggregates(
+            variable.database_table,
+            ClimateDataPortal.Observed
+        )
 
 import sys
     
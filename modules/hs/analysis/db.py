@@ -67,10 +67,9 @@ def toMap (connection, polygons):
             table.addColumn (val, 'numeric')
     for pname, poly in polygons:
         insertMap = {}
-        geom = "GeomFromText ('" + poly.geometry () + "', 4326)"
         pname = str(pname)
         insertMap.update ({'Polygon': pname})
-        insertMap.update ({'the_geom': geom})
+        insertMap.update ({'the_geom': poly.geometry ()})
         for key, value in poly:
             insertMap.update ({noSpace(str(key)):value})
         table.insert (**insertMap)
@@ -53,6 +53,7 @@ SCATTER = keygen ('SCATTER')
 
 EUCLIDEAN = keygen ('EUCLIDEAN')
 TAXICAB = keygen ('TAXICAB')
+HAVERSINE = keygen ('HAVERSINE')
 
 DICT = keygen ('DICT')
 
@@ -36,14 +36,13 @@ from ...utils.dictionary import DefaultDictionary
 
 from savage.graph import ScatterPlot, DoubleScatterPlot, BarGraph, LineChart, PieChart
 
-from rpy2 import rinterface as R
-from rpy2.robjects import RFormula
-
-from uuid import uuid4
+# charts are rendered by rworkers, which falls back to matplotlib
+from ...rworkers import render
 
 from re import search
 
 def usage (fname):
+    from rpy2 import rinterface as R
     R.initr ()
     fname = R.StrSexpVector ([fname])
 
@@ -60,23 +59,18 @@ def usage (fname):
     else:
         return m.group (1)
 
-def cp (fileOrString, filename):
+def write (fileOrString, image):
     needToClose = False
     if isinstance (fileOrString, str):
         needToClose = True
-        fileOrString = open (fileOrString, 'w')
-    readingFile = open (filename, 'r')
-    fileOrString.write (readingFile.read ())
+        fileOrString = open (fileOrString, 'wb')
+    fileOrString.write (image)
     if needToClose:
         fileOrString.close ()
-    readingFile.close ()
 
 
-def multiRScatter (response, data, groups, tmpdir = '.',  params = {}):
-    R.initr ()
-    svg = R.globalEnv.get ('svg')
-    off = R.globalEnv.get ('graphics.off')
-    pairs = R.globalEnv.get ('pairs')
+def multiRScatter (response, data, groups, params = {}):
+    series = []
     for g in groups:
         dataList = []
         for key, value in data:
@@ -84,70 +78,14 @@ def multiRScatter (response, data, groups, tmpdir = '.',  params = {}):
                 dataList.append (value[g])
             except KeyError:
                 dataList.append (None)
-        R.globalEnv[str(g)] = R.FloatSexpVector (dataList)
-    f = '~' + '+'.join (map (str, groups))
-    formula = RFormula (f)
-
-    params = formatForR (params)
-
-    filename = tmpdir + '/' + str(uuid4 ().int) + '.svg'
-    svg (R.StrSexpVector([filename]), width=R.FloatSexpVector ([10.5]),
-         height=R.FloatSexpVector ([7]))
-    pairs (formula, **params)
-    off ()
-    cp (response, filename)
-
-
-def boxPlotData (response, data, tmpdir = '.', params = {}):
-    R.initr ()
-    svg = R.globalEnv.get ('svg')
-    off = R.globalEnv.get ('graphics.off')
-    boxplot = R.globalEnv.get ('boxplot')
-    vectors = []
-    for dataList in data:
-        vectors.append (R.FloatSexpVector (dataList))
-
-    params = formatForR (params)
-
-    filename = tmpdir + '/' + str(uuid4 ().int) + '.svg'
-    svg (R.StrSexpVector([filename]), width=R.FloatSexpVector ([10.5]),
-         height=R.FloatSexpVector ([7]))
-    boxplot (*vectors, **params)
-    off ()
-    cp (response, filename)
-
-
-def formatForR (params):
-    kwargs = {}
-    for key, value in params.iteritems ():
-        if not isinstance (value, list):
-            value = [value]
-
-        t = commonType (value)
-
-        if t == float:
-            v = R.FloatSexpVector (value)
-        elif t == int:
-            v = R.IntSexpVector (value)
-        elif t == bool:
-            v = R.BoolSexpVector (value)
-        elif t == str:
-            v = R.StrSexpVector (value)
-        else:
-            v = None
-        
-        kwargs.update ([(key, v)])
-    return kwargs
+        series.append ((str(g), dataList))
+    image = render ('scatterMatrix', series, format='svg', params=params)
+    write (response, image)
 
 
-def commonType (elements):
-    if len (elements) == 0:
-        raise RuntimeError ('Empty List')
-    t = type (elements[0])
-    for item in elements:
-        if t != type (item):
-            return False
-    return t
+def boxPlotData (response, data, params = {}):
+    image = render ('boxPlot', list (data), format='svg', params=params)
+    write (response, image)
 
 
 def barGraphData (responseBody, data, groups, title='Bar Graph', 
@@ -38,7 +38,7 @@ import shapelib
 import dbflib
 
 import enum
-from query import Query
+from query import Query, quoteIdentifier, quoteLiteral
 from utils import keygen
 from ..utils.dictionary import Dictionary
 from polygon import GeneralizedPolygon, SpatialPolygon, PolygonDictionary
@@ -98,7 +98,7 @@ class DatabasePointMap (PointMap):
         query.FROM ('%(geomSource)s')
         query.where = '%(geomSource)s.gid=%(id)s AND '
         query.where += 'ST_Contains(%(geomSource)s.the_geom, '
-        query.where += self.name + '.the_geom)'
+        query.where += quoteIdentifier (self.name) + '.the_geom)'
 
         spatialQuery = Query (self._connection)
         spatialQuery.SELECT ('the_geom', self.name, 'AsText')
@@ -125,7 +125,8 @@ class DatabasePolygonMap (PolygonMap):
         whereList = []
         try:
             for entry in self._subset:
-                item = self.name + '.' + self._primary + '=\'' + entry + '\''
+                item = quoteIdentifier (self.name) + '.' + quoteIdentifier (self._primary)
+                item += '=' + quoteLiteral (entry)
                 whereList.append (item)
                 query.where = ' OR '.join (whereList)
         except TypeError:
@@ -152,7 +153,7 @@ class DatabasePolygonMap (PolygonMap):
             for key, gen in self._fields:
                 self._matchQuery.SELECT (key, self.name)
             self._matchQuery.where='%(mapName)s.gid=%(fieldID)s AND ST_Equals'
-            self._matchQuery.where += '(%(mapName)s.the_geom,' + self.name
+            self._matchQuery.where += '(%(mapName)s.the_geom,' + quoteIdentifier (self.name)
             self._matchQuery.where += '.the_geom);'
             self._matchQuery.SELECT 
         self._matchQuery.setVariable ('mapName', mapName)
@@ -40,9 +40,11 @@ from utils import Vector, decode, BoundingBox
 from ..utils.dictionary import Dictionary
 from base import SpatialData, SpatialCollection
 
-from math import pow, sqrt
+from math import pow, sqrt, sin, cos, asin, radians
 from re import match
 
+import numpy
+
 
 class QuadTree (object):
     def __init__ (self):
@@ -60,6 +62,88 @@ class QuadTree (object):
         return pointList
 
 
+class KDTree (object):
+    """
+        Balanced 2-d tree, bulk-loaded from a list of points.
+
+        The points are sorted in place of an index array, alternating
+        between x and y at each level and splitting at the median, so
+        the tree is balanced however the points are ordered. Each node
+        covers a contiguous slice of the index array.
+    """
+    LEAF_SIZE = 64
+
+    def __init__ (self, points):
+        self.points = points
+        n = len (points)
+        self.x = numpy.fromiter ((p.x for p in points), float, n)
+        self.y = numpy.fromiter ((p.y for p in points), float, n)
+        self.index = numpy.arange (n)
+        # (start, end, minX, minY, maxX, maxY, left, right)
+        self.nodes = []
+        if n:
+            self._build ()
+
+    def _build (self):
+        coords = (self.x, self.y)
+        index = self.index
+        nodes = self.nodes
+        # (node position, start, end, depth)
+        stack = [(None, 0, len (index), 0)]
+        while stack:
+            parent, start, end, depth = stack.pop ()
+            segment = index[start:end]
+            x = self.x[segment]
+            y = self.y[segment]
+            node = [start, end, x.min (), y.min (), x.max (), y.max (), None, None]
+            position = len (nodes)
+            nodes.append (node)
+            if parent is not None:
+                nodes[parent[0]][parent[1]] = position
+            if end - start > self.LEAF_SIZE:
+                axis = coords[depth % 2]
+                index[start:end] = segment[numpy.argsort (axis[segment], kind='mergesort')]
+                middle = (start + end) // 2
+                stack.append (((position, 6), start, middle, depth + 1))
+                stack.append (((position, 7), middle, end, depth + 1))
+
+    def searchIndices (self, box):
+        """
+            Indices (into self.points) of the points inside a BoundingBox
+        """
+        maxX = box[0].x
+        maxY = box[0].y
+        minX = box[2].x
+        minY = box[2].y
+        found = []
+        if not self.nodes:
+            return numpy.array ([], int)
+        stack = [0]
+        while stack:
+            start, end, nMinX, nMinY, nMaxX, nMaxY, left, right = self.nodes[stack.pop ()]
+            if nMinX > maxX or nMaxX < minX or nMinY > maxY or nMaxY < minY:
+                continue
+            segment = self.index[start:end]
+            if nMinX >= minX and nMaxX <= maxX and nMinY >= minY and nMaxY <= maxY:
+                found.append (segment)
+            elif left is None:
+                x = self.x[segment]
+                y = self.y[segment]
+                found.append (segment[(x >= minX) & (x <= maxX) & (y >= minY) & (y <= maxY)])
+            else:
+                stack.append (left)
+                stack.append (right)
+        if not found:
+            return numpy.array ([], int)
+        return numpy.concatenate (found)
+
+    def search (self, box):
+        pointList = SpatialPointList ()
+        for i in self.searchIndices (box):
+            pointList.append (self.points[i])
+        return pointList
+
+
 class Treenode (object):
     def __init__ (self, point):
         self.x = point.x
@@ -170,8 +254,15 @@ class PointList (SpatialCollection):
 
  
 class SpatialPointList (PointList):
+    # rows of the distance matrix computed at once, which bounds
+    # memory use to BLOCK_SIZE * len (pointList) distances
+    BLOCK_SIZE = 256
+    # mean earth radius in km, for HAVERSINE distances of lon/lat points
+    EARTH_RADIUS = 6371.0
+
     def __init__ (self):
         PointList.__init__ (self)
+        self.distanceMode (enum.EUCLIDEAN)
 
     def vector (self):
         spatialListX = []
@@ -182,6 +273,12 @@ class SpatialPointList (PointList):
         v = Vector (spatialListX, spatialListY)
         return v
 
+    def arrays (self):
+        n = len (self)
+        x = numpy.fromiter ((p.x for p in self), float, n)
+        y = numpy.fromiter ((p.y for p in self), float, n)
+        return Vector (x, y)
+
     def sortX (self):
         self.sort (SpatialPoint.compareX)
 
@@ -190,20 +287,81 @@ class SpatialPointList (PointList):
 
     def distances (self, pointList):
         dList = []
-        for p1 in self:
-            list = []
-            for p2 in pointList:
-                dist = self.d (p1, p2)
-                list.append (dist)
-            dList.append (list)
+        for start, block in self.distanceBlocks (pointList):
+            dList.extend (block.tolist ())
         return dList
 
+    def distanceBlocks (self, pointList):
+        """
+            Distances from the points of this list to those of another
+            list, as (first row, block of distances) pairs of at most
+            BLOCK_SIZE rows each
+        """
+        v1 = self.arrays ()
+        v2 = pointList.arrays ()
+        if self.mode is enum.HAVERSINE:
+            x2 = numpy.radians (v2.x)
+            y2 = numpy.radians (v2.y)
+            cos2 = numpy.cos (y2)
+        for start in xrange (0, len (v1.x), self.BLOCK_SIZE):
+            end = start + self.BLOCK_SIZE
+            x1 = v1.x[start:end, numpy.newaxis]
+            y1 = v1.y[start:end, numpy.newaxis]
+            if self.mode is enum.HAVERSINE:
+                x1 = numpy.radians (x1)
+                y1 = numpy.radians (y1)
+                a = numpy.sin ((y2 - y1) / 2) ** 2 + \
+                    numpy.cos (y1) * cos2 * numpy.sin ((x2 - x1) / 2) ** 2
+                block = 2 * self.EARTH_RADIUS * numpy.arcsin (numpy.sqrt (numpy.minimum (a, 1.0)))
+            elif self.mode is enum.TAXICAB:
+                block = numpy.abs (x1 - v2.x) + numpy.abs (y1 - v2.y)
+            else:
+                block = numpy.hypot (x1 - v2.x, y1 - v2.y)
+            yield start, block
+
+    def nearest (self, pointList, k=1):
+        """
+            The k nearest points of another list to each point of this list
+
+            @returns: (indices, distances) arrays of shape (len (self), k),
+                      ordered by distance
+        """
+        k = min (k, len (pointList))
+        indices = numpy.empty ((len (self), k), int)
+        distances = numpy.empty ((len (self), k))
+        for start, block in self.distanceBlocks (pointList):
+            rows = numpy.arange (len (block))[:, numpy.newaxis]
+            if k < block.shape[1]:
+                nearest = numpy.argpartition (block, k - 1, axis=1)[:, :k]
+            else:
+                nearest = numpy.tile (numpy.arange (k), (len (block), 1))
+            order = numpy.argsort (block[rows, nearest], axis=1)
+            nearest = nearest[rows, order]
+            indices[start:start + len (block)] = nearest
+            distances[start:start + len (block)] = block[rows, nearest]
+        return indices, distances
+
+    def within (self, pointList, radius):
+        """
+            The points of another list within radius of each point of this list
+
+            @returns: a list with an array of indices into pointList
+                      for each point of this list
+        """
+        result = []
+        for start, block in self.distanceBlocks (pointList):
+            for row in block:
+                result.append (numpy.flatnonzero (row <= radius))
+        return result
 
     def distanceMode (self, mode):
+        self.mode = mode
         if mode == enum.EUCLIDEAN:
             self.d = SpatialPointList.euclidean
         elif mode == enum.TAXICAB:
             self.d = SpatialPointList.taxicab
+        elif mode == enum.HAVERSINE:
+            self.d = SpatialPointList.haversine
 
     @staticmethod
     def euclidean (p1, p2):
@@ -220,6 +378,16 @@ class SpatialPointList (PointList):
         y = abs (p1.y - p2.y)
         return x + y
 
+    @staticmethod
+    def haversine (p1, p2):
+        x1 = radians (p1.x)
+        y1 = radians (p1.y)
+        x2 = radians (p2.x)
+        y2 = radians (p2.y)
+        a = pow (sin ((y2 - y1) / 2), 2) + \
+            cos (y1) * cos (y2) * pow (sin ((x2 - x1) / 2), 2)
+        return 2 * SpatialPointList.EARTH_RADIUS * asin (sqrt (min (a, 1.0)))
+
 
 class GeneralizedPointList (object):
     def __init__ (self, type, *args):
@@ -36,16 +36,42 @@
 
 import enum
 
-from utils import R, Vector, BoundingBox
+from utils import Vector, BoundingBox
 from ..utils.dictionary import Dictionary
-from point import SpatialPointList, PointList, Point, QuadTree
+from point import SpatialPointList, PointList, Point, KDTree
 from query import Query
 from base import SpatialData
 from instruction import Instruction
 
 from math import sqrt, pow
 from re import findall
-from random import shuffle
+
+import numpy
+
+
+def pointInPolygon (x, y, polyX, polyY):
+    """
+        Crossing number test of arrays of points against a simple polygon,
+        vectorised over the points (one pass per polygon edge)
+
+        @returns: boolean array, True for points inside the polygon
+    """
+    inside = numpy.zeros (len (x), bool)
+    n = len (polyX)
+    j = n - 1
+    for i in xrange (n):
+        xi = polyX[i]
+        yi = polyY[i]
+        xj = polyX[j]
+        yj = polyY[j]
+        j = i
+        if yi == yj:
+            # horizontal edges are never crossed
+            continue
+        crosses = (yi > y) != (yj > y)
+        crossX = (xj - xi) * (y - yi) / (yj - yi) + xi
+        inside ^= crosses & (x < crossX)
+    return inside
 
 
 class PolygonDictionary (Dictionary):
@@ -53,10 +79,7 @@ class PolygonDictionary (Dictionary):
         Dictionary.__init__ (self)
 
     def push (self, points):
-        shuffle (points)
-        tree = QuadTree ()
-        for p in points:
-            tree.append (p)
+        tree = KDTree (points)
         for pname, poly in self:
             poly.pushPoints (tree)
 
@@ -155,7 +178,6 @@ class Polygon (SpatialData):
 
 
 class SpatialPolygon (Polygon):
-    pointInPolygon = False
     def __init__ (self, shp, data, source, geom=None):
         Polygon.__init__ (self, data, source)
         self.simplePolys = []
@@ -176,19 +198,17 @@ class SpatialPolygon (Polygon):
         minX = min (minXList)
         minY = min (minYList)
         self.bounds = BoundingBox ((maxX, maxY), (minX, minY))
-        if not SpatialPolygon.pointInPolygon:
-            R.importLibrary ('sp')
-            SpatialPolygon.pointInPolygon = True
 
     def pushPoints (self, pointTree):
         for s in self.simplePolys:
-            pList = pointTree.search (s.bounds)
-            v = pList.vector ()
+            indices = pointTree.searchIndices (s.bounds)
+            if not len (indices):
+                continue
             c = s.coordinates
-            locations = R.function ('point.in.polygon', v.x, v.y, c.x, c.y)
-            for i, val in enumerate(locations):
-                if val != 0:
-                    self.points.append (pList[i])
+            inside = pointInPolygon (pointTree.x[indices], pointTree.y[indices],
+                                     c.x, c.y)
+            for i in indices[inside]:
+                self.points.append (pointTree.points[i])
 
     def geometry (self):
         if self._geom:
@@ -207,7 +227,7 @@ class SimpleSpatialPolygon:
         for point in shp:
             xCoords.append (float(point[0]))
             yCoords.append (float(point[1]))
-        self.coordinates = Vector (xCoords, yCoords)
+        self.coordinates = Vector (numpy.array (xCoords), numpy.array (yCoords))
         maxX = max (xCoords)
         minX = min (xCoords)
         maxY = max (yCoords)
@@ -34,7 +34,7 @@
 
 
 
-from re import sub
+from re import match
 
 
 class Query:
@@ -47,17 +47,22 @@ class Query:
         self.numEntries = 0
 
     def setVariable (self, name, value):
-        value = clean (str(value))
+        """
+            Numbers are substituted as they are, strings are table
+            names and substituted as quoted identifiers
+        """
+        if isinstance (value, basestring):
+            value = quoteIdentifier (value)
+        else:
+            value = str (value)
         try:
             self._vars[name] = value
         except KeyError:
             self._vars.update ([(name, value)])
 
     def SELECT (self, column, table, func=None):
-        column = clean (column)
-        table = clean (table)
         if func != None:
-            func = clean(func)
+            checkName (func)
         flag = False
         for entry in self.selectList:
             if entry[0] == column and entry[1] == table:
@@ -66,18 +71,22 @@ class Query:
         if flag == False:
             self.selectList.append ((column, table, func))
             self.numEntries += 1    
-        self.FROM (table)
+        self.FROM (quoteIdentifier (table))
 
     def _selectEntries (self):
         list = []
         for entry in self.selectList:
-            item = entry[1] + '.' + entry[0]
+            item = quoteIdentifier (entry[1]) + '.' + quoteIdentifier (entry[0])
             if entry[2]:
                 item = entry[2] + '(' + item + ')'
             list.append (item)
         return list
 
     def FROM (self, table):
+        """
+            Add an SQL table expression (a quoted name or a
+            %(variable)s) to the FROM list
+        """
         flag = False
         for entry in self.tableList:
             if entry == table:
@@ -130,27 +139,34 @@ class QueryIterator:
 
 
 class SQLTable:
-    def __init__ (self,connection, name, pk=None):
-        name = clean (name)
+    # rows per executemany, each batch is committed
+    BATCH_SIZE = 1000
+
+    def __init__ (self,connection, name, pk=None, batchSize=None):
+        self._connection = connection
         self._cursor = connection.cursor ()
         self._name = name
         self._columns = []
+        self._rows = []
         self.columnType = {}
-        inputString = 'CREATE TABLE ' + name + '('
+        self.srid = {}
+        if batchSize is None:
+            batchSize = SQLTable.BATCH_SIZE
+        self.batchSize = batchSize
+        inputString = 'CREATE TABLE ' + quoteIdentifier (name) + '('
         if pk:
-            inputString += pk + ' SERIAL PRIMARY KEY'
+            inputString += quoteIdentifier (pk) + ' SERIAL PRIMARY KEY'
         inputString += ')'
         self._cursor.execute (inputString)
 
     def addColumn (self, columnName, type, notNull=False):
         self.columnType[columnName] = type
-        columnName = clean(columnName)
-        type = clean (type)
+        checkName (type)
         for c in self._columns:
             if c == columnName:
                 return False
-        inputString = 'ALTER TABLE ' + self._name
-        inputString += ' ADD COLUMN ' + columnName + ' ' + type
+        inputString = 'ALTER TABLE ' + quoteIdentifier (self._name)
+        inputString += ' ADD COLUMN ' + quoteIdentifier (columnName) + ' ' + type
         if notNull:
             inputString += ' NOT NULL'
         self._cursor.execute (inputString)
@@ -159,38 +175,83 @@ class SQLTable:
 
     def addGeometryColumn (self, column, srid, geomType, dim):
         self.columnType[column] ='geom'
+        self.srid[column] = srid
         args = []
-        args.append ("'" + self._name + "'")
-        args.append ("'" + clean (column) + "'")
-        args.append (srid)
-        args.append ("'" + clean(geomType) + "'")
-        args.append (dim)
+        args.append (quoteLiteral (self._name))
+        args.append (quoteLiteral (column))
+        args.append (str (int (srid)))
+        args.append (quoteLiteral (geomType))
+        args.append (str (int (dim)))
         arguments = ', '.join (args)
         inputString = 'SELECT AddGeometryColumn (' + arguments + ')'
         self._cursor.execute (inputString)
 
     def insert (self, **kwargs):
-        keyList = []
-        valueList = []
-        for key, value in kwargs.iteritems ():
-            keyList.append (clean(key))
-            if self.columnType[key] == 'varchar':
-                valueList.append ("'" + clean(value) + "'")
-            else:
-                valueList.append (str(value))
-        keyString = ', '.join (keyList)
-        valueString = ', '.join (valueList)
-        inputString = 'INSERT INTO ' + self._name + ' (' + keyString
-        inputString += ') VALUES (' + valueString + ')'
-        self._cursor.execute (inputString)
+        """
+            Queue a row for insertion, geometry columns take WKT.
+            Rows are written in batches of batchSize, call save ()
+            to write the rest.
+        """
+        self._rows.append (kwargs)
+        if len (self._rows) >= self.batchSize:
+            self.flush ()
+
+    def _placeholder (self, key):
+        if self.columnType[key] == 'geom':
+            return 'GeomFromText (%s, ' + str (self.srid[key]) + ')'
+        else:
+            return '%s'
+
+    def flush (self):
+        """
+            Write the queued rows with one parameterised executemany
+            per set of columns, and commit them
+        """
+        if not self._rows:
+            return
+        batches = {}
+        for row in self._rows:
+            keys = tuple (sorted (row.keys ()))
+            values = tuple ([row[key] for key in keys])
+            try:
+                batches[keys].append (values)
+            except KeyError:
+                batches[keys] = [values]
+        for keys, values in batches.iteritems ():
+            keyString = ', '.join ([quoteIdentifier (key) for key in keys])
+            valueString = ', '.join ([self._placeholder (key) for key in keys])
+            inputString = 'INSERT INTO ' + quoteIdentifier (self._name)
+            inputString += ' (' + keyString
+            inputString += ') VALUES (' + valueString + ')'
+            self._cursor.executemany (inputString, values)
+        self._connection.commit ()
+        self._rows = []
         
     def save (self):
-        self._cursor.execute ('COMMIT')
+        self.flush ()
+        self._connection.commit ()
         
 
-def clean (string):
-    return string
-    s = sub ('([;\'\"])',r'\\\1', string)
-    return s
+def quoteIdentifier (name):
+    """
+        Quote a table or column name, keeping its case
+    """
+    return '"' + str (name).replace ('"', '""') + '"'
+
+def quoteLiteral (string):
+    """
+        Quote a string constant, for the statements which
+        cannot take parameters
+    """
+    return "'" + str (string).replace ("'", "''") + "'"
+
+def checkName (name):
+    """
+        Function and type names cannot be quoted, only accept
+        names like AsText or varchar(20)
+    """
+    if not match (r'^[A-Za-z_][\w ]*(\([\d, ]*\))?$', name):
+        raise ValueError ('Invalid SQL name: %s' % name)
+    return name
 
 
@@ -33,7 +33,11 @@
 
 
 
-import rpy2.rinterface as r
+try:
+    import rpy2.rinterface as r
+except ImportError:
+    # R is only needed for the R based functions
+    r = None
 
 
 class R:
@@ -44,6 +48,8 @@ class R:
     @staticmethod
     def _start ():
         if not R._running:
+            if r is None:
+                raise ImportError ("rpy2 is required to call R functions")
             R._running = True
             r.initr ()
             R._execute = r.globalEnv.get
@@ -11,6 +11,8 @@ import datetime
 import time
 import errors
 import threading
+import traceback
+import Queue
 import gsmcodecs
 from devicewrapper import DeviceWrapper
 from pdusmshandler import PduSmsHandler
@@ -73,6 +75,13 @@ class GsmModem(object):
     retry_delay = 2
     max_retries = 10
     modem_lock = threading.RLock()
+
+    # when the reader thread is running: the seconds of silence
+    # after which it checks for a data prompt (and whether it
+    # should stop), and the seconds to wait for each line of
+    # a response to a command
+    read_interval = 0.05
+    response_timeout = 30
     
     
     def __init__(self, *args, **kwargs):
@@ -116,7 +125,23 @@ class GsmModem(object):
         self.multipart = {}
 
         # to store unhandled incoming messages
-        self.incoming_queue = []
+        self.incoming_queue = Queue.Queue()
+
+        # the reader thread (see start_reader) passes on the responses
+        # to commands, and the unsolicited notifications of incoming
+        # messages to the dispatcher thread
+        self.reader = None
+        self.dispatcher = None
+        self.responses = Queue.Queue()
+        self.notifications = Queue.Queue()
+
+        # when the modem will be ready for the next command
+        self.ready_time = 0
+
+        # lines received before a data prompt, which are parsed for
+        # incoming sms after the next command (not while the modem
+        # is waiting for the data, since that would need AT+CNMA)
+        self.unsolicited = []
         
         if mode.lower() == "text":
             self.smshandler = TextSmsHandler(self)
@@ -192,6 +217,8 @@ class GsmModem(object):
         """Disconnects from the modem."""
         
         self._log("Disconnecting")
+
+        self.stop_reader()
         
         # attempt to close and destroy the device
         if hasattr(self, "device") and (self.device is None):
@@ -316,7 +343,7 @@ class GsmModem(object):
 
             msg = self.smshandler.parse_incoming_message(lines[n], msg_line)
             if msg is not None:
-                self.incoming_queue.append(msg)
+                self.incoming_queue.put(msg)
 
             # jump over the CMT line, and the
             # pdu line, and continue iterating
@@ -344,10 +371,16 @@ class GsmModem(object):
                 # issue the command, and wait for the
                 # response
                 with self.modem_lock:
-                    self._write(cmd + write_term)
-                    lines = self.device.read_lines(
-                        read_term=read_term,
-                        read_timeout=read_timeout)
+                    self._wait_until_ready()
+                    if self.reader is not None:
+                        self._clear_responses()
+                        self._write(cmd + write_term)
+                        lines = self._read_responses(read_timeout)
+                    else:
+                        self._write(cmd + write_term)
+                        lines = self.device.read_lines(
+                            read_term=read_term,
+                            read_timeout=read_timeout)
                     
                 # no exception was raised, so break
                 # out of the enclosing WHILE loop
@@ -395,14 +428,255 @@ class GsmModem(object):
         # parse out any incoming sms that were bundled
         # with this data (to be fetched later by an app)
         lines = self._parse_incoming_sms(lines)
+        if self.unsolicited:
+            unsolicited, self.unsolicited = self.unsolicited, []
+            self._parse_incoming_sms(unsolicited)
 
-        # rest up for a bit (modems are
-        # slow, and get confused easily)
-        time.sleep(self.cmd_delay)
+        # give the modem a rest before the next command (modems are
+        # slow, and get confused easily), without blocking until then
+        self.ready_time = time.time() + self.cmd_delay
 
         return lines
 
 
+    def _wait_until_ready(self):
+        """Sleep until at least _GsmModem.cmd_delay_ seconds have passed
+           since the response to the previous command."""
+
+        delay = self.ready_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+    def prompt(self, cmd, read_timeout=1, write_term="\r", settle=0):
+        """Issue an AT command which answers with the "> " data prompt
+           (such as AT+CMGS), and return as soon as the prompt arrives,
+           rather than waiting for the read to time out. Raises
+           GsmReadTimeoutError (including any error response from the
+           modem) if no prompt is received within _read_timeout_.
+
+           Some modems echo the prompt FOLLOWED BY a CMS error: if
+           _settle_ is given, keep reading until the modem has been
+           silent for that many seconds, and raise GsmModemError if
+           an error arrives."""
+
+        with self.modem_lock:
+            self._wait_until_ready()
+            if self.reader is None:
+                self._write(cmd + write_term)
+                buf = self.device._read(
+                    read_term="> ",
+                    read_timeout=read_timeout)
+
+                # keep any incoming sms (+CMT) received before the
+                # prompt, for the next command to parse
+                for line in buf[:-2].split("\r\n"):
+                    if line.strip():
+                        self.unsolicited.append(line.strip())
+
+                while settle:
+                    try:
+                        line = self.device._read(read_timeout=settle)
+                    except errors.GsmReadTimeoutError:
+                        break
+                    self._raise_modem_error(line.strip())
+                    if line.strip():
+                        self.unsolicited.append(line.strip())
+                return
+
+            self._clear_responses()
+            self._write(cmd + write_term)
+            lines = []
+            while True:
+                try:
+                    line = self.responses.get(timeout=read_timeout)
+                except Queue.Empty:
+                    raise(errors.GsmReadTimeoutError(lines))
+                if line == ">":
+                    break
+                lines.append(line)
+
+            while settle:
+                try:
+                    line = self.responses.get(timeout=settle)
+                except Queue.Empty:
+                    break
+                self._raise_modem_error(line)
+
+
+    def _raise_modem_error(self, line):
+        """Raise GsmModemError if _line_ is an error response."""
+
+        m = re.match(r"^\+(CM[ES]) ERROR: (\d+)$", line)
+        if m is not None:
+            type, code = m.groups()
+            raise(errors.GsmModemError(type, int(code)))
+
+        if line == "ERROR":
+            raise(errors.GsmModemError)
+
+
+    def start_reader(self):
+        """Starts a thread which does all the reading from the modem, so
+           that incoming messages are received as soon as the modem
+           notifies them (+CMT or +CMTI), rather than when the modem is
+           next polled. Responses to commands are passed on to the thread
+           which issued the command. Incoming messages can then be waited
+           for with next_message(ping=False, fetch=False, timeout=...)."""
+
+        with self.modem_lock:
+            if self.reader is not None:
+                return
+
+            self.reader_stop = threading.Event()
+            self.reader = threading.Thread(
+                target=self._reader_loop,
+                name="pygsm-reader")
+            self.dispatcher = threading.Thread(
+                target=self._dispatcher_loop,
+                name="pygsm-dispatcher")
+            for thread in (self.reader, self.dispatcher):
+                thread.setDaemon(True)
+                thread.start()
+
+
+    def stop_reader(self):
+        """Stops the reader thread started by start_reader, if any."""
+
+        with self.modem_lock:
+            if self.reader is None:
+                return
+            self.reader_stop.set()
+            self.reader.join()
+            self.reader = None
+
+        # the dispatcher might be waiting for the lock to issue a command
+        self.notifications.put(None)
+        self.dispatcher.join()
+        self.dispatcher = None
+
+
+    def _reader_loop(self):
+        """Main loop of the reader thread: reads lines from the device,
+           and sorts them into notifications of incoming messages and
+           responses to commands."""
+
+        partial = ""
+        header = None
+        while not self.reader_stop.isSet():
+            try:
+                line = partial + self.device._read(
+                    read_timeout=self.read_interval)
+                partial = ""
+
+            # nothing (or an incomplete line) was received. the data
+            # prompt is the only thing which doesn't end with a newline
+            except errors.GsmReadTimeoutError, err:
+                partial += "".join(err.pending_data)
+                if partial.strip() == ">":
+                    self.responses.put(">")
+                    partial = ""
+                continue
+
+            # the device was closed or went away
+            except Exception, err:
+                self._log("Reader stopped: %s" % err, "error")
+                break
+
+            # skip the blank lines around responses, like command()
+            line = line.strip()
+            if not line:
+                continue
+
+            # the line after a +CMT header is the message itself
+            if header is not None:
+                self.notifications.put((header, line))
+                header = None
+
+            elif line[0:5] == "+CMT:":
+                header = line
+
+            # a message was stored, at the index given
+            elif line[0:6] == "+CMTI:":
+                self.notifications.put((line, None))
+
+            else:
+                self.responses.put(line)
+
+
+    def _dispatcher_loop(self):
+        """Main loop of the dispatcher thread: handles the notifications
+           of incoming messages passed on by the reader thread, which
+           needs to issue commands to the modem."""
+
+        while True:
+            notification = self.notifications.get()
+            if notification is None:
+                break
+
+            header, line = notification
+            try:
+                # a message was stored - fetch all the unread ones
+                if line is None:
+                    self._fetch_stored_messages()
+                    continue
+
+                # notify the network that we accepted the incoming
+                # message BEFORE pushing it to the incoming queue
+                # (see _parse_incoming_sms)
+                try:
+                    self.command("AT+CNMA")
+                except errors.GsmError:
+                    pass
+
+                msg = self.smshandler.parse_incoming_message(header, line)
+                if msg is not None:
+                    self.incoming_queue.put(msg)
+
+            # pyGSM is meant to be embedded, so don't
+            # let the dispatcher die on a bad message
+            except Exception:
+                self._log(traceback.format_exc(), "error")
+
+
+    def _clear_responses(self):
+        """Drops any stray lines received before a command is issued."""
+
+        while True:
+            try:
+                self.responses.get_nowait()
+            except Queue.Empty:
+                return
+
+
+    def _read_responses(self, read_timeout=None):
+        """Reads the lines of a response received by the reader thread
+           until a response terminator is hit, like DeviceWrapper.read_lines.
+           _read_timeout_ is the number of seconds to wait for each line."""
+
+        if read_timeout is None:
+            read_timeout = self.response_timeout
+
+        lines = []
+        while True:
+            try:
+                line = self.responses.get(timeout=read_timeout)
+            except Queue.Empty:
+                raise(errors.GsmReadTimeoutError(lines))
+            lines.append(line)
+
+            if line == "OK":
+                return lines
+
+            m = re.match(r"^\+(CM[ES]) ERROR: (\d+)$", line)
+            if m is not None:
+                type, code = m.groups()
+                raise(errors.GsmModemError(type, int(code)))
+
+            if line == "ERROR":
+                raise(errors.GsmModemError)
+
+
     def query(self, cmd, prefix=None):
         """Issues a single AT command to the modem, and returns the relevant
            part of the response. This only works for commands that return a
@@ -447,7 +721,33 @@ class GsmModem(object):
 
         """
         with self.modem_lock:
-            self.smshandler.send_sms(recipient, text)
+            return self.smshandler.send_sms(recipient, text)
+
+    def send_sms_batch(self, messages):
+        """
+        Sends a batch of SMSs, given as a list of (recipient, text)
+        tuples, holding the modem for the whole batch so that the
+        messages are submitted back to back.
+
+        Returns a list of (recipient, sent, latency) tuples, where
+        _latency_ is the number of seconds taken to submit the message
+        (all of its parts).
+
+        """
+        results = []
+        with self.modem_lock:
+            for recipient, text in messages:
+                start = time.time()
+                try:
+                    sent = self.smshandler.send_sms(recipient, text)
+                except ValueError, err:
+                    # too long - skip it, but keep on sending the batch
+                    self._log(str(err), "warn")
+                    sent = None
+                latency = time.time() - start
+                self._log("Sent SMS to %s in %.3fs" % (recipient, latency))
+                results.append((recipient, bool(sent), latency))
+        return results
 
     def break_out_of_prompt(self):
         self._write(chr(27))
@@ -529,15 +829,17 @@ class GsmModem(object):
         lines = self._strip_ok(lines)
         messages = self.smshandler.parse_stored_messages(lines)
         for msg in messages:
-            self.incoming_queue.append(msg)
+            self.incoming_queue.put(msg)
 
-    def next_message(self, ping=True, fetch=True):
+    def next_message(self, ping=True, fetch=True, timeout=0):
         """Returns the next waiting IncomingMessage object, or None if the
            queue is empty. The optional _ping_ and _fetch_ parameters control
            whether the modem is pinged (to allow new messages to be delivered
            instantly, on those modems which support it) and queried for unread
            messages in storage, which can both be disabled in case you're
-           already polling in a separate thread."""
+           already polling in a separate thread, or the reader thread is
+           running (see start_reader). _timeout_ is the number of seconds to
+           wait for a message to arrive (None to wait indefinitely)."""
 
         # optionally ping the modem, to give it a
         # chance to deliver any waiting messages
@@ -550,14 +852,15 @@ class GsmModem(object):
         if fetch:
             self._fetch_stored_messages()
 
-        # abort if there are no messages waiting
-        if not self.incoming_queue:
+        # remove the message that has been waiting longest from the
+        # queue, and return it. abort if there are no messages waiting
+        try:
+            if timeout == 0:
+                return self.incoming_queue.get_nowait()
+            return self.incoming_queue.get(timeout=timeout)
+        except Queue.Empty:
             return None
 
-        # remove the message that has been waiting
-        # longest from the queue, and return it
-        return self.incoming_queue.pop(0)
-
 
 if __name__ == "__main__":
 
@@ -562,53 +562,51 @@ def _read_ts(seq):
    
     return dt
 
-def _to_binary(n):
-    s = ""
-    for i in range(8):
-        s = ("%1d" % (n & 1)) + s
-        n >>= 1
-    return s
-
 def _unpack_septets(seq,padding=0):
     """ 
-    this function taken from:
-    http://offog.org/darcs/misccode/desms.py
-
-    Thank you Adam Sampson <ats@offog.org>!
+    Unpack 7-bit characters from a string of hex octets. The septets
+    are packed least significant bit first, after _padding_ fill bits.
     """
 
-    # Unpack 7-bit characters
     msgbytes,r = _consume_bytes(seq,len(seq)/2)
-    msgbytes.reverse()
-    asbinary = ''.join(map(_to_binary, msgbytes))
-    if padding != 0:
-        asbinary = asbinary[:-padding]
     chars = []
-    while len(asbinary) >= 7:
-        chars.append(int(asbinary[-7:], 2))
-        asbinary = asbinary[:-7]
-    return "".join(map(chr, chars))
+    bits = 0
+    acc = 0
+    for b in msgbytes:
+        acc |= b << bits
+        bits += 8
+        if padding:
+            # drop the fill bits
+            skip = min(padding, bits)
+            acc >>= skip
+            bits -= skip
+            padding -= skip
+        while bits >= 7:
+            chars.append(chr(acc & 0x7F))
+            acc >>= 7
+            bits -= 7
+    return "".join(chars)
 
 def _pack_septets(str, padding=0):
-    bytes=[ord(c) for c in str]
-    bytes.reverse()
-    asbinary = ''.join([_to_binary(b)[1:] for b in bytes])
-    # add padding
-    for i in range(padding):
-        asbinary+='0'
-    
-    # zero extend last octet if needed
-    extra = len(asbinary) % 8
-    if extra>0:
-        for i in range(8-extra):
-            asbinary='0'+asbinary
-        
-    # convert back to bytes
-    bytes=[]
-    for i in range(0,len(asbinary),8):
-        bytes.append(int(asbinary[i:i+8],2))
-    bytes.reverse()
-    return ''.join([chr(b) for b in bytes])
+    """
+    Pack a string of 7-bit characters into octets, least significant
+    bit first, after _padding_ fill bits. The last octet is zero
+    extended.
+    """
+
+    octets = []
+    bits = padding
+    acc = 0
+    for c in str:
+        acc |= (ord(c) & 0x7F) << bits
+        bits += 7
+        while bits >= 8:
+            octets.append(chr(acc & 0xFF))
+            acc >>= 8
+            bits -= 8
+    if bits > 0:
+        octets.append(chr(acc & 0xFF))
+    return ''.join(octets)
 
 if __name__ == "__main__":
     # poor man's unit tests
@@ -641,6 +639,18 @@ if __name__ == "__main__":
             ])
     """
 
+    # septet packing round trips, with and without fill bits
+    for text in ('', 'a', 'hellohello', 'The quick brown fox', ''.join([chr(c) for c in range(128)])):
+        for padding in range(7):
+            packed = _pack_septets(text, padding)
+            assert len(packed) == (len(text) * 7 + padding + 7) / 8
+            unpacked = _unpack_septets(packed.encode('hex'), padding)
+            # a zero extended last octet can hold a spare septet
+            assert unpacked[:len(text)] == text
+            assert unpacked[len(text):] in ('', '\x00')
+    assert _pack_septets('hellohello').encode('hex').upper() == 'E8329BFD4697D9EC37'
+    assert _unpack_septets('E8329BFD4697D9EC37') == 'hellohello'
+
     for p in pdus:
         print '\n-------- Received ----------\nPDU: %s\n' % p 
         rp = ReceivedGsmPdu(p)
@@ -27,8 +27,11 @@ class PduSmsHandler(SmsHandler):
                 (MAX_MESSAGES, len(pdus))
                 )
 
+        sent = True
         for pdu in pdus:
-            self._send_pdu(pdu)
+            if not self._send_pdu(pdu):
+                sent = False
+        return sent
             
     def _send_pdu(self, pdu):
         # outer try to catch any error and make sure to
@@ -38,33 +41,21 @@ class PduSmsHandler(SmsHandler):
             # to be generated, so do once and cache
             pdu_string = pdu.pdu_string
 
-            # try to catch write timeouts
-            try:
-                # content length is in bytes, so half PDU minus
-                # the first blank '00' byte
-                self.modem.command( 
-                'AT+CMGS=%d' % (len(pdu_string)/2 - 1), 
+            # content length is in bytes, so half PDU minus
+            # the first blank '00' byte. if no prompt is received
+            # within a second (or an error is received instead),
+            # a timeout is raised
+            self.modem.prompt(
+                'AT+CMGS=%d' % (len(pdu_string)/2 - 1),
                 read_timeout=1
                 )
 
-                # if no error is raised within the timeout period,
-                # and the text-mode prompt WAS received, send the
-                # sms text, wait until it is accepted or rejected
-                # (text-mode messages are terminated with ascii char 26
-                # "SUBSTITUTE" (ctrl+z)), and return True (message sent)
-            except errors.GsmReadTimeoutError, err:
-                if err.pending_data[0] == ">":
-                    self.modem.command(pdu_string, write_term=chr(26))
-                    return True
-
-                    # a timeout was raised, but no prompt nor
-                    # error was received. i have no idea what
-                    # is going on, so allow the error to propagate
-                else:
-                    raise
-
-            finally:
-                pass
+            # the prompt WAS received, so send the pdu, wait until
+            # it is accepted or rejected (messages are terminated
+            # with ascii char 26 "SUBSTITUTE" (ctrl+z)), and return
+            # True (message sent)
+            self.modem.command(pdu_string, write_term=chr(26))
+            return True
 
         # for all other errors...
         # (likely CMS or CME from device)
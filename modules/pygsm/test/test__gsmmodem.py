@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# vim: ai ts=4 sts=4 et sw=4 encoding=utf-8
+
+# run from this directory with: PYTHONPATH=.. python test__gsmmodem.py
+# (requires pyserial)
+
+from __future__ import with_statement
+
+import time
+import threading
+import unittest
+
+import errors
+from devicewrapper import DeviceWrapper
+from gsmmodem import GsmModem
+
+
+# a +CMT notification of an incoming "hellohello", in PDU mode
+CMT = ("+CMT: ,29",
+       "07917283010010F5040BC87238880900F10000993092516195800AE8329BFD4697D9EC37")
+
+
+class MockSerial(object):
+    """Quacks like a serial.Serial connected to a GSM modem, which
+       answers OK to any command, prompts for the data of AT+CMGS,
+       and accepts the data (unless its number is in _reject_).
+       The lines in _before_prompt_ are sent before the prompt, and
+       the prompt is followed by an error if _prompt_error_ is set.
+       AT+CMGL lists (and forgets) the PDUs in _stored_."""
+
+    def __init__(self, reject=(), prompt=True):
+        self.timeout = 1
+        self.reject = reject
+        self.prompt = prompt
+        self.prompt_error = False
+        self.before_prompt = ()
+        self.stored = []
+        self.written = []
+        self.submitted = []
+        self.buffer = []
+        self.lock = threading.Condition()
+
+    def isOpen(self):
+        return True
+
+    def close(self):
+        pass
+
+    def _respond(self, *lines):
+        for line in lines:
+            self.buffer.extend("\r\n%s\r\n" % line)
+
+    def emit(self, *lines):
+        """Send unsolicited lines, such as +CMT (header and PDU) or +CMTI"""
+        with self.lock:
+            self.buffer.extend("\r\n%s\r\n" % "\r\n".join(lines))
+            self.lock.notify()
+
+    def write(self, data):
+        with self.lock:
+            self.written.append(data)
+            if data.endswith(chr(26)):
+                self.submitted.append(data[:-1])
+                if len(self.submitted) in self.reject:
+                    self._respond("+CMS ERROR: 500")
+                else:
+                    self._respond("+CMGS: %d" % len(self.submitted), "OK")
+            elif data.startswith("AT+CMGS="):
+                if self.prompt:
+                    self._respond(*self.before_prompt)
+                    self.buffer.extend("\r\n> ")
+                    if self.prompt_error:
+                        self._respond("+CMS ERROR: 304")
+                else:
+                    self._respond("ERROR")
+            elif data.startswith("AT+CMGL="):
+                for index, pdu in enumerate(self.stored):
+                    self._respond("+CMGL: %d,0,,%d" % (index, len(pdu) / 2 - 8), pdu)
+                self._respond("OK")
+                self.stored = []
+            elif data != chr(27):
+                self._respond("OK")
+            self.lock.notify()
+
+    def read(self, size=1):
+        with self.lock:
+            if not self.buffer:
+                self.lock.wait(self.timeout)
+            if not self.buffer:
+                # timed out
+                return ""
+            return self.buffer.pop(0)
+
+
+class MockDeviceWrapper(DeviceWrapper):
+    """The DeviceWrapper, reading from a MockSerial"""
+
+    def __init__(self, device):
+        self.device = device
+
+
+class MockModem(GsmModem):
+    cmd_delay = 0
+
+    def __init__(self, device, **kwargs):
+        GsmModem.__init__(self, device=device, logger=self.quiet, **kwargs)
+
+    @staticmethod
+    def quiet(modem, message, type):
+        pass
+
+
+class Test_prompt(unittest.TestCase):
+
+    def setUp(self):
+        self.serial = MockSerial()
+        self.modem = MockModem(MockDeviceWrapper(self.serial))
+
+    def test_prompt(self):
+        start = time.time()
+        self.modem.prompt("AT+CMGS=10", read_timeout=1)
+        # returns on the prompt, without waiting for the timeout
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertEqual(self.serial.written[-1], "AT+CMGS=10\r")
+
+    def test_prompt_error(self):
+        self.serial.prompt = False
+        self.assertRaises(errors.GsmReadTimeoutError,
+                          self.modem.prompt, "AT+CMGS=10", 0.1)
+
+    def test_prompt_settle_error(self):
+        # the prompt is followed by an error
+        self.serial.prompt_error = True
+        self.assertRaises(errors.GsmModemError,
+                          self.modem.prompt, "AT+CMGS=10", 1, settle=0.1)
+
+    def test_prompt_incoming(self):
+        # an incoming sms before the prompt is parsed after the next command
+        self.serial.before_prompt = CMT
+        self.modem.prompt("AT+CMGS=10", read_timeout=1)
+        self.assertTrue(self.modem.incoming_queue.empty())
+        self.modem.command("00", write_term=chr(26))
+        msg = self.modem.incoming_queue.get_nowait()
+        self.assertEqual(msg.text, u"hellohello")
+
+
+class Test_send_sms_batch(unittest.TestCase):
+
+    def setUp(self):
+        # the 3rd submission is rejected
+        self.serial = MockSerial(reject=(3,))
+        self.modem = MockModem(MockDeviceWrapper(self.serial))
+
+    def _batch(self):
+        messages = [("+14153773715", "hello %d" % i) for i in range(4)]
+        # 3 parts
+        messages.append(("+14153773716", "x" * 400))
+        return messages
+
+    def _check(self, results):
+        self.assertEqual([r[0] for r in results],
+                         ["+14153773715"] * 4 + ["+14153773716"])
+        self.assertEqual([r[1] for r in results],
+                         [True, True, False, True, True])
+        for recipient, sent, latency in results:
+            self.assertTrue(0 <= latency < 0.5)
+        self.assertEqual(len(self.serial.submitted), 7)
+
+    def test_send_sms_batch(self):
+        self._check(self.modem.send_sms_batch(self._batch()))
+
+    def test_send_sms(self):
+        self.assertEqual(self.modem.send_sms("+14153773715", "hello"), True)
+        self.assertEqual(len(self.serial.submitted), 1)
+
+
+class Test_send_sms_text(unittest.TestCase):
+
+    def setUp(self):
+        self.serial = MockSerial()
+        self.modem = MockModem(MockDeviceWrapper(self.serial), mode="text")
+
+    def test_send_sms(self):
+        self.assertEqual(self.modem.send_sms("+14153773715", "hello"), True)
+        self.assertEqual(self.serial.submitted, ["hello"])
+
+    def test_send_sms_prompt_error(self):
+        # the prompt is followed by an error, so the text is not sent
+        self.serial.prompt_error = True
+        self.assertEqual(self.modem.send_sms("+14153773715", "hello"), None)
+        self.assertEqual(self.serial.submitted, [])
+
+
+def suite():
+    return unittest.TestSuite((
+            unittest.makeSuite(Test_prompt),
+            unittest.makeSuite(Test_send_sms_batch),
+            unittest.makeSuite(Test_send_sms_text),
+                              ))
+
+if __name__ == "__main__":
+    # run tests
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
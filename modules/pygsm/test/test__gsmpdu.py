@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# vim: ai ts=4 sts=4 et sw=4 encoding=utf-8
+
+# run from this directory with: PYTHONPATH=.. python test__gsmpdu.py
+
+import unittest
+
+import gsmpdu
+from gsmpdu import _pack_septets, _unpack_septets
+
+
+class Test_pack_septets(unittest.TestCase):
+
+    def test_known_vector(self):
+        packed = _pack_septets('hellohello')
+        self.assertEqual(packed.encode('hex').upper(), 'E8329BFD4697D9EC37')
+
+    def test_length(self):
+        for text in ('', 'a', 'hellohello', 'x' * 160):
+            for padding in range(7):
+                packed = _pack_septets(text, padding)
+                self.assertEqual(len(packed), (len(text) * 7 + padding + 7) / 8)
+
+    def test_round_trip(self):
+        texts = ('', 'a', 'hellohello', 'The quick brown fox',
+                 ''.join([chr(c) for c in range(128)]))
+        for text in texts:
+            for padding in range(7):
+                packed = _pack_septets(text, padding)
+                unpacked = _unpack_septets(packed.encode('hex'), padding)
+                # a zero extended last octet can hold a spare septet
+                self.assertEqual(unpacked[:len(text)], text)
+                self.assertTrue(unpacked[len(text):] in ('', '\x00'))
+
+
+class Test_unpack_septets(unittest.TestCase):
+
+    def test_known_vector(self):
+        self.assertEqual(_unpack_septets('E8329BFD4697D9EC37'), 'hellohello')
+
+    def test_received_pdu(self):
+        pdu = gsmpdu.ReceivedGsmPdu(
+            '07917283010010F5040BC87238880900F10000993092516195800AE8329BFD4697D9EC37')
+        self.assertEqual(pdu.text, u'hellohello')
+
+
+class Test_get_outbound_pdus(unittest.TestCase):
+
+    def test_single(self):
+        pdus = gsmpdu.get_outbound_pdus('hellohello', '+14153773715')
+        self.assertEqual(len(pdus), 1)
+        self.assertTrue(pdus[0].pdu_string.endswith('0AE8329BFD4697D9EC37'))
+
+    def test_concatenated(self):
+        # 153 septets per part, after the 6 octet user data header
+        pdus = gsmpdu.get_outbound_pdus('x' * 400, '+14153773715')
+        self.assertEqual(len(pdus), 3)
+        text = ''
+        for pdu in pdus:
+            # SMSC, header, message reference, recipient, PID, DCS, VP, UDL
+            udl = int(pdu.pdu_string[28:30], 16)
+            udh = pdu.pdu_string[30:42]
+            self.assertEqual(udh[:6], '050003')
+            # the user data starts after one fill bit
+            text += _unpack_septets(pdu.pdu_string[42:], 1)[:udl - 7]
+        self.assertEqual(text, 'x' * 400)
+
+
+def suite():
+    return unittest.TestSuite((
+            unittest.makeSuite(Test_pack_septets),
+            unittest.makeSuite(Test_unpack_septets),
+            unittest.makeSuite(Test_get_outbound_pdus),
+                              ))
+
+if __name__ == "__main__":
+    # run tests
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# vim: ai ts=4 sts=4 et sw=4 encoding=utf-8
+
+# run from this directory with: PYTHONPATH=.. python test__gsmreader.py
+# (requires pyserial; the S3Msg test also needs web2py, with
+# PYTHONPATH=..:../..:/path/to/web2py)
+
+import time
+import unittest
+
+import errors
+from test__gsmmodem import CMT, MockSerial, MockDeviceWrapper, MockModem
+
+try:
+    from s3.s3msg import S3Msg
+except ImportError:
+    S3Msg = None
+
+
+class ReaderTestCase(unittest.TestCase):
+    """Runs each test with the reader thread started"""
+
+    def setUp(self):
+        self.serial = MockSerial()
+        self.modem = MockModem(MockDeviceWrapper(self.serial))
+        self.modem.start_reader()
+
+    def tearDown(self):
+        self.modem.stop_reader()
+
+
+class Test_prompt(ReaderTestCase):
+
+    def test_prompt(self):
+        start = time.time()
+        self.modem.prompt("AT+CMGS=10", read_timeout=1)
+        self.assertTrue(time.time() - start < 0.5)
+
+    def test_prompt_error(self):
+        self.serial.prompt = False
+        self.assertRaises(errors.GsmReadTimeoutError,
+                          self.modem.prompt, "AT+CMGS=10", 0.1)
+
+    def test_prompt_settle_error(self):
+        self.serial.prompt_error = True
+        self.assertRaises(errors.GsmModemError,
+                          self.modem.prompt, "AT+CMGS=10", 1, settle=0.1)
+
+
+class Test_send_sms_batch(ReaderTestCase):
+
+    def test_send_sms_batch(self):
+        # the 3rd submission is rejected
+        self.serial.reject = (3,)
+        messages = [("+14153773715", "hello %d" % i) for i in range(4)]
+        results = self.modem.send_sms_batch(messages)
+        self.assertEqual([r[1] for r in results], [True, True, False, True])
+        self.assertEqual(len(self.serial.submitted), 4)
+
+
+class Test_incoming(ReaderTestCase):
+
+    def test_cmt(self):
+        self.serial.emit(*CMT)
+        msg = self.modem.incoming_queue.get(timeout=1)
+        self.assertEqual(msg.text, u"hellohello")
+        # the message was acknowledged
+        self.assertTrue("AT+CNMA\r" in self.serial.written)
+
+    def test_cmti(self):
+        # a message was stored, which is fetched with AT+CMGL
+        self.serial.stored.append(CMT[1])
+        self.serial.emit('+CMTI: "SM",1')
+        msg = self.modem.incoming_queue.get(timeout=1)
+        self.assertEqual(msg.text, u"hellohello")
+        self.assertEqual(self.serial.stored, [])
+
+    def test_command_between(self):
+        # a notification while a command waits for its response
+        self.serial.emit(*CMT)
+        self.assertEqual(self.modem.command("AT"), ["OK"])
+        msg = self.modem.incoming_queue.get(timeout=1)
+        self.assertEqual(msg.text, u"hellohello")
+
+
+class Test_next_message(ReaderTestCase):
+
+    def test_timeout(self):
+        start = time.time()
+        self.assertEqual(self.modem.next_message(
+            ping=False, fetch=False, timeout=0.2), None)
+        self.assertTrue(time.time() - start >= 0.2)
+
+    def test_no_wait(self):
+        self.assertEqual(self.modem.next_message(
+            ping=False, fetch=False), None)
+
+    def test_waits_for_message(self):
+        self.serial.emit(*CMT)
+        msg = self.modem.next_message(ping=False, fetch=False, timeout=1)
+        self.assertEqual(msg.text, u"hellohello")
+
+
+class Test_receive_sms_via_modem(ReaderTestCase):
+
+    def setUp(self):
+        ReaderTestCase.setUp(self)
+        if S3Msg is None:
+            return
+        # S3Msg.__init__ needs a web2py request, this only needs the modem
+        self.msg = S3Msg.__new__(S3Msg)
+        self.msg.modem = self.modem
+        self.received = []
+        self.msg.receive_msg = lambda **kwargs: self.received.append(kwargs)
+
+    @unittest.skipIf(S3Msg is None, "requires web2py")
+    def test_receive(self):
+        self.serial.emit(*CMT)
+        self.serial.emit(*CMT)
+        self.assertEqual(self.msg.receive_sms_via_modem(timeout=0.5), 2)
+        self.assertEqual([r["message"] for r in self.received],
+                         [u"hellohello"] * 2)
+        self.assertEqual(self.received[0]["fromaddress"], "27838890001")
+        self.assertEqual(self.received[0]["pr_message_method"], "SMS")
+
+
+def suite():
+    return unittest.TestSuite((
+            unittest.makeSuite(Test_prompt),
+            unittest.makeSuite(Test_send_sms_batch),
+            unittest.makeSuite(Test_incoming),
+            unittest.makeSuite(Test_next_message),
+            unittest.makeSuite(Test_receive_sms_via_modem),
+                              ))
+
+if __name__ == "__main__":
+    # run tests
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
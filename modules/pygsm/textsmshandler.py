@@ -27,52 +27,42 @@ class TextSmsHandler(SmsHandler):
 
         old_mode = None
         try:
+            # cast the text to a string, to check that
+            # it doesn't contain non-ascii characters
             try:
-                # cast the text to a string, to check that
-                # it doesn't contain non-ascii characters
-                try:
-                    text = str(text)
-
-                # uh-oh. unicode ahoy
-                except UnicodeEncodeError:
-
-                    # fetch and store the current mode (so we can
-                    # restore it later), and override it with UCS2
-                    csmp = self.modem.query("AT+CSMP?", "+CSMP:")
-                    if csmp is not None:
-                        old_mode = csmp.split(",")
-                        mode = old_mode[:]
-                        mode[3] = "8"
-
-                        # enable hex mode, and set the encoding
-                        # to UCS2 for the full character set
-                        self.modem.command('AT+CSCS="HEX"')
-                        self.modem.command("AT+CSMP=%s" % ",".join(mode))
-                        text = text.encode("utf-16").encode("hex")
-
-                # initiate the sms, and give the device a second
-                # to raise an error. unfortunately, we can't just
-                # wait for the "> " prompt, because some modems
-                # will echo it FOLLOWED BY a CMS error
-                result = self.modem.command(
-                        'AT+CMGS=\"%s\"' % (recipient),
-                        read_timeout=1)
-
-            # if no error is raised within the timeout period,
-            # and the text-mode prompt WAS received, send the
+                text = str(text)
+
+            # uh-oh. unicode ahoy
+            except UnicodeEncodeError:
+
+                # fetch and store the current mode (so we can
+                # restore it later), and override it with UCS2
+                csmp = self.modem.query("AT+CSMP?", "+CSMP:")
+                if csmp is not None:
+                    old_mode = csmp.split(",")
+                    mode = old_mode[:]
+                    mode[3] = "8"
+
+                    # enable hex mode, and set the encoding
+                    # to UCS2 for the full character set
+                    self.modem.command('AT+CSCS="HEX"')
+                    self.modem.command("AT+CSMP=%s" % ",".join(mode))
+                    text = text.encode("utf-16").encode("hex")
+
+            # initiate the sms, and give the device a second to
+            # send the "> " prompt. some modems will echo it
+            # FOLLOWED BY a CMS error, so keep listening briefly
+            # after the prompt, in case one arrives
+            self.modem.prompt(
+                    'AT+CMGS=\"%s\"' % (recipient),
+                    read_timeout=1, settle=0.5)
+
+            # the text-mode prompt WAS received, so send the
             # sms text, wait until it is accepted or rejected
             # (text-mode messages are terminated with ascii char 26
             # "SUBSTITUTE" (ctrl+z)), and return True (message sent)
-            except errors.GsmReadTimeoutError, err:
-                if err.pending_data[0] == ">":
-                    self.modem.command(text, write_term=chr(26))
-                    return True
-
-                # a timeout was raised, but no prompt nor
-                # error was received. i have no idea what
-                # is going on, so allow the error to propagate
-                else:
-                    raise
+            self.modem.command(text, write_term=chr(26))
+            return True
 
         # for all other errors...
         # (likely CMS or CME from device)
@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Chart rendering with a pool of persistent R worker processes
+
+    Charts are rendered by long-lived worker processes, each with its own
+    R interpreter, which take one job at a time over a pipe and return
+    the SVG/PNG bytes. Where R (rpy2) is not installed, the same charts
+    are rendered in-process with matplotlib.
+
+    Usage:
+        image = render("boxPlot", [[1, 2, 3], [2, 3, 4]], format="svg")
+
+    @requires: U{B{I{rpy2}} <http://rpy.sourceforge.net/rpy2.html>} or
+               U{B{I{matplotlib}} <http://matplotlib.sourceforge.net>}
+
+    @copyright: 2011 (c) Sahana Software Foundation
+    @license: MIT
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    Software is furnished to do so, subject to the following
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+__all__ = ["RenderError",
+           "RenderTimeout",
+           "RWorkerPool",
+           "render"]
+
+import os
+import imp
+import atexit
+import threading
+import traceback
+import Queue
+from tempfile import mkstemp
+from cStringIO import StringIO
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+try:
+    imp.find_module("rpy2")
+except ImportError:
+    R_AVAILABLE = False
+else:
+    R_AVAILABLE = multiprocessing is not None
+
+# =============================================================================
+class RenderError(RuntimeError):
+    """ A chart job failed in the renderer """
+    pass
+
+class RenderTimeout(RenderError):
+    """ A chart job did not finish in time """
+    pass
+
+# =============================================================================
+# R renderers (run inside the worker processes)
+#
+# All renderers take the chart data, an image format ("svg" or "png"),
+# width and height in inches, and return the image as a string of bytes
+#
+class RRenderers(object):
+
+    robjects = None
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def r(cls):
+        if cls.robjects is None:
+            # Starts R in this process
+            import rpy2.robjects as robjects
+            cls.robjects = robjects
+        return cls.robjects
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def vector(cls, values):
+        """ R vector for a list of Python values """
+
+        robjects = cls.r()
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        values = list(values)
+        types = set([type(v) for v in values if v is not None])
+        if types == set([bool]):
+            return robjects.BoolVector(values)
+        elif types == set([int]):
+            return robjects.IntVector(values)
+        elif types and types.issubset(set([int, long, float])):
+            return robjects.FloatVector([v is None and robjects.NA_Real or v
+                                         for v in values])
+        else:
+            return robjects.StrVector(values)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def plot(cls, plot, format, width, height):
+        """
+            Run a plot function against a graphics device writing
+            to a temporary file and return the file's contents
+        """
+
+        r = cls.r().r
+        handle, filename = mkstemp(suffix=".%s" % format)
+        os.close(handle)
+        try:
+            if format == "svg":
+                r.svg(filename, width=width, height=height)
+            else:
+                r.png(filename, width=width, height=height,
+                      units="in", res=72)
+            try:
+                plot()
+            finally:
+                r["dev.off"]()
+            image = open(filename, "rb")
+            try:
+                return image.read()
+            finally:
+                image.close()
+        finally:
+            os.remove(filename)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def params(cls, params):
+        return dict([(k, cls.vector(v)) for k, v in params.items()])
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def scatterMatrix(cls, series, format="svg", width=10.5, height=7,
+                      params={}):
+        """
+            Matrix of scatter plots of each pair of series
+
+            @param series: list of (name, values)
+        """
+
+        robjects = cls.r()
+        frame = robjects.DataFrame(dict([(str(name), cls.vector(values))
+                                         for name, values in series]))
+        params = cls.params(params)
+        return cls.plot(lambda: robjects.r.pairs(frame, **params),
+                        format, width, height)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def boxPlot(cls, series, format="svg", width=10.5, height=7, params={}):
+        """
+            Box plot of each series
+
+            @param series: list of value lists
+        """
+
+        robjects = cls.r()
+        vectors = [cls.vector(values) for values in series]
+        params = cls.params(params)
+        return cls.plot(lambda: robjects.r.boxplot(*vectors, **params),
+                        format, width, height)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def timeSeries(cls, series, xlab="", ylab="", frequency=12,
+                   format="png", width=640/72.0, height=480/72.0):
+        """
+            Time series plot
+
+            @param series: list of ((start year, start period), values)
+            @param frequency: periods per year
+        """
+
+        robjects = cls.r()
+        r = robjects.r
+        c = r.c
+        time_series = [r.ts(robjects.FloatVector(values),
+                            start=c(*start),
+                            frequency=frequency)
+                       for start, values in series]
+        plot_chart = r("function (xlab, ylab, n, ...) {"
+                           "ts.plot(...,"
+                               "gpars=list(xlab=xlab, ylab=ylab, col=c(1:n))"
+                           ")"
+                       "}")
+        return cls.plot(lambda: plot_chart(xlab, ylab, len(time_series),
+                                           *time_series),
+                        format, width, height)
+
+# =============================================================================
+# matplotlib renderers (fallback, same API as the R renderers)
+#
+class MatplotlibRenderers(object):
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def figure(width, height):
+        # Use the object API only - pyplot is not thread-safe
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        figure = Figure(figsize=(width, height), dpi=72)
+        FigureCanvasAgg(figure)
+        return figure
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def save(figure, format):
+        output = StringIO()
+        figure.savefig(output, format=format)
+        return output.getvalue()
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def clean(values):
+        return [v for v in values if v is not None]
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def scatterMatrix(cls, series, format="svg", width=10.5, height=7,
+                      params={}):
+
+        figure = cls.figure(width, height)
+        n = len(series)
+        for i, (yname, yvalues) in enumerate(series):
+            for j, (xname, xvalues) in enumerate(series):
+                axes = figure.add_subplot(n, n, i * n + j + 1)
+                if i == j:
+                    axes.text(0.5, 0.5, str(yname),
+                              ha="center", va="center",
+                              transform=axes.transAxes)
+                else:
+                    pairs = [(x, y) for x, y in zip(xvalues, yvalues)
+                             if x is not None and y is not None]
+                    if pairs:
+                        axes.scatter([x for x, y in pairs],
+                                     [y for x, y in pairs],
+                                     s=8, facecolors="none")
+                axes.set_xticks([])
+                axes.set_yticks([])
+        if "main" in params:
+            figure.suptitle(str(params["main"]))
+        return cls.save(figure, format)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def boxPlot(cls, series, format="svg", width=10.5, height=7, params={}):
+
+        figure = cls.figure(width, height)
+        axes = figure.add_subplot(1, 1, 1)
+        axes.boxplot([cls.clean(values) for values in series])
+        if "main" in params:
+            axes.set_title(str(params["main"]))
+        return cls.save(figure, format)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def timeSeries(cls, series, xlab="", ylab="", frequency=12,
+                   format="png", width=640/72.0, height=480/72.0):
+
+        figure = cls.figure(width, height)
+        axes = figure.add_subplot(1, 1, 1)
+        for (year, period), values in series:
+            start = year + (period - 1) / float(frequency)
+            axes.plot([start + i / float(frequency)
+                       for i in xrange(len(values))],
+                      values)
+        axes.set_xlabel(xlab)
+        axes.set_ylabel(ylab)
+        return cls.save(figure, format)
+
+# =============================================================================
+def _serve(connection):
+    """ Main loop of a worker process """
+
+    while True:
+        try:
+            job = connection.recv()
+        except (EOFError, IOError):
+            break
+        if job is None:
+            break
+        name, args, kwargs = job
+        try:
+            result = ("ok", getattr(RRenderers, name)(*args, **kwargs))
+        except Exception:
+            result = ("error", traceback.format_exc())
+        connection.send(result)
+    connection.close()
+
+# =============================================================================
+class RWorkerPool(object):
+    """
+        Pool of persistent R worker processes
+
+        Each worker renders one job at a time, callers wait for an idle
+        worker. A worker which does not answer within the timeout is
+        terminated and replaced.
+    """
+
+    def __init__(self, size=2, timeout=60):
+        """
+            @param size: the number of worker processes
+            @param timeout: seconds to wait for a worker and for a job
+        """
+
+        self.size = size
+        self.timeout = timeout
+        self.idle = Queue.Queue()
+        self.workers = []
+        self.lock = threading.Lock()
+        for i in xrange(size):
+            self.idle.put(self._start())
+
+    # -------------------------------------------------------------------------
+    def _start(self):
+
+        connection, worker_connection = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_serve,
+                                          args=(worker_connection,))
+        process.daemon = True
+        process.start()
+        worker = (process, connection)
+        self.lock.acquire()
+        try:
+            self.workers.append(worker)
+        finally:
+            self.lock.release()
+        return worker
+
+    # -------------------------------------------------------------------------
+    def _stop(self, worker, terminate=False):
+
+        process, connection = worker
+        self.lock.acquire()
+        try:
+            if worker in self.workers:
+                self.workers.remove(worker)
+        finally:
+            self.lock.release()
+        try:
+            if terminate:
+                process.terminate()
+            else:
+                connection.send(None)
+        except Exception:
+            pass
+        process.join(1)
+        connection.close()
+
+    # -------------------------------------------------------------------------
+    def render(self, name, *args, **kwargs):
+        """
+            Render a chart in a worker process
+
+            @param name: the name of the renderer, see RRenderers
+            @returns: the image as string of bytes
+        """
+
+        try:
+            worker = self.idle.get(timeout=self.timeout)
+        except Queue.Empty:
+            raise RenderTimeout("No R worker available")
+
+        process, connection = worker
+        try:
+            connection.send((name, args, kwargs))
+            if not connection.poll(self.timeout):
+                raise RenderTimeout("%s did not finish in %s seconds" %
+                                    (name, self.timeout))
+            status, result = connection.recv()
+        except Exception:
+            # the worker state is unknown - replace it
+            self._stop(worker, terminate=True)
+            self.idle.put(self._start())
+            raise
+        self.idle.put(worker)
+
+        if status != "ok":
+            raise RenderError(result)
+        return result
+
+    # -------------------------------------------------------------------------
+    def close(self):
+        """ Stop all workers """
+
+        for worker in list(self.workers):
+            self._stop(worker)
+
+# =============================================================================
+_pool = None
+_pool_lock = threading.Lock()
+
+def render(name, *args, **kwargs):
+    """
+        Render a chart with the R worker pool, or with matplotlib
+        if R is not available
+
+        @param name: the name of the renderer, see RRenderers
+        @returns: the image as string of bytes
+    """
+
+    global _pool
+    if R_AVAILABLE:
+        _pool_lock.acquire()
+        try:
+            if _pool is None:
+                _pool = RWorkerPool()
+                atexit.register(_pool.close)
+        finally:
+            _pool_lock.release()
+        return _pool.render(name, *args, **kwargs)
+    else:
+        return getattr(MatplotlibRenderers, name)(*args, **kwargs)
+
+# END =========================================================================
@@ -32,16 +32,13 @@
 
 __all__ = ["S3XLS"]
 
-try:
-    from cStringIO import StringIO    # Faster, where available
-except:
-    from StringIO import StringIO
+from tempfile import TemporaryFile
 
 from gluon import *
 from gluon import current
+from gluon.dal import Row
 from gluon.storage import Storage
 from gluon.contenttype import contenttype
-from lxml import etree
 
 from ..s3codec import S3Codec
 
@@ -52,6 +49,11 @@ class S3XLS(S3Codec):
         Simple Microsoft Excel format codec
     """
 
+    # Records retrieved and represented at a time
+    CHUNK_SIZE = 500
+    # Bytes streamed to the client at a time
+    STREAM_CHUNK_SIZE = 65536
+
     # Customizable styles
     COL_WIDTH_MULTIPLIER = 360
     LARGE_HEADER_COLOUR = 0x2C
@@ -77,6 +79,11 @@ class S3XLS(S3Codec):
         """
             Export a resource as Microsoft Excel spreadsheet
 
+            Writes XLSX in constant-memory mode if XlsxWriter is installed,
+            otherwise XLS with xlwt. Records are retrieved and represented
+            in chunks of CHUNK_SIZE, and continued on a new sheet when a
+            sheet is full. The file is streamed to the client.
+
             @param resource: the resource
             @param list_fields: fields to include in list views
             @param report_groupby: a Field object of the field to group the records by
@@ -84,25 +91,24 @@ class S3XLS(S3Codec):
 
         manager = current.manager
 
-        # Try import xlwt
+        # Try import xlsxwriter, then xlwt
         try:
-            import xlwt
+            import xlsxwriter
+            book_class = S3XLSXBook
+            extension = ".xlsx"
         except ImportError:
-            manager.session.error = self.ERROR.XLWT_ERROR
-            redirect(URL(extension=""))
+            try:
+                import xlwt
+                book_class = S3XLSBook
+                extension = ".xls"
+            except ImportError:
+                manager.session.error = self.ERROR.XLWT_ERROR
+                redirect(URL(extension=""))
 
         # Environment
-        db = current.db
-        session = current.session
         request = current.request
         response = current.response
 
-        # Date/Time formats from L10N deployment settings
-        settings = current.deployment_settings
-        date_format = S3XLS.dt_format_translate(settings.get_L10n_date_format())
-        time_format = S3XLS.dt_format_translate(settings.get_L10n_time_format())
-        datetime_format = S3XLS.dt_format_translate(settings.get_L10n_datetime_format())
-
         # List fields
         if not list_fields:
             fields = resource.readable_fields()
@@ -114,65 +120,20 @@ class S3XLS(S3Codec):
             resource.add_filter(response.s3.filter)
         orderby = report_groupby
 
-        # Retrieve the resource contents
+        # Resolve the list fields
         crud = resource.crud
         table = resource.table
         lfields, joins = crud.get_list_fields(table, list_fields)
         fields = [f for f in lfields if f.show]
-        headers = [f.label for f in lfields if f.show]
-        items = crud.sqltable(fields=list_fields,
-                              start=None,
-                              limit=None,
-                              orderby=orderby,
-                              no_ids=True,
-                              as_page=True)
-
-        if items is None:
-            items = []
-
-        # Initialize output
-        output = StringIO()
-
-        # Create the workbook and a sheet in it
-        book = xlwt.Workbook(encoding="utf-8")
-        sheet1 = book.add_sheet(str(table))
-
-        # Styles
-        styleLargeHeader = xlwt.XFStyle()
-        styleLargeHeader.font.bold = True
-        styleLargeHeader.font.height = 400
-        styleLargeHeader.alignment.horz = styleLargeHeader.alignment.HORZ_CENTER
-        styleLargeHeader.pattern.pattern = styleLargeHeader.pattern.SOLID_PATTERN
-        styleLargeHeader.pattern.pattern_fore_colour = S3XLS.LARGE_HEADER_COLOUR
-
-        styleHeader = xlwt.XFStyle()
-        styleHeader.font.bold = True
-        styleHeader.num_format_str = datetime_format
-        styleHeader.pattern.pattern = styleHeader.pattern.SOLID_PATTERN
-        styleHeader.pattern.pattern_fore_colour = S3XLS.HEADER_COLOUR
-
-        styleSubHeader = xlwt.XFStyle()
-        styleSubHeader.font.bold = True
-        styleSubHeader.pattern.pattern = styleHeader.pattern.SOLID_PATTERN
-        styleSubHeader.pattern.pattern_fore_colour = S3XLS.SUB_HEADER_COLOUR
-
-        styleOdd = xlwt.XFStyle()
-        styleOdd.pattern.pattern = styleOdd.pattern.SOLID_PATTERN
-        styleOdd.pattern.pattern_fore_colour = S3XLS.ROW_ALTERNATING_COLOURS[0]
-
-        styleEven = xlwt.XFStyle()
-        styleEven.pattern.pattern = styleEven.pattern.SOLID_PATTERN
-        styleEven.pattern.pattern_fore_colour = S3XLS.ROW_ALTERNATING_COLOURS[1]
-
-        # Initialize counters
-        rowCnt = 0
-        colCnt = 0
-
-        # Title row
-        currentRow = sheet1.row(rowCnt)
-        totalRows = len(fields)-1
-        if report_groupby != None:
-            totalRows -= 1
+        group = None
+        columns = []
+        for i, f in enumerate(fields):
+            if report_groupby is not None and \
+               f.label == report_groupby.label:
+                group = i
+            else:
+                columns.append(i)
+        headers = [str(fields[i].label) for i in columns]
 
         # Use the title_list CRUD string for the title
         name = "title_list"
@@ -182,95 +143,139 @@ class S3XLS(S3Codec):
         not_found = s3.crud_strings.get(name, request.function)
         title = str(crud_strings.get(name, not_found))
 
-        sheet1.write_merge(rowCnt, rowCnt, 0, totalRows-1, title, styleLargeHeader)
-        currentRow.write(totalRows, request.now, styleHeader)
-        currentRow.height = 440
-        rowCnt += 1
-        currentRow = sheet1.row(rowCnt)
-
-        # Header row
-        fieldWidth=[]
-        for field in fields:
-            if report_groupby != None:
-                if field.label == report_groupby.label:
-                    continue
-            currentRow.write(colCnt, str(field.label), styleHeader)
-            width=len(field.label)*S3XLS.COL_WIDTH_MULTIPLIER
-            fieldWidth.append(width)
-            sheet1.col(colCnt).width = width
-            colCnt += 1
-
-        # fix the size of the last column to display the date
-        if 16*S3XLS.COL_WIDTH_MULTIPLIER > width:
-            sheet1.col(totalRows).width = 16*S3XLS.COL_WIDTH_MULTIPLIER
+        output = TemporaryFile()
+        book = book_class(output, str(table), title, headers, request.now)
 
         subheading = None
-        for item in items:
-            # Item details
-            rowCnt += 1
-            currentRow = sheet1.row(rowCnt)
-            colCnt = 0
-            if rowCnt%2 == 0:
-                style = styleEven
-            else:
-                style = styleOdd
-            for field in fields:
-                represent = item[colCnt]
-                # Strip away markup from representation
-                try:
-                    markup = etree.XML(str(represent))
-                    text = markup.xpath(".//text()")
-                    if text:
-                        text = " ".join(text)
-                    else:
-                        text = ""
-                    represent = text
-                except:
-                    pass
-                if report_groupby != None:
-                    if field.label == report_groupby.label:
-                        if subheading != represent:
-                            subheading = represent
-                            sheet1.write_merge(rowCnt, rowCnt, 0, totalRows,
-                                               represent, styleSubHeader)
-                            rowCnt += 1
-                            currentRow = sheet1.row(rowCnt)
-                            if rowCnt%2 == 0:
-                                style = styleEven
-                            else:
-                                style = styleOdd
-                        continue
-                if field.colname:
-                    tab, col = field.colname.split(".")
-                try:
-                    # Check for Date formats
-                    coltype = db[tab][col].type
-                    if coltype == "date":
-                        style.num_format_str = date_format
-                    elif coltype == "datetime":
-                        style.num_format_str = datetime_format
-                    elif coltype == "time":
-                        style.num_format_str = time_format
-                except:
-                    pass
-                currentRow.write(colCnt, unicode(represent), style)
-                width = len(unicode(represent))*S3XLS.COL_WIDTH_MULTIPLIER
-                if width > fieldWidth[colCnt]:
-                    fieldWidth[colCnt] = width
-                    sheet1.col(colCnt).width = width
-                colCnt += 1
-        sheet1.panes_frozen = True
-        sheet1.horz_split_pos = 2
-        book.save(output)
+        for items in self.items(resource, lfields, joins, orderby, fields):
+            for item in items:
+                if group is not None and item[group] != subheading:
+                    subheading = item[group]
+                    book.write_subheading(subheading)
+                book.write_row([item[i] for i in columns])
+        book.close()
 
         # Response headers
-        filename = "%s_%s.xls" % (request.env.server_name, str(table))
+        filename = "%s_%s%s" % (request.env.server_name, str(table), extension)
         disposition = "attachment; filename=\"%s\"" % filename
-        response.headers["Content-Type"] = contenttype(".xls")
+        response.headers["Content-Type"] = contenttype(extension)
         response.headers["Content-disposition"] = disposition
 
         output.seek(0)
-        return output.read()
+        return response.stream(output, chunk_size=S3XLS.STREAM_CHUNK_SIZE)
+
+    # -------------------------------------------------------------------------
+    def items(self, resource, lfields, joins, orderby, fields):
+        """
+            Generator for the represented records, in chunks of
+            CHUNK_SIZE records. Each distinct value of a column is
+            represented only once per chunk.
+
+            @param resource: the resource
+            @param lfields: the list fields (all, including extra fields)
+            @param joins: the joins for the list fields
+            @param orderby: orderby for the query (None to order by ID)
+            @param fields: the list fields to represent
+        """
+
+        db = current.db
+        manager = current.manager
+        table = resource.table
+        _id = table._id
+
+        query = resource.get_query()
+        for j in joins.values():
+            query &= j
+        qfields = [f.field for f in lfields if f.field is not None]
+        qfields.insert(0, _id)
+
+        chunk_size = S3XLS.CHUNK_SIZE
+        start = 0
+        last_id = None
+        while True:
+            if orderby is None:
+                # Seek by record ID, so that each chunk is an index scan
+                if last_id is not None:
+                    q = query & (_id > last_id)
+                else:
+                    q = query
+                rows = db(q).select(orderby=_id,
+                                    limitby=(0, chunk_size),
+                                    *qfields)
+            else:
+                rows = db(query).select(orderby=orderby|_id,
+                                        limitby=(start, start + chunk_size),
+                                        *qfields)
+            if not rows:
+                break
+            start += len(rows)
+
+            # Represent the chunk column by column
+            columns = []
+            for f in fields:
+                represented = {}
+                column = []
+                for row in rows:
+                    value = self.value(row, f)
+                    try:
+                        text = represented[value]
+                    except KeyError:
+                        text = represented[value] = self.represent(manager, f, value)
+                    except TypeError:
+                        # unhashable value (list types)
+                        text = self.represent(manager, f, value)
+                    column.append(text)
+                columns.append(column)
+            yield zip(*columns)
+
+            if len(rows) < chunk_size:
+                break
+            last = rows.last()
+            if table._tablename in last and \
+               isinstance(last[table._tablename], Row):
+                last = last[table._tablename]
+            last_id = last[_id.name]
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def value(row, f):
+        """
+            Get the value of a list field from a row
+
+            @param row: the row
+            @param f: the list field
+        """
+
+        if f.tname in row and isinstance(row[f.tname], Row):
+            row = row[f.tname]
+        try:
+            return row[f.fname]
+        except (KeyError, AttributeError):
+            return None
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def represent(manager, f, value):
+        """
+            Represent the value of a list field as text without markup
+
+            @param manager: the S3RequestManager
+            @param f: the list field
+            @param value: the value
+        """
+
+        if f.field is not None:
+            text = manager.represent(f.field,
+                                     value=value,
+                                     strip_markup=True,
+                                     non_xml_output=True)
+        elif value is None:
+            text = ""
+        else:
+            text = value
+        if isinstance(text, str):
+            return text.decode("utf-8", "replace")
+        return unicode(text)
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -314,4 +319,287 @@ class S3XLS(S3Codec):
                 xlfmt = xlfmt.replace(item, translate[item])
         return xlfmt
 
+
+# =============================================================================
+
+class S3XLSBook(object):
+    """
+        Microsoft Excel (XLS) workbook writer using xlwt, continues on
+        a new sheet when a sheet is full. Note that xlwt keeps the whole
+        workbook in memory until it is closed.
+    """
+
+    MAX_ROWS = 65536
+
+    # -------------------------------------------------------------------------
+    def __init__(self, output, name, title, headers, timestamp):
+        """
+            Constructor
+
+            @param output: the file to write the workbook to
+            @param name: the sheet name
+            @param title: the title for the first row of each sheet
+            @param headers: the column headers
+            @param timestamp: the datetime of the export
+        """
+
+        self.output = output
+        self.name = name
+        self.title = title
+        self.headers = headers
+        self.timestamp = timestamp
+
+        self.book = self.workbook()
+        self.styles()
+
+        self.sheets = 0
+        self.sheet = None
+        self.row = self.MAX_ROWS
+
+    # -------------------------------------------------------------------------
+    def workbook(self):
+
+        import xlwt
+        return xlwt.Workbook(encoding="utf-8")
+
+    # -------------------------------------------------------------------------
+    def styles(self):
+
+        import xlwt
+
+        styleLargeHeader = xlwt.XFStyle()
+        styleLargeHeader.font.bold = True
+        styleLargeHeader.font.height = 400
+        styleLargeHeader.alignment.horz = styleLargeHeader.alignment.HORZ_CENTER
+        styleLargeHeader.pattern.pattern = styleLargeHeader.pattern.SOLID_PATTERN
+        styleLargeHeader.pattern.pattern_fore_colour = S3XLS.LARGE_HEADER_COLOUR
+
+        settings = current.deployment_settings
+        datetime_format = S3XLS.dt_format_translate(settings.get_L10n_datetime_format())
+
+        styleHeader = xlwt.XFStyle()
+        styleHeader.font.bold = True
+        styleHeader.num_format_str = datetime_format
+        styleHeader.pattern.pattern = styleHeader.pattern.SOLID_PATTERN
+        styleHeader.pattern.pattern_fore_colour = S3XLS.HEADER_COLOUR
+
+        styleSubHeader = xlwt.XFStyle()
+        styleSubHeader.font.bold = True
+        styleSubHeader.pattern.pattern = styleHeader.pattern.SOLID_PATTERN
+        styleSubHeader.pattern.pattern_fore_colour = S3XLS.SUB_HEADER_COLOUR
+
+        styleOdd = xlwt.XFStyle()
+        styleOdd.pattern.pattern = styleOdd.pattern.SOLID_PATTERN
+        styleOdd.pattern.pattern_fore_colour = S3XLS.ROW_ALTERNATING_COLOURS[0]
+
+        styleEven = xlwt.XFStyle()
+        styleEven.pattern.pattern = styleEven.pattern.SOLID_PATTERN
+        styleEven.pattern.pattern_fore_colour = S3XLS.ROW_ALTERNATING_COLOURS[1]
+
+        self.styleLargeHeader = styleLargeHeader
+        self.styleHeader = styleHeader
+        self.styleSubHeader = styleSubHeader
+        self.styleRows = [styleEven, styleOdd]
+
+    # -------------------------------------------------------------------------
+    def new_sheet(self):
+        """ Start a new sheet with the title and header rows """
+
+        self.sheets += 1
+        if self.sheets > 1:
+            name = "%s (%s)" % (self.name, self.sheets)
+        else:
+            name = self.name
+        sheet = self.book.add_sheet(name[:31])
+        self.sheet = sheet
+
+        # Title row
+        last = max(len(self.headers) - 1, 1)
+        sheet.write_merge(0, 0, 0, last - 1, self.title, self.styleLargeHeader)
+        currentRow = sheet.row(0)
+        currentRow.write(last, self.timestamp, self.styleHeader)
+        currentRow.height = 440
+
+        # Header row
+        currentRow = sheet.row(1)
+        self.widths = []
+        for col, header in enumerate(self.headers):
+            currentRow.write(col, header, self.styleHeader)
+            width = len(header) * S3XLS.COL_WIDTH_MULTIPLIER
+            self.widths.append(width)
+            sheet.col(col).width = width
+
+        # fix the size of the last column to display the date
+        width = 16 * S3XLS.COL_WIDTH_MULTIPLIER
+        if last >= len(self.widths) or width > self.widths[last]:
+            sheet.col(last).width = width
+
+        sheet.panes_frozen = True
+        sheet.horz_split_pos = 2
+        self.row = 2
+
+    # -------------------------------------------------------------------------
+    def next_row(self):
+
+        if self.row >= self.MAX_ROWS:
+            self.new_sheet()
+        row = self.row
+        self.row += 1
+        return row
+
+    # -------------------------------------------------------------------------
+    def write_subheading(self, text):
+
+        row = self.next_row()
+        self.sheet.write_merge(row, row, 0, max(len(self.headers) - 1, 0),
+                               text, self.styleSubHeader)
+
+    # -------------------------------------------------------------------------
+    def write_row(self, values):
+
+        row = self.next_row()
+        style = self.styleRows[row % 2]
+        sheet = self.sheet
+        currentRow = sheet.row(row)
+        widths = self.widths
+        for col, value in enumerate(values):
+            currentRow.write(col, value, style)
+            width = len(value) * S3XLS.COL_WIDTH_MULTIPLIER
+            if width > widths[col]:
+                widths[col] = width
+                sheet.col(col).width = width
+
+    # -------------------------------------------------------------------------
+    def close(self):
+
+        if self.sheet is None:
+            self.new_sheet()
+        self.book.save(self.output)
+
+# =============================================================================
+
+class S3XLSXBook(S3XLSBook):
+    """
+        Microsoft Excel (XLSX) workbook writer using XlsxWriter in
+        constant-memory mode (rows are flushed to disk as they are
+        written), continues on a new sheet when a sheet is full.
+    """
+
+    MAX_ROWS = 1048576
+
+    # -------------------------------------------------------------------------
+    def workbook(self):
+
+        import xlsxwriter
+        return xlsxwriter.Workbook(self.output, {"constant_memory": True})
+
+    # -------------------------------------------------------------------------
+    def styles(self):
+
+        add_format = self.book.add_format
+        colour = self.colour
+
+        settings = current.deployment_settings
+        datetime_format = S3XLS.dt_format_translate(settings.get_L10n_datetime_format())
+
+        self.styleLargeHeader = add_format({"bold": True,
+                                            "font_size": 20,
+                                            "align": "center",
+                                            "bg_color": colour(S3XLS.LARGE_HEADER_COLOUR)})
+        self.styleHeader = add_format({"bold": True,
+                                       "num_format": datetime_format,
+                                       "bg_color": colour(S3XLS.HEADER_COLOUR)})
+        self.styleSubHeader = add_format({"bold": True,
+                                          "bg_color": colour(S3XLS.SUB_HEADER_COLOUR)})
+        self.styleRows = [add_format({"bg_color": colour(c)})
+                          for c in reversed(S3XLS.ROW_ALTERNATING_COLOURS)]
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def colour(index):
+        """ RGB colour for an index in the default XLS palette """
+
+        palette = {0x18: "#9999FF",
+                   0x2A: "#CCFFCC",
+                   0x2B: "#FFFF99",
+                   0x2C: "#99CCFF"}
+        return palette.get(index, "#FFFFFF")
+
+    # -------------------------------------------------------------------------
+    def new_sheet(self):
+        """ Start a new sheet with the title and header rows """
+
+        if self.sheet is not None:
+            self.set_widths()
+        self.sheets += 1
+        if self.sheets > 1:
+            name = "%s (%s)" % (self.name, self.sheets)
+        else:
+            name = self.name
+        sheet = self.book.add_worksheet(name[:31])
+        self.sheet = sheet
+
+        # Title row
+        last = max(len(self.headers) - 1, 1)
+        if last > 1:
+            sheet.merge_range(0, 0, 0, last - 1, self.title, self.styleLargeHeader)
+        else:
+            sheet.write_string(0, 0, self.title, self.styleLargeHeader)
+        sheet.write_datetime(0, last, self.timestamp, self.styleHeader)
+        sheet.set_row(0, 22)
+
+        # Header row
+        for col, header in enumerate(self.headers):
+            sheet.write_string(1, col, header, self.styleHeader)
+        self.widths = [len(header) for header in self.headers]
+
+        sheet.freeze_panes(2, 0)
+        self.row = 2
+
+    # -------------------------------------------------------------------------
+    def write_subheading(self, text):
+
+        row = self.next_row()
+        last = max(len(self.headers) - 1, 0)
+        if last:
+            self.sheet.merge_range(row, 0, row, last, text, self.styleSubHeader)
+        else:
+            self.sheet.write_string(row, 0, text, self.styleSubHeader)
+
+    # -------------------------------------------------------------------------
+    def write_row(self, values):
+
+        row = self.next_row()
+        style = self.styleRows[row % 2]
+        write_string = self.sheet.write_string
+        widths = self.widths
+        for col, value in enumerate(values):
+            write_string(row, col, value, style)
+            if len(value) > widths[col]:
+                widths[col] = len(value)
+
+    # -------------------------------------------------------------------------
+    def set_widths(self):
+        """
+            Set the column widths of the current sheet (these are
+            only written when the workbook is closed, so they can
+            still be set after the rows have been flushed)
+        """
+
+        factor = S3XLS.COL_WIDTH_MULTIPLIER / 256.0
+        last = max(len(self.headers) - 1, 1)
+        for col, width in enumerate(self.widths):
+            if col == last:
+                # fix the size of the last column to display the date
+                width = max(width, 16)
+            self.sheet.set_column(col, col, width * factor)
+
+    # -------------------------------------------------------------------------
+    def close(self):
+
+        if self.sheet is None:
+            self.new_sheet()
+        self.set_widths()
+        self.book.close()
+
 # End =========================================================================
@@ -159,10 +159,13 @@ class DataFrame(OrderedDict):
         for n, a, f in pystaggrelite3.getaggregators():
             self.bind_aggregate(n, a, f)
 
-        # holds the factors conditions (and all the data values)
-        # maybe this should be built on the fly for necessary
-        # columns only?
-        self.conditions = DictSet([(n, self[n]) for n in self.names()]) 
+        # holds the factors conditions (and all the data values),
+        # built on the fly when first needed after the data changed
+        self._conditions = None
+
+        # key (subset, where, index) of the current sqlite3 table TBL,
+        # None if TBL needs to be rebuilt
+        self._tbl_key = None
 
         # prints the sqlite3 queries to stdout before
         # executing them for debugging purposes
@@ -180,6 +183,25 @@ class DataFrame(OrderedDict):
         self.aggregates.append(name)
         self.aggregates = tuple(self.aggregates)
 
+    def _get_conditions(self):
+        if self._conditions is None:
+            self._conditions = DictSet([(n, self[n]) for n in self.names()])
+        return self._conditions
+
+    def _set_conditions(self, conditions):
+        self._conditions = conditions
+
+    conditions = property(_get_conditions, _set_conditions)
+
+    def _invalidate(self):
+        """
+        private method to be called whenever the data change
+
+          drops the conditions and the cached sqlite3 table
+        """
+        self._conditions = None
+        self._tbl_key = None
+
     def read_tbl(self, fname, skip=0, delimiter=',',labels=True):
         """
         loads tabulated data from a plain text file
@@ -243,7 +265,52 @@ class DataFrame(OrderedDict):
             super(DataFrame, self).__setitem__(name_type, v)
             
         del d
-        self.conditions = DictSet([(n,self[n]) for n in self.names()])
+        self._invalidate()
+
+    def read_columns(self, columns):
+        """
+        loads data in bulk from column arrays
+
+          columns should be a list of (label, values) tuples or a
+          mapping of labels to values (use an OrderedDict to keep the
+          order of the columns). The values can be any iterables.
+        """
+        if hasattr(columns, 'items'):
+            columns = columns.items()
+
+        d = OrderedDict()
+        for k, v in columns:
+            d[str(k)] = list(v)
+
+        if len(set(len(v) for v in d.values())) > 1:
+            raise Exception('columns have unequal lengths')
+
+        self.clear()
+        for k, v in d.items():
+            name_type = (k, self._check_sqlite3_type(v))
+            super(DataFrame, self).__setitem__(name_type, v)
+
+        del d
+        self._invalidate()
+
+    def read_cursor(self, cursor, arraysize=1000):
+        """
+        loads data in bulk from the result set of a DB-API 2.0 cursor
+
+          The cursor must have executed a query. The column labels are
+          taken from cursor.description, the rows are fetched in chunks
+          of arraysize.
+        """
+        names = [desc[0] for desc in cursor.description]
+        columns = [[] for n in names]
+        while True:
+            rows = cursor.fetchmany(arraysize)
+            if not rows:
+                break
+            for column, values in zip(columns, zip(*rows)):
+                column.extend(values)
+
+        self.read_columns(zip(names, columns))
 
     def __contains__(self, key):
         return key in self.names()
@@ -275,7 +342,7 @@ class DataFrame(OrderedDict):
             if name in self.names() and dtype != self.typesdict()[name]:
                 del self[name]
             super(DataFrame, self).__setitem__((name, dtype), item)
-            self.conditions[name] = self[key]
+            self._invalidate()
             return
 
         # string, no where conditions to handle
@@ -289,7 +356,7 @@ class DataFrame(OrderedDict):
             if name in self.names():
                 del self[name]
             super(DataFrame, self).__setitem__((name, dtype), item)
-            self.conditions[name] = self[key]
+            self._invalidate()
             return
 
         # string, with where conditions to handle    
@@ -304,7 +371,7 @@ class DataFrame(OrderedDict):
                             'of conditions in selection')
         for i,v in zip(indices, item):
             self[name][i] = v
-        self.conditions[name] = self[key]
+        self._invalidate()
 
     def __getitem__(self, key):
         """
@@ -336,8 +403,8 @@ class DataFrame(OrderedDict):
             key = str(key)
             name_type = (key, self.typesdict()[key])
             
-        del self.conditions[key]
         super(DataFrame, self).__delitem__(name_type)
+        self._invalidate()
         
     def __str__(self):
         """
@@ -500,7 +567,7 @@ class DataFrame(OrderedDict):
         self._execute(query)
         
 
-    def _build_sqlite3_tbl(self, nsubset, where=None):
+    def _build_sqlite3_tbl(self, nsubset, where=None, index=None):
         """
         build or rebuild sqlite table with columns in nsubset based on
         the where list
@@ -511,6 +578,14 @@ class DataFrame(OrderedDict):
           should contain value for the operator.
 
           where can also be a list of strings. or a single string.
+
+          index can be a list of columns in nsubset to index the
+          table on.
+
+          The table is kept until the DataFrame is mutated, so
+          repeated calls with the same arguments reuse it. Changing
+          the values of a column list in-place is not tracked, call
+          _invalidate() afterwards.
         """
         if where == None:
             where = []
@@ -525,6 +600,12 @@ class DataFrame(OrderedDict):
                              % type(where).__name__)
 
         nsubset = map(str, nsubset)
+        index = [str(n) for n in index or [] if str(n) in nsubset]
+
+        key = (tuple(nsubset), repr(where), tuple(index))
+        if key == self._tbl_key:
+            return
+        self._tbl_key = None
 
         #  2. Figure out which columns need to go into the table
         #     to be able to filter the data
@@ -540,37 +621,32 @@ class DataFrame(OrderedDict):
         # orders nsubset2 to match the order in self.names()
         nsubset2 = [n for n in self.names() if n in nsubset2]
 
-        #  3. Build a table
+        #  3. Build a table, if there is no where list we can insert
+        #     the data straight into TBL
         ##############################################################
         self.conn.commit()
+        self._execute('drop table if exists TBL')
         self._execute('drop table if exists TBL2')
 
-        self.conn.commit()
-        query =  'create temp table TBL2\n  ('
+        if where == []:
+            tbl = 'TBL'
+        else:
+            tbl = 'TBL2'
+        
+        query =  'create temp table %s\n  ('%tbl
         query += ', '.join('_%s_ %s'%(n, self.typesdict()[n]) for n in nsubset2)
         query += ')'
         self._execute(query)
 
         # build insert query
-        query = 'insert into TBL2 values ('
+        query = 'insert into %s values ('%tbl
         query += ','.join('?' for n in nsubset2) + ')'
         self._executemany(query, zip(*[self[n] for n in nsubset2]))
-        self.conn.commit()
 
         #  4. If where == None then we are done. Otherwise we need
         #     to build query to filter the rows
         ##############################################################
-        if where == []:
-            self._execute('drop table if exists TBL')
-            self.conn.commit()
-            
-            self._execute('alter table TBL2 rename to TBL')
-            self.conn.commit()
-        else:
-            # Initialize another temparary table
-            self._execute('drop table if exists TBL')
-            self.conn.commit()
-            
+        if where != []:
             query = []
             for n in nsubset:
                 query.append('_%s_ %s'%(n, self.typesdict()[n]))
@@ -615,11 +691,18 @@ class DataFrame(OrderedDict):
             
             # run query
             self._execute(query)
-            self.conn.commit()
 
             # delete TBL2
             self._execute('drop table if exists TBL2')
-            self.conn.commit()
+
+        #  5. Index the table
+        ##############################################################
+        if index:
+            self._execute('create index TBL_IDX on TBL (%s)'
+                          %', '.join('_%s_'%n for n in index))
+            
+        self.conn.commit()
+        self._tbl_key = key
 
     def _get_sqlite3_tbl_info(self):
         """
@@ -901,7 +984,7 @@ class DataFrame(OrderedDict):
             self[n].extend(copy(other[n]))
 
         # update state variables
-        self.conditions = DictSet([(n, self[n]) for n in self.names()])
+        self._invalidate()
 
     def insert(self, row):
         """
@@ -923,15 +1006,13 @@ class DataFrame(OrderedDict):
             if isinstance(row, list):
                 for (k, v) in row:
                     self[k] = [v]
-                    self.conditions[k] = [v]
             else:
                 for (k, v) in dict(row).items():
                     self[k] = [v]
-                    self.conditions[k] = [v]
         elif c - s == set():
             for (k, v) in dict(row).items():
                 self[k].append(v)
-                self.conditions[k].add(v)
+            self._invalidate()
         else:
             raise Exception('row must have the same keys as the table')
 
@@ -1976,7 +2057,7 @@ class PyvtTbl(list):
         #     specified by val, rows, and cols. Also eliminate
         #     rows that meet the exclude conditions      
         ##############################################################
-        df._build_sqlite3_tbl([val] + rows + cols, where)
+        df._build_sqlite3_tbl([val] + rows + cols, where, index=rows + cols)
         
         #  3. Build rnames and cnames lists
         ##############################################################
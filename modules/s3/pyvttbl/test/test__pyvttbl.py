@@ -693,6 +693,64 @@ class Test_insert(unittest.TestCase):
         df=DataFrame()
         df.insert([('A',1.23), ('B',2), ('C','A')])
         self.assertEqual(df.types(), ('real', 'integer', 'text'))
+
+    def test5(self):
+        df=DataFrame()
+        df.insert({'A':1, 'B':2})
+        self.assertEqual(df.conditions['A'], set([1]))
+        
+        df.insert({'A':3, 'B':2})
+        self.assertEqual(df.conditions['A'], set([1,3]))
+        
+class Test_read_columns(unittest.TestCase):
+    def test0(self):
+        df=DataFrame()
+        df.read_columns([('A',[1,2,3]), ('B',[1.5,2.5,3.5]), ('C','abc')])
+
+        self.assertEqual(df.names(), ('A', 'B', 'C'))
+        self.assertEqual(df.types(), ('integer', 'real', 'text'))
+        self.assertEqual(df['C'], ['a', 'b', 'c'])
+        self.assertEqual(df.conditions['A'], set([1,2,3]))
+
+    def test1(self):
+        df=DataFrame()
+
+        with self.assertRaises(Exception) as cm:
+            df.read_columns([('A',[1,2,3]), ('B',[1,2])])
+
+        self.assertEqual(str(cm.exception),
+                         'columns have unequal lengths')
+
+    def test2(self):
+        import sqlite3
+        conn = sqlite3.connect(':memory:')
+        cur = conn.cursor()
+        cur.execute('create table T (A integer, B text)')
+        cur.executemany('insert into T values (?,?)',
+                        [(i, 'b%i'%(i%3)) for i in range(10)])
+        cur.execute('select A, B from T order by A')
+        
+        df=DataFrame()
+        df.read_cursor(cur, arraysize=3)
+
+        self.assertEqual(df.names(), ('A', 'B'))
+        self.assertEqual(df['A'], range(10))
+        self.assertEqual(df.conditions['B'], set(['b0','b1','b2']))
+
+    def test3(self):
+        df=DataFrame()
+        df.read_columns([('A',[1,2,1,2]), ('B',[1,2,3,4])])
+        self.assertEqual(df.pivot('B', rows=['A'], aggregate='sum'),
+                         [[4], [6]])
+
+        # the table is cached until the data change
+        df.pivot('B', rows=['A'], aggregate='count')
+        self.assertEqual(df._tbl_key, (('B', 'A'), '[]', ('A',)))
+        
+        df.insert({'A':1, 'B':5})
+        self.assertEqual(df._tbl_key, None)
+        self.assertEqual(df.pivot('B', rows=['A'], aggregate='sum'),
+                         [[9], [6]])
         
 class Test_attach(unittest.TestCase):
     def test0(self):
@@ -2132,6 +2190,7 @@ def suite():
             unittest.makeSuite(Test_pt__str__),
             unittest.makeSuite(Test_pt__repr__),
             unittest.makeSuite(Test_insert),
+            unittest.makeSuite(Test_read_columns),
             unittest.makeSuite(Test_attach),
             unittest.makeSuite(Test_sort),
             unittest.makeSuite(Test_pivot_1),
@@ -40,6 +40,7 @@ __all__ = ["S3CRUD"]
 
 import datetime
 import os
+import re
 import sys
 import csv
 import cgi
@@ -55,7 +56,7 @@ from s3export import S3Exporter
 from s3gis import S3MAP
 from s3pdf import S3PDF
 from s3tools import SQLTABLES3
-from s3utils import s3_mark_required
+from s3utils import s3_mark_required, s3_table_changed
 
 from lxml import etree
 # *****************************************************************************
@@ -66,6 +67,9 @@ class S3CRUD(S3Method):
 
     """
 
+    APPROX_COUNT = 100000 # estimate SSPag counts for larger tables
+    SEEK_POINTS = 50 # max number of keyset pagination points per session
+
     # -------------------------------------------------------------------------
     def apply_method(self, r, **attr):
         """
@@ -862,7 +866,7 @@ class S3CRUD(S3Method):
             # response (avoids the dataTables Ajax request unless the user
             # tries nagivating around)
             if not response.s3.no_sspag and items:
-                totalrows = self.resource.count()
+                totalrows = self.ssp_count()
                 if totalrows:
                     if response.s3.dataTable_iDisplayLength:
                         limit = 2 * response.s3.dataTable_iDisplayLength
@@ -925,7 +929,7 @@ class S3CRUD(S3Method):
                 self.resource.build_query(filter=response.s3.filter,
                                           vars=session.s3.filter)
 
-            displayrows = totalrows = self.resource.count(distinct=distinct)
+            displayrows = totalrows = self.ssp_count(distinct=distinct)
 
             # SSPag dynamic filter?
             if vars.sSearch:
@@ -934,8 +938,8 @@ class S3CRUD(S3Method):
                                          left=left)
                 if squery is not None:
                     self.resource.add_filter(squery)
-                    displayrows = self.resource.count(left=left,
-                                                      distinct=distinct)
+                    displayrows = self.ssp_count(left=left,
+                                                 distinct=distinct)
 
             # SSPag sorting
             if vars.iSortingCols and orderby is None:
@@ -956,6 +960,7 @@ class S3CRUD(S3Method):
                                   linkto=linkto,
                                   download_url=self.download_url,
                                   as_page=True,
+                                  seek=True,
                                   format=representation) or []
 
             result = dict(sEcho = sEcho,
@@ -1045,6 +1050,7 @@ class S3CRUD(S3Method):
                  no_ids=False,
                  as_page=False,
                  as_list=False,
+                 seek=False,
                  format=None):
         """
             DRY helper function for SQLTABLEs in CRUD
@@ -1059,6 +1065,7 @@ class S3CRUD(S3Method):
             @param download_url: the default download URL of the application
             @param as_page: return the list as JSON page
             @param as_list: return the list as Python list
+            @param seek: use keyset pagination if possible, see ssp_seek
             @param format: the representation format
         """
 
@@ -1091,10 +1098,53 @@ class S3CRUD(S3Method):
         if left is not None:
             attributes.update(left=left)
 
+        # Keyset pagination
+        seek_field = None
+        if seek and limitby is not None and not distinct:
+            seek_field, seek_desc = self.ssp_seek_field(table, orderby)
+        if seek_field is not None:
+            if seek_desc:
+                orderby = ~seek_field | ~table._id
+            else:
+                orderby = seek_field | table._id
+            attributes.update(orderby=orderby)
+            seek_key = str(hash((str(query), str(left), str(orderby))))
+            seek_points = self.ssp_seek_points(seek_key)
+            point = seek_points.get(limitby[0], None)
+            if point is not None:
+                # Seek to the last row of the previous page
+                value, last_id = point
+                if seek_desc:
+                    next_id = (table._id < last_id)
+                else:
+                    next_id = (table._id > last_id)
+                # NULLs sort as the highest values on PostgreSQL, but as
+                # the lowest on MySQL and SQLite
+                nulls_first = (db._dbname == "postgres") == seek_desc
+                if value is None:
+                    seek_query = (seek_field == None) & next_id
+                    if nulls_first:
+                        seek_query |= (seek_field != None)
+                else:
+                    if seek_desc:
+                        seek_query = (seek_field < value)
+                    else:
+                        seek_query = (seek_field > value)
+                    seek_query |= (seek_field == value) & next_id
+                    if not nulls_first and not seek_field.notnull:
+                        seek_query |= (seek_field == None)
+                query &= seek_query
+                attributes.update(limitby=(0, limitby[1] - limitby[0]))
+
         # Fields in the query
         qfields = [f.field for f in lfields if f.field is not None]
         if no_ids:
             qfields.insert(0, table._id)
+        if seek_field is not None:
+            qf = [str(f) for f in qfields]
+            for f in (table._id, seek_field):
+                if str(f) not in qf:
+                    qfields.append(f)
 
         # Add orderby fields which are not in qfields
         if distinct and orderby is not None:
@@ -1126,6 +1176,15 @@ class S3CRUD(S3Method):
         if not rows:
             return None
 
+        # Remember the seek point for the next page
+        if seek_field is not None:
+            last = rows.last()
+            if table._tablename in last and \
+               isinstance(last[table._tablename], Row):
+                last = last[table._tablename]
+            value = last[seek_field.name]
+            seek_points[limitby[0] + len(rows)] = (value, last[table._id.name])
+
         # Fields to show
         row = rows.first()
         def __expand(tablename, row, lfields=lfields):
@@ -1361,6 +1420,9 @@ class S3CRUD(S3Method):
                 # Execute onaccept
                 callback(onaccept, form, tablename=tablename)
 
+                # Invalidate caches of data from this table
+                s3_table_changed(tablename)
+
         if not logged and not form.errors:
             audit("read", prefix, name,
                   record=record_id, representation=format)
@@ -1964,16 +2026,23 @@ class S3CRUD(S3Method):
                     r = requires[0]
                     if isinstance(r, IS_EMPTY_OR):
                         r = r.other
-                    try:
-                        options = r.options()
-                    except:
-                        continue
-                    vlist = []
-                    for (value, text) in options:
-                        if str(text).lower().find(context) != -1:
-                            vlist.append(value)
-                    if vlist:
-                        query = field.belongs(vlist)
+                    # Match the labels in the key table if possible
+                    lookup = None
+                    if hasattr(r, "lookup"):
+                        lookup = r.lookup(context)
+                    if lookup is not None:
+                        query = field.belongs(lookup)
+                    else:
+                        try:
+                            options = r.options()
+                        except:
+                            continue
+                        vlist = []
+                        for (value, text) in options:
+                            if str(text).lower().find(context) != -1:
+                                vlist.append(value)
+                        if vlist:
+                            query = field.belongs(vlist)
                 else:
                     continue
             elif str(field.type) in ("string", "text"):
@@ -1990,6 +2059,85 @@ class S3CRUD(S3Method):
 
         return searchq
 
+    # -------------------------------------------------------------------------
+    def ssp_count(self, left=None, distinct=False):
+        """
+            Count the records for SSPag: exact for small tables, but for
+            tables with more than APPROX_COUNT records estimated from the
+            query plan (PostgreSQL only)
+
+            @param left: list of left joins
+            @param distinct: count distinct records
+        """
+
+        db = current.db
+        resource = self.resource
+        table = resource.table
+
+        estimate = None
+        if db._dbname == "postgres":
+            try:
+                sql = "SELECT reltuples FROM pg_class WHERE relname='%s';" % \
+                      table._tablename
+                rows = db.executesql(sql)
+                if rows and rows[0][0] > self.APPROX_COUNT:
+                    sql = db(resource.get_query())._select(table._id,
+                                                           left=left,
+                                                           distinct=distinct)
+                    plan = db.executesql("EXPLAIN %s" % sql)
+                    match = re.search("rows=(\d+)", plan[0][0])
+                    if match:
+                        estimate = int(match.group(1))
+            except:
+                estimate = None
+        if estimate is None:
+            return resource.count(left=left, distinct=distinct)
+        return estimate
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def ssp_seek_field(table, orderby):
+        """
+            Get the field to seek on for keyset pagination, i.e. if the
+            list is ordered by a single field of the table
+
+            @param table: the table
+            @param orderby: the orderby
+            @returns: tuple (field, descending), field is None if the
+                      orderby is not suitable for keyset pagination
+        """
+
+        if isinstance(orderby, Field):
+            orderby = str(orderby)
+        if not orderby or not isinstance(orderby, str) or "," in orderby:
+            return (None, False)
+        parts = orderby.split()
+        if len(parts) > 2:
+            return (None, False)
+        tn, fn = ([table._tablename] + parts[0].split(".", 1))[-2:]
+        if tn != table._tablename or fn not in table.fields:
+            return (None, False)
+        desc = len(parts) == 2 and parts[1].lower() == "desc"
+        return (table[fn], desc)
+
+    # -------------------------------------------------------------------------
+    def ssp_seek_points(self, key):
+        """
+            Get the keyset pagination points {start: (value, id)} of the
+            current list (as identified by key) from the session
+
+            @param key: the list key (query, joins and orderby)
+        """
+
+        session = current.session
+        seek = session.s3.ssp_seek
+        if not seek or seek.get("key", None) != key:
+            seek = session.s3.ssp_seek = dict(key=key, points={})
+        points = seek["points"]
+        if len(points) > self.SEEK_POINTS:
+            points.clear()
+        return points
+
     # -------------------------------------------------------------------------
     def ssp_orderby(self, table, fields, left=[]):
         """
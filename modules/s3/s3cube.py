@@ -9,6 +9,7 @@
     @license: MIT
 
     @requires: U{B{I{Python 2.7}} <http://www.python.org>}
+        (for aggregates other than count, sum, avg, min and max:)
     @requires: U{B{I{SciPy}} <http://www.scipy.org>}
     @requires: U{B{I{NumPy}} <http://www.numpy.org>}
     @requires: U{B{I{MatPlotLib}} <http://matplotlib.sourceforge.net>}
@@ -44,6 +45,7 @@ import sys
 from gluon import current
 from gluon.storage import Storage
 from gluon.html import *
+from gluon.dal import Expression
 try:
     from pyvttbl import DataFrame
     PYVTTBL = True
@@ -62,6 +64,9 @@ from s3crud import S3CRUD
 class S3Cube(S3CRUD):
     """ RESTful method handler to generate contingency tables """
 
+    # Aggregate functions which can be computed by the database
+    SQL_AGGREGATES = ("count", "sum", "avg", "min", "max")
+
     def __init__(self):
 
         pass
@@ -72,9 +77,6 @@ class S3Cube(S3CRUD):
 
         response = current.response
 
-        if not PYVTTBL:
-            r.error(501, "Function not available on this server")
-
         if r.interactive:
 
             # Get rows, cols, fact and aggregate from URL
@@ -106,17 +108,25 @@ class S3Cube(S3CRUD):
             if self.fact and self.fact not in fields:
                 fields.append(self.fact)
             list_fields = list(fields)
-            lfields, join = self.get_list_fields(self.resource.table, list_fields)
+            lfields, joins = self.get_list_fields(self.resource.table, list_fields)
             lfields = Storage([(f.fieldname, f) for f in lfields])
 
-            # Get the items
-            items = self.sqltable(list_fields, as_list=True)
-            if items:
-                # Map the items into a data frame
-                df = DataFrame()
+            pt = None
+            if self.aggregate in self.SQL_AGGREGATES and \
+               not [f for f in fields if not lfields[f] or lfields[f].field is None]:
+                # Aggregate in the database
+                pt = self.pivot(lfields, joins)
+                items = pt is not None
+            else:
+                if not PYVTTBL:
+                    r.error(501, "Function not available on this server")
+                # Get the items
+                items = self.sqltable(list_fields, as_list=True)
+            if items and pt is None:
+                # Map the items into the columns of a data frame
+                columns = Storage([(field, []) for field in fields])
                 for row in items:
-                    frow = Storage()
-                    for field in fields:
+                    for field in columns:
                         lfield = lfields[field]
                         tname = lfield.tname
                         fname = lfield.fname
@@ -126,8 +136,9 @@ class S3Cube(S3CRUD):
                             value = row[tname][fname]
                         else:
                             value = None
-                        frow[field] = value
-                    df.insert(frow)
+                        columns[field].append(value)
+                df = DataFrame()
+                df.read_columns(columns)
                 # Pivot table
                 try:
                     pt = df.pivot(self.fact, self.rows, self.cols,
@@ -136,6 +147,7 @@ class S3Cube(S3CRUD):
                     r.error(400, "Could not generate contingency table",
                             next=r.url(method=""))
 
+            if items:
                 items = S3ContingencyTable(pt,
                                            rows=self.rows,
                                            cols=self.cols,
@@ -162,6 +174,100 @@ class S3Cube(S3CRUD):
 
         return output
 
+    # -------------------------------------------------------------------------
+    def pivot(self, lfields, joins):
+        """
+            Aggregate the fact per distinct row and column keys with a
+            single grouped query in the database
+
+            @param lfields: the list fields (as returned from
+                            get_list_fields), keyed by field name
+            @param joins: the joins for the list fields
+
+            @returns: a S3PivotTable, or None if there are no records
+        """
+
+        db = current.db
+
+        query = self.resource.get_query()
+        for j in joins.values():
+            query &= j
+
+        rfields = [lfields[f].field for f in self.rows]
+        cfields = [lfields[f].field for f in self.cols]
+        keys = rfields + cfields
+
+        ffield = lfields[self.fact].field
+        aggregate = self.aggregate
+        if aggregate == "count":
+            value = ffield.count()
+        else:
+            if aggregate == "avg":
+                ftype = "double"
+            else:
+                ftype = ffield.type
+            value = Expression(db, db._adapter.AGGREGATE, ffield,
+                               aggregate.upper(), ftype)
+
+        groupby = keys[0]
+        for key in keys[1:]:
+            groupby |= key
+        rows = db(query).select(value, groupby=groupby, *keys)
+        if not rows:
+            return None
+
+        cells = {}
+        rkeys = set()
+        ckeys = set()
+        for row in rows:
+            rkey = tuple([row[f] for f in rfields])
+            ckey = tuple([row[f] for f in cfields])
+            rkeys.add(rkey)
+            ckeys.add(ckey)
+            cells[(rkey, ckey)] = row[value]
+
+        return S3PivotTable(cells,
+                            rows=self.rows,
+                            cols=self.cols,
+                            rkeys=sorted(rkeys),
+                            ckeys=sorted(ckeys))
+
+# =============================================================================
+
+class S3PivotTable(object):
+    """
+        Contingency table from a grouped query, with the same interface
+        as the pyvttbl pivot table (as far as used by S3ContingencyTable)
+    """
+
+    def __init__(self, cells, rows=[], cols=[], rkeys=[], ckeys=[]):
+        """
+            Constructor
+
+            @param cells: dict {(row key, col key): value}
+            @param rows: the row field names
+            @param cols: the column field names
+            @param rkeys: the distinct row keys (tuples of values), in order
+            @param ckeys: the distinct column keys (tuples of values), in order
+        """
+
+        self.cells = cells
+        self.rkeys = rkeys
+        self.ckeys = ckeys
+        self.rnames = [zip(rows, rkey) for rkey in rkeys]
+        self.cnames = [zip(cols, ckey) for ckey in ckeys]
+
+    def __iter__(self):
+
+        cells = self.cells
+        ckeys = self.ckeys
+        for rkey in self.rkeys:
+            yield [cells.get((rkey, ckey)) for ckey in ckeys]
+
+    def __len__(self):
+
+        return len(self.rkeys)
+
 # =============================================================================
 
 class S3ContingencyTable(TABLE):
@@ -513,9 +513,16 @@ class GIS(object):
             e.g. to use in GPX export for correct zooming
             Ensure a minimum size of bounding box, and that the points
             are inset from the border.
+            The bounds of the current config (no features) are calculated
+            once per request.
             @ToDo: Optimised Geospatial routines rather than this crude hack
         """
 
+        if not features:
+            bounds = current.response.s3.gis.bounds
+            if bounds:
+                return dict(bounds)
+
         config = self.get_config()
 
         # Minimum Bounding Box
@@ -593,7 +600,10 @@ class GIS(object):
         max_lon = min(config.max_lon, max_lon)
         max_lat = min(config.max_lat, max_lat)
 
-        return dict(min_lon=min_lon, min_lat=min_lat, max_lon=max_lon, max_lat=max_lat)
+        bounds = dict(min_lon=min_lon, min_lat=min_lat, max_lon=max_lon, max_lat=max_lat)
+        if not features:
+            current.response.s3.gis.bounds = dict(bounds)
+        return bounds
 
     # -------------------------------------------------------------------------
     def _lookup_parent_path(self, feature_id):
@@ -1080,6 +1090,7 @@ class GIS(object):
         # Store the values if they were found.
         if cache:
             response.s3.gis.config = cache
+            response.s3.gis.bounds = None
             self.update_gis_config_dependent_options()
             if set_in_session:
                 session.s3.gis_config_id = config_id
@@ -1121,6 +1132,7 @@ class GIS(object):
 
         if response.s3.gis.saved_config:
             response.s3.gis.config = response.s3.gis.saved_config
+            response.s3.gis.bounds = None
         else:
             self.set_config(session.s3.gis_config_id)
         self.update_gis_config_dependent_options()
@@ -1883,32 +1895,44 @@ class GIS(object):
             symbology = config.symbology_id
             marker = None
 
+            # Lookups are memoised for the request
+            s3gis = current.response.s3.gis
+            if s3gis.feature_classes is None:
+                s3gis.feature_classes = {}
+            if s3gis.markers is None:
+                s3gis.markers = {}
+            markers = s3gis.markers
+
+            def get_marker(marker_id):
+                if marker_id not in markers:
+                    query = (table_marker.id == marker_id)
+                    markers[marker_id] = db(query).select(table_marker.image,
+                                                          table_marker.height,
+                                                          table_marker.width,
+                                                          limitby=(0, 1),
+                                                          cache=cache).first()
+                return markers[marker_id]
+
             # 1st choice for a Marker is the Feature Class's
-            query = (table_fclass.resource == tablename) & \
-                    (table_fclass.symbology_id == symbology)
-            fclasses = db(query).select(table_fclass.marker_id,
-                                        table_fclass.filter_field,
-                                        table_fclass.filter_value,
-                                        cache=cache)
+            key = (tablename, symbology)
+            fclasses = s3gis.feature_classes.get(key, None)
+            if fclasses is None:
+                query = (table_fclass.resource == tablename) & \
+                        (table_fclass.symbology_id == symbology)
+                fclasses = db(query).select(table_fclass.marker_id,
+                                            table_fclass.filter_field,
+                                            table_fclass.filter_value,
+                                            cache=cache)
+                s3gis.feature_classes[key] = fclasses
             if fclasses:
                 for row in fclasses:
                     if record and row.filter_field:
                         # Check if the record matches the filter
                         if record[row.filter_field] == int(row.filter_value):
-                            query = (table_marker.id == row.marker_id)
-                            marker = db(query).select(table_marker.image,
-                                                      table_marker.height,
-                                                      table_marker.width,
-                                                      limitby=(0, 1),
-                                                      cache=cache).first()
+                            marker = get_marker(row.marker_id)
                     else:
                         # No Filter so we match automatically
-                        query = (table_marker.id == row.marker_id)
-                        marker = db(query).select(table_marker.image,
-                                                  table_marker.height,
-                                                  table_marker.width,
-                                                  limitby=(0, 1),
-                                                  cache=cache).first()
+                        marker = get_marker(row.marker_id)
                     if marker:
                         # Return the 1st matching marker
                         return marker
@@ -1935,12 +1959,20 @@ class GIS(object):
         db = current.db
         table_fclass = db.gis_feature_class
 
+        # Lookups are memoised for the request
+        s3gis = current.response.s3.gis
+        if s3gis.gps_feature_classes is None:
+            s3gis.gps_feature_classes = {}
+
         # 1st choice for a Symbol is the Feature Class's
-        query = (table_fclass.resource == tablename)
-        fclasses = db(query).select(table_fclass.gps_marker,
-                                    table_fclass.filter_field,
-                                    table_fclass.filter_value,
-                                    cache=cache)
+        fclasses = s3gis.gps_feature_classes.get(tablename, None)
+        if fclasses is None:
+            query = (table_fclass.resource == tablename)
+            fclasses = db(query).select(table_fclass.gps_marker,
+                                        table_fclass.filter_field,
+                                        table_fclass.filter_value,
+                                        cache=cache)
+            s3gis.gps_feature_classes[tablename] = fclasses
         if fclasses:
             for row in fclasses:
                 if row.filter_field:
@@ -2568,12 +2600,17 @@ class GIS(object):
             http://eden.sahanafoundation.org/wiki/HaitiGISToDo#HierarchicalTrees
             Do a lazy update of a database that does not have location paths.
             For convenience of get_parents, return the path.
+
+            Also updates the search tokens of the location(s).
         """
 
+        from s3search import S3SearchIndex
+
         db = current.db
         table = db.gis_location
 
         if location_id:
+            S3SearchIndex.update("gis_location", location_id)
             if parent_id:
                 query = (table.id == parent_id)
                 parent = db(query).select(table.parent,
@@ -2626,6 +2663,8 @@ class GIS(object):
                                                       lat_min = _vars.lat_min,
                                                       lon_min = _vars.lon_min,
                                                       lon_max = _vars.lon_max)
+            # Also (re-)build the search tokens
+            S3SearchIndex.rebuild("gis_location")
 
     # -------------------------------------------------------------------------
     def wkt_centroid(self, form):
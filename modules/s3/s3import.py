@@ -56,6 +56,7 @@ from gluon.serializers import json
 from s3tools import SQLTABLES3
 from s3crud import S3CRUD
 from s3xml import S3XML
+from s3utils import s3_table_changed
 
 DEBUG = False
 if DEBUG:
@@ -2116,6 +2117,7 @@ class S3ImportItem(object):
                        model.get_config(tablename, "onaccept"))
             if onaccept:
                 callback(onaccept, form, tablename=self.tablename)
+            s3_table_changed(tablename)
 
         # Update referencing items
         if self.update and self.id:
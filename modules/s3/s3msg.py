@@ -184,6 +184,33 @@ class S3Msg(object):
         db.commit()
         return True
 
+    # -------------------------------------------------------------------------
+    def receive_sms_via_modem(self, timeout=None):
+        """
+            Function to drop the SMS received by the locally-attached Modem
+            into msg_log as they arrive
+            - to be run by the cron/sms_handler_modem.py script, with the
+              modem's reader thread started (GsmModem.start_reader)
+
+            @param timeout: seconds to wait for the next message before
+                            returning, None to wait indefinitely
+
+            @returns: the number of messages received
+        """
+
+        count = 0
+        while True:
+            msg = self.modem.next_message(ping=False,
+                                          fetch=False,
+                                          timeout=timeout)
+            if msg is None:
+                break
+            self.receive_msg(message = msg.text,
+                             fromaddress = msg.sender,
+                             pr_message_method = "SMS")
+            count += 1
+        return count
+
     # -------------------------------------------------------------------------
     # Outbound Messages
     # -------------------------------------------------------------------------
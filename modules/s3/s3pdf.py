@@ -43,8 +43,11 @@ import uuid
 import math
 import json
 import shutil
+import zipfile
+import tempfile
 import subprocess
 import unicodedata
+import multiprocessing
 try:
     from cStringIO import StringIO    # Faster, where available
 except:
@@ -79,6 +82,17 @@ except(ImportError):
     except(ImportError):
         print >> sys.stderr, "S3 Debug: S3PDF: Python Image Library not installed"
         PILImported = False
+try:
+    import numpy
+    numpyImported = True
+except(ImportError):
+    print >> sys.stderr, "S3 Debug: S3PDF: NumPy not installed"
+    numpyImported = False
+try:
+    from scipy import ndimage
+    ndimageImported = True
+except(ImportError):
+    ndimageImported = False
 try:
     from reportlab.lib.enums import TA_CENTER, TA_RIGHT
     from reportlab.pdfbase import pdfmetrics
@@ -306,6 +320,7 @@ class S3PDF(S3Method):
             OCR_DISABLED=T("OCR module is disabled. Ask the Server Administrator to enable it."),
             IMAGE_MAGICK_ERROR=T("ImageMagick Command Line tool is not installed. Ask the Server Administrator to install ImageMagick on Sahana Eden Server(s)."),
             NOT_PDF_FILE=T("Uploaded file is not a PDF file. Provide a Form in valid PDF Format."),
+            NOT_ZIP_FILE=T("Uploaded file is not a ZIP file. Provide the scanned Forms as ZIP file of page images."),
             INVALID_PDF=T("Uploaded PDF file has more/less number of page(s) than required. Check if you have provided appropriate revision for your Form as well as check the Form contains appropriate number of pages."),
             NO_UTC_OFFSET=T("No UTC offset found. Please set UTC offset in your 'User Profile' details. Example: UTC+0530"),
             INVALID_JOBID=T("The provided 'jobuuid' is invalid. The session of Form upload is invalid. You should retry uploading."),
@@ -409,7 +424,7 @@ class S3PDF(S3Method):
                                   report_hide_comments=report_hide_comments)
 
                 # build the document
-                doc = self.buildDoc()
+                doc = self.buildDoc(stream=True)
                 # Set content type and disposition headers
                 if response:
                     response.headers["Content-Type"] = contenttype(".pdf")
@@ -690,142 +705,9 @@ class S3PDF(S3Method):
                     datafile_content = data_file.read()
                     data_file.close()
 
-                    metatable = "ocr_meta"
-                    rows = db(db[metatable].form_uuid == formuuid).select()
-                    try:
-                        row = rows[0]
-                    except(IndexError):
-                        r.error(501, self.ERROR.INVALID_FORMID)
-
-                    s3ocrxml_filename = row.s3ocrxml_file
-                    f = open(os.path.join(r.folder,
-                                          "uploads",
-                                          "ocr_meta",
-                                          s3ocrxml_filename),
-                             "rb")
-                    s3ocrxml = f.read()
-                    f.close()
-
-                    s3ocrdict = self.__s3ocrxml2dict(s3ocrxml)
-                    crosslimit_options = {}
-                    for eachresource in s3ocrdict["$resource_seq"]:
-                        resource = s3ocrdict[eachresource]
-                        for eachfield in resource["$field_seq"]:
-                            field = resource[eachfield]
-                            if field.has_options:
-                                if field.options and\
-                                        field.options.count > MAX_FORM_OPTIONS_LIMIT:
-                                    if not crosslimit_options.has_key(eachresource):
-                                        crosslimit_options[eachresource] = [eachfield]
-                                    else:
-                                        crosslimit_options[eachresource].append(eachfield)
-
-                    if len(crosslimit_options) != 0:
-                        s3xml_root = etree.fromstring(datafile_content)
-                        resource_element = s3xml_root.getchildren()[0]
-                        resourcename = resource_element.attrib.get("name")
-                        for eachfield in resource_element:
-                            if eachfield.tag == "data":
-                                if crosslimit_options.has_key(resourcename):
-                                    fieldname = eachfield.attrib.get("field")
-                                    if fieldname in crosslimit_options[resourcename]:
-                                        match_status = {}
-                                        value = eachfield.text.encode("utf-8").lower()
-                                        for eachoption in s3ocrdict[resourcename][fieldname].options.list:
-                                            try:
-                                                fieldtext = eachoption.label.lower()
-                                            except:
-                                                fieldtext = ""
-                                            match_status[eachoption.value] =\
-                                                self.dameraulevenshtein(cast2ascii(fieldtext),
-                                                                        cast2ascii(value))
-                                            #print value, fieldtext, match_status[eachoption.value]
-
-                                        closematch_value = 1000000000
-                                        closematch = []
-
-                                        for eachmatch in match_status.keys():
-                                            if match_status[eachmatch] < closematch_value:
-                                                closematch = [eachmatch]
-                                                closematch_value = match_status[eachmatch]
-                                            elif match_status[eachmatch] == closematch_value:
-                                                closematch.append(eachmatch)
-
-                                        if len(closematch) > 0:
-                                            value = closematch[0]
-                                        else:
-                                            value = ""
-
-                                        eachfield.text = value
-                                        eachfield.attrib["value"] = value
-
-
-                            elif eachfield.tag == "resource":
-                                resourcename = eachfield.attrib.get("name")
-                                for eachsubfield in eachfield:
-                                    if eachsubfield.tag == "data":
-                                        fieldname = eachsubfield.attrib.get("field")
-                                        if resourcename in crosslimit_options.keys() and\
-                                                fieldname in crosslimit_options[resourcename]:
-                                            match_status = {}
-                                            value = eachsubfield.text.encode("utf-8").lower()
-                                            for eachoption in s3ocrdict[resourcename][fieldname].options.list:
-                                                try:
-                                                    fieldtext = eachoption.label.lower()
-                                                except:
-                                                    fieldtext = ""
-                                                match_status[eachoption.value] =\
-                                                    self.dameraulevenshtein(cast2ascii(fieldtext),
-                                                                            cast2ascii(value))
-                                                #print value, fieldtext, match_status[eachoption.value]
-
-                                            closematch_value = 1000000000
-                                            closematch = []
-
-                                            for eachmatch in match_status.keys():
-                                                if match_status[eachmatch] < closematch_value:
-                                                    closematch = [eachmatch]
-                                                    closematch_value = match_status[eachmatch]
-                                                elif match_status[eachmatch] == closematch_value:
-                                                    closematch.append(eachmatch)
-
-                                            if len(closematch) > 0:
-                                                value = closematch[0]
-                                            else:
-                                                value = ""
-
-                                            eachsubfield.text = value
-                                            eachsubfield.attrib["value"] = value
-
-                        datafile_content = etree.tostring(s3xml_root)
-
-                    #print datafile_content
-                    # import_xml routine
-                    outputjson = self.resource.import_xml(StringIO(datafile_content),
-                                                          commit_job=False,
-                                                          ignore_errors=True)
-
-                    #print etree.tostring(etree.fromstring(datafile_content), pretty_print=True)
-
-                    # get metadata for review
-                    jobuuid = self.resource.job.job_id
-                    json2dict = json.loads(outputjson, strict=False)
-
-                    if json2dict.has_key("message"):
-                        jobhaserrors = 1
-                    else:
-                        jobhaserrors = 0
-
-                    # check status code
-                    if json2dict.get("statuscode") != "200":
-                        r.error(501, self.ERROR.UNRECOVERABLE_ERROR)
-
-                    # store metadata for review
-                    db[statustable].insert(
-                        image_set_uuid=setuuid,
-                        form_uuid=formuuid,
-                        job_uuid=jobuuid,
-                        job_has_errors=jobhaserrors)
+                    jobuuid = self.__stageOCRData(formuuid,
+                                                  setuuid,
+                                                  datafile_content)
 
                     request = current.request
                     if r.component:
@@ -1034,6 +916,76 @@ class S3PDF(S3Method):
                     except(OSError):
                         shutil.rmtree(ocr_temp_dir)
 
+                elif uploadformat == "zip":
+
+                    fileholder = r.vars["zipfile"]
+                    # server side file validation
+                    filename = fileholder.filename
+                    extension = lambda m: m[m.rfind(".")+1:]
+
+                    if extension(filename) != "zip":
+                        r.error(501, self.ERROR.NOT_ZIP_FILE)
+
+                    (fd, zippath) = tempfile.mkstemp(suffix=".zip")
+                    f = os.fdopen(fd, "wb")
+                    shutil.copyfileobj(fileholder.file, f)
+                    f.close()
+
+                    # ocr all forms in the batch
+                    s3ocrimageparser = S3OCRImageParser(self, r)
+                    try:
+                        results = s3ocrimageparser.parse_batch(formuuid,
+                                                               zippath)
+                    finally:
+                        os.remove(zippath)
+
+                    # stage the data of each form as import job for review
+                    tablename = "ocr_data_xml"
+                    staged = 0
+                    for result in results:
+                        if result.error:
+                            _debug("OCR batch: set %s failed: %s" % \
+                                   (result.set_uuid, result.error))
+                            continue
+                        db[tablename].insert(image_set_uuid=result.set_uuid,
+                                             data_file=\
+                                                 db[tablename]["data_file"].store(\
+                                                     StringIO(result.output),
+                                                     "%s-data.xml" % result.set_uuid
+                                                     ),
+                                             form_uuid=formuuid,
+                                             )
+                        try:
+                            self.__stageOCRData(formuuid,
+                                                result.set_uuid,
+                                                result.output)
+                        except HTTP:
+                            # unrecoverable form => manual data entry
+                            continue
+                        staged += 1
+
+                    current.session.confirmation = \
+                        T("%(staged)s of %(total)s scanned forms imported for review") % \
+                            dict(staged=staged, total=len(results))
+
+                    request = current.request
+                    if r.component:
+                        # if component
+                        request_args = current.request.get("args",["",""])
+                        record_id = request_args[0]
+                        component_name = request_args[1]
+                        urlprefix = "%s/%s/%s" % (request.function,
+                                                  record_id,
+                                                  component_name)
+
+                    else:
+                        # if not a component
+                        urlprefix = request.function
+
+                    # redirect
+                    redirect(URL(current.request.controller,
+                                 "%s/upload.pdf" % urlprefix))
+
                 else:
                     r.error(501, self.ERROR.INVALID_IMAGE_TYPE)
 
@@ -1316,6 +1268,158 @@ class S3PDF(S3Method):
             r.error(501, self.manager.ERROR.BAD_REQUEST)
     # End of apply_method()
 
+    def __stageOCRData(self, formuuid, setuuid, datafile_content):
+        """
+            Import the OCR data of a set of page images as import job
+            (uncommitted, for review)
+
+            @param formuuid: the form UUID
+            @param setuuid: the image set UUID
+            @param datafile_content: the OCR data XML
+
+            @returns: the job UUID
+        """
+
+        db = current.db
+        metatable = "ocr_meta"
+        rows = db(db[metatable].form_uuid == formuuid).select()
+        try:
+            row = rows[0]
+        except(IndexError):
+            self.r.error(501, self.ERROR.INVALID_FORMID)
+
+        s3ocrxml_filename = row.s3ocrxml_file
+        f = open(os.path.join(self.r.folder,
+                              "uploads",
+                              "ocr_meta",
+                              s3ocrxml_filename),
+                 "rb")
+        s3ocrxml = f.read()
+        f.close()
+
+        s3ocrdict = self.__s3ocrxml2dict(s3ocrxml)
+        crosslimit_options = {}
+        for eachresource in s3ocrdict["$resource_seq"]:
+            resource = s3ocrdict[eachresource]
+            for eachfield in resource["$field_seq"]:
+                field = resource[eachfield]
+                if field.has_options:
+                    if field.options and\
+                            field.options.count > MAX_FORM_OPTIONS_LIMIT:
+                        if not crosslimit_options.has_key(eachresource):
+                            crosslimit_options[eachresource] = [eachfield]
+                        else:
+                            crosslimit_options[eachresource].append(eachfield)
+
+        if len(crosslimit_options) != 0:
+            s3xml_root = etree.fromstring(datafile_content)
+            resource_element = s3xml_root.getchildren()[0]
+            resourcename = resource_element.attrib.get("name")
+            for eachfield in resource_element:
+                if eachfield.tag == "data":
+                    if crosslimit_options.has_key(resourcename):
+                        fieldname = eachfield.attrib.get("field")
+                        if fieldname in crosslimit_options[resourcename]:
+                            match_status = {}
+                            value = eachfield.text.encode("utf-8").lower()
+                            for eachoption in s3ocrdict[resourcename][fieldname].options.list:
+                                try:
+                                    fieldtext = eachoption.label.lower()
+                                except:
+                                    fieldtext = ""
+                                match_status[eachoption.value] =\
+                                    self.dameraulevenshtein(cast2ascii(fieldtext),
+                                                            cast2ascii(value))
+                                #print value, fieldtext, match_status[eachoption.value]
+
+                            closematch_value = 1000000000
+                            closematch = []
+
+                            for eachmatch in match_status.keys():
+                                if match_status[eachmatch] < closematch_value:
+                                    closematch = [eachmatch]
+                                    closematch_value = match_status[eachmatch]
+                                elif match_status[eachmatch] == closematch_value:
+                                    closematch.append(eachmatch)
+
+                            if len(closematch) > 0:
+                                value = closematch[0]
+                            else:
+                                value = ""
+
+                            eachfield.text = value
+                            eachfield.attrib["value"] = value
+
+
+                elif eachfield.tag == "resource":
+                    resourcename = eachfield.attrib.get("name")
+                    for eachsubfield in eachfield:
+                        if eachsubfield.tag == "data":
+                            fieldname = eachsubfield.attrib.get("field")
+                            if resourcename in crosslimit_options.keys() and\
+                                    fieldname in crosslimit_options[resourcename]:
+                                match_status = {}
+                                value = eachsubfield.text.encode("utf-8").lower()
+                                for eachoption in s3ocrdict[resourcename][fieldname].options.list:
+                                    try:
+                                        fieldtext = eachoption.label.lower()
+                                    except:
+                                        fieldtext = ""
+                                    match_status[eachoption.value] =\
+                                        self.dameraulevenshtein(cast2ascii(fieldtext),
+                                                                cast2ascii(value))
+                                    #print value, fieldtext, match_status[eachoption.value]
+
+                                closematch_value = 1000000000
+                                closematch = []
+
+                                for eachmatch in match_status.keys():
+                                    if match_status[eachmatch] < closematch_value:
+                                        closematch = [eachmatch]
+                                        closematch_value = match_status[eachmatch]
+                                    elif match_status[eachmatch] == closematch_value:
+                                        closematch.append(eachmatch)
+
+                                if len(closematch) > 0:
+                                    value = closematch[0]
+                                else:
+                                    value = ""
+
+                                eachsubfield.text = value
+                                eachsubfield.attrib["value"] = value
+
+            datafile_content = etree.tostring(s3xml_root)
+
+        #print datafile_content
+        # import_xml routine
+        outputjson = self.resource.import_xml(StringIO(datafile_content),
+                                              commit_job=False,
+                                              ignore_errors=True)
+
+        #print etree.tostring(etree.fromstring(datafile_content), pretty_print=True)
+
+        # get metadata for review
+        jobuuid = self.resource.job.job_id
+        json2dict = json.loads(outputjson, strict=False)
+
+        if json2dict.has_key("message"):
+            jobhaserrors = 1
+        else:
+            jobhaserrors = 0
+
+        # check status code
+        if json2dict.get("statuscode") != "200":
+            self.r.error(501, self.ERROR.UNRECOVERABLE_ERROR)
+
+        # store metadata for review
+        db["ocr_form_status"].insert(
+            image_set_uuid=setuuid,
+            form_uuid=formuuid,
+            job_uuid=jobuuid,
+            job_has_errors=jobhaserrors)
+
+        return jobuuid
+
     def __parse_job_error_tree(self, tree):
         """
             create a dictionary of fields with errors
@@ -1960,7 +2064,7 @@ class S3PDF(S3Method):
         now = self.request.now.isoformat()[:19].replace("T", " ")
         docTitle = "%s %s" % (title, now)
         self.filename = "%s_%s.pdf" % (title, now)
-        self.output = StringIO()
+        self.output = tempfile.TemporaryFile()
         self.doc = EdenDocTemplate(self.output, title=docTitle)
         self.doc.setPageTemplates(header,footer)
         self.content = []
@@ -2454,6 +2558,9 @@ class S3PDF(S3Method):
                 s3ocrxml_file_name),
                           pages=numPages)
 
+        # The layout of this form has changed
+        S3OCRImageParser.layouts.pop(formUUID, None)
+
     def __book_revision(self, formUUID, formResourceName):
         """
             Books a revision number for current operation in ocr_meta
@@ -2806,12 +2913,15 @@ class S3PDF(S3Method):
         canvas.restoreState()
 
 
-    def buildDoc(self):
+    def buildDoc(self, stream=False):
         """
             This method will build the pdf document.
             The response headers are set up for a pdf document and the document
             is then sent
 
+            @param stream: stream the document from its (temporary) file
+                           rather than reading it into memory
+
             @return the document as a stream of characters
 
             @todo add a proper template class so that the doc.build is more generic
@@ -2821,6 +2931,8 @@ class S3PDF(S3Method):
         self.doc.build(self.content,
                        canvasmaker=canvas.Canvas)
         self.output.seek(0)
+        if stream:
+            return current.response.stream(self.output, chunk_size=65536)
         return self.output.read()
 
     # Nested classes that extended external libraries
@@ -2964,6 +3076,9 @@ class S3PDFDataSource:
     """
         Class to get the labels and the data from the database
     """
+    # Records to fetch and represent at a time
+    CHUNK_SIZE = 500
+
     def __init__(self,
                  obj,
                 ):
@@ -2990,11 +3105,13 @@ class S3PDFDataSource:
         If a groupby field is provided then this will be used as the sort
         criteria, otherwise the it will sort by the first field
 
-        The returned records are stored in the records property.
+        The records are fetched in chunks of CHUNK_SIZE (see getData),
+        the first chunk is stored in the records property.
 
         If there are no records then an error is returned,
         followed by a redirect.
         """
+        table = self.resource.table
         if self.listedFields == None:
             self.fields = self.resource.readable_fields()
         else:
@@ -3007,18 +3124,26 @@ class S3PDFDataSource:
         if not self.fields:
             self.fields = [table.id]
 
+        # Order by ID as well, so that the chunks don't overlap
         if self.groupBy != None:
-            self.records = self.resource.select(self.resource.table.ALL,
-                                                orderby=self.groupBy
-                                               )
+            self.orderby = self.groupBy | table.id
         else:
-            self.records = self.resource.select(self.resource.table.ALL,
-                                                orderby=self.fields[0]
-                                               )
+            self.orderby = self.fields[0] | table.id
+        self.records = self.chunk(0)
         if not self.records:
             current.session.warning = current.manager.ERROR.NO_RECORDS
             redirect(URL(extension=""))
 
+    def chunk(self, start):
+        """
+        Internally used method to get the next CHUNK_SIZE records
+        off the database, starting at index start
+        """
+        return self.resource.select(self.resource.table.ALL,
+                                    orderby=self.orderby,
+                                    limitby=(start, start + self.CHUNK_SIZE)
+                                   )
+
     def getLabels(self):
         """
         Internally used method to get the field labels
@@ -3046,47 +3171,86 @@ class S3PDFDataSource:
 
         If there is no groupby then the result is a simple matrix
         of rows by fields
+
+        The records are fetched and represented one chunk at a time, so
+        that only the represented data is kept for all records.
         """
         # Build the data list
         data = []
         currentGroup = None
         subheadingList = []
         rowNumber = 1
-        for item in self.records:
-            row = []
-            if self.groupBy != None:
-                # @ToDo: non-XML output should use Field.represent
-                # - this saves the extra parameter
-                groupData = s3mgr.represent(self.groupBy,
-                                            record=item,
-                                            strip_markup=True,
-                                            non_xml_output=True
-                                           )
-                if groupData != currentGroup:
-                    currentGroup = groupData
-                    data.append([groupData])
-                    subheadingList.append(rowNumber)
-                    rowNumber += 1
-
-            for field in self.fields:
+        start = 0
+        records = self.records
+        self.records = False
+        while records:
+            # Each distinct value is represented once per chunk
+            cache = {}
+            for item in records:
+                row = self.getRow(s3mgr, cache, item)
                 if self.groupBy != None:
-                    if field.label == self.groupBy.label:
-                        continue
-                text = s3mgr.represent(field,
-                                       record=item,
-                                       strip_markup=True,
-                                       non_xml_output=True,
-                                       extended_comments=True
-                                      )
-                # some represents replace the data with an image which will
-                # then be lost by the strip_markup, so get back what we can
-                if text == "":
-                    text = item[field.name]
-                row.append(text)
-            data.append(row)
-            rowNumber += 1
+                    groupData = row.pop(0)
+                    if groupData != currentGroup:
+                        currentGroup = groupData
+                        data.append([groupData])
+                        subheadingList.append(rowNumber)
+                        rowNumber += 1
+                data.append(row)
+                rowNumber += 1
+            if len(records) < self.CHUNK_SIZE:
+                break
+            start += self.CHUNK_SIZE
+            records = self.chunk(start)
         return (subheadingList, data)
         # end of iterate through each record
+
+    def getRow(self, s3mgr, cache, item):
+        """
+        Internally used method to represent the fields of a record, the
+        representation of the groupby field (if any) comes first
+        """
+        row = []
+        if self.groupBy != None:
+            # @ToDo: non-XML output should use Field.represent
+            # - this saves the extra parameter
+            row.append(self.represent(s3mgr, cache, self.groupBy, item))
+
+        for field in self.fields:
+            if self.groupBy != None:
+                if field.label == self.groupBy.label:
+                    continue
+            text = self.represent(s3mgr, cache, field, item,
+                                  extended_comments=True)
+            # some represents replace the data with an image which will
+            # then be lost by the strip_markup, so get back what we can
+            if text == "":
+                text = item[field.name]
+            row.append(text)
+        return row
+
+    def represent(self, s3mgr, cache, field, item, **attr):
+        """
+        Internally used method to represent the value of a field in a
+        record, looking up the representation of the same value in cache
+        """
+        value = item[field.name]
+        key = (field.name, value)
+        try:
+            return cache[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # unhashable value (list types)
+            key = None
+        text = s3mgr.represent(field,
+                               value=value,
+                               strip_markup=True,
+                               non_xml_output=True,
+                               **attr
+                              )
+        if key is not None:
+            cache[key] = text
+        return text
 # end of class S3PDFDataSource
 
 # -----------------------------------------------------------------------------
@@ -3152,6 +3316,8 @@ class S3PDFTable(object):
         self.evenColour = Color(0.83, 0.84, 1)
         self.MIN_COMMENT_COL_WIDTH = 200
         self.fontsize = 12
+        # Rows to measure the column widths and row heights with
+        self.SAMPLE_ROWS = 100
 
     def build(self):
         """
@@ -3176,20 +3342,53 @@ class S3PDFTable(object):
         if len(self.data) == 0:
             return None
         endCol = len(self.labels) - 1
-        rowCnt = len(self.data)
 
-        self.style = self.tableStyle(0, rowCnt, endCol)
-        tempTable = Table(self.data, repeatRows=1,
+        # Measure the table on a sample of the rows
+        sample = self.sample()
+        self.style = self.tableStyle(0, len(sample), endCol)
+        tempTable = Table(sample, repeatRows=1,
                           style=self.style, hAlign="LEFT"
                          )
         self.tempDoc.build([tempTable], canvasmaker=canvas.Canvas)
         self.newColWidth = [tempTable._colWidths]
-        self.pages.append(self.data)
-        if not self.tweakDoc(tempTable):
+        if self.tweakDoc(tempTable):
+            # Fits across the page, only split the rows into pages
+            colWidths = self.newColWidth[0]
+            self.pages = self.splitPages(tempTable._rowHeights,
+                                         [len(colWidths)])
+        else:
             #print "Need to split the table"
             self.pages = self.splitTable(tempTable)
         return self.presentation()
 
+    def sample(self):
+        """
+            Internally used method to select the rows to measure the
+            table with: the heading, the first SAMPLE_ROWS rows, and the
+            row with the longest text for each column. The first rows
+            are kept in order so their heights can be used for the page
+            breaks.
+        """
+        data = self.data
+        if len(data) <= self.SAMPLE_ROWS + 1:
+            return data
+        sample = data[:self.SAMPLE_ROWS + 1]
+        longest = {}
+        for rowNo in xrange(self.SAMPLE_ROWS + 1, len(data)):
+            if rowNo in self.subheadingList:
+                continue
+            for colNo, cell in enumerate(data[rowNo]):
+                try:
+                    length = len(cell)
+                except TypeError:
+                    continue
+                if length > longest.get(colNo, (0, None))[0]:
+                    longest[colNo] = (length, rowNo)
+        rows = set([rowNo for (length, rowNo) in longest.values()])
+        for rowNo in sorted(rows):
+            sample.append(data[rowNo])
+        return sample
+
     def presentation(self):
         """
             This will convert the S3PDFTABLE object to a format that can be
@@ -3334,7 +3533,6 @@ class S3PDFTable(object):
             will fit into the available space on the page.
         """
         colWidths = tempTable._colWidths
-        rowHeights = tempTable._rowHeights
         total = 0
         colNo = 0
         colSplit = []
@@ -3354,11 +3552,36 @@ class S3PDFTable(object):
         newColWidth.append(pageColWidth)
         self.newColWidth = newColWidth
 
+        return self.splitPages(tempTable._rowHeights, colSplit)
+    # End of function splitTable()
+
+    def splitPages(self, rowHeights, colSplit):
+        """
+            Internally used method to split the data into pages of rows
+            (and columns, as given by colSplit), each of which will be
+            rendered as a separate table.
+
+            @param rowHeights: the measured row heights, rows beyond the
+                               first rows of the sample are assumed to be
+                               as high as the highest measured row
+                               (including the longest rows of the sample)
+            @param colSplit: the column index after each column page
+        """
+        measured = [rowH for rowH in rowHeights if rowH != None]
+        if measured:
+            estimatedHeight = max(measured)
+        else:
+            estimatedHeight = 20
+        # The longest rows are appended to the sample, out of order
+        rowHeights = rowHeights[:self.SAMPLE_ROWS + 1]
         total = 0
-        rowNo = 0
         lastKnownHeight = 20 # Not all row heights get calculated.
         rowSplit = []
-        for rowH in rowHeights:
+        for rowNo in xrange(len(self.data)):
+            if rowNo < len(rowHeights):
+                rowH = rowHeights[rowNo]
+            else:
+                rowH = estimatedHeight
             if rowH == None:
                 rowH = lastKnownHeight
             else:
@@ -3368,8 +3591,7 @@ class S3PDFTable(object):
                 total = 2 * rowH # 2* is needed to take into account the repeated header row
             else:
                 total += rowH
-            rowNo += 1
-        rowSplit.append(rowNo)
+        rowSplit.append(len(self.data))
 
         # Build the pages of data
         pages = []
@@ -3401,7 +3623,7 @@ class S3PDFTable(object):
                 startCol = endCol
             startRow = endRow
         return pages
-    # End of function splitTable()
+    # End of function splitPages()
 
     def tableStyle(self, startRow, rowCnt, endCol):
         """
@@ -3967,12 +4189,68 @@ cast2ascii = lambda m: m if isinstance(m, str) else\
 class S3OCRImageParser(object):
     """ S3 Image Parsing and OCR Utility"""
 
-    def __init__(self, s3method, r):
+    # OCR layouts per form UUID (a form UUID identifies a layout revision)
+    layouts = {}
+
+    # Supported page image formats
+    IMAGE_FORMATS = ("jpg", "png", "gif", "bmp")
+
+    def __init__(self, s3method, r, folder=None, utc_offset=None):
         """ Instialise it with environment variables and functions """
 
         self.r = r
         self.request = current.request
-        checkDependencies(r)
+        if r is not None:
+            checkDependencies(r)
+            folder = r.folder
+        if not numpyImported:
+            self.__error(current.T("NumPy not installed"))
+        self.folder = folder
+        if utc_offset is None and current.session:
+            utc_offset = current.session.s3.ocr_user_utc_offset
+        self.utc_offset = utc_offset
+
+        # Directory for field crops, if they are to be collected rather
+        # than stored in the database (batch mode)
+        self.crop_dir = None
+        self.crops = None
+
+    def __error(self, message):
+        """ Report an error, as HTTP error if parsing a request """
+
+        if self.r is not None:
+            self.r.error(501, message)
+        else:
+            raise RuntimeError(message)
+
+    def __getLayout(self, form_uuid):
+        """
+            Get the metadata and the layout XML of a form (cached)
+
+            @param form_uuid: the form UUID
+        """
+
+        layouts = self.layouts
+        if form_uuid not in layouts:
+            db = current.db
+            metatable = "ocr_meta"
+            query = (db[metatable]["form_uuid"] == form_uuid)
+            row = db(query).select(limitby=(0, 1)).first()
+            if not row or not row["layout_file"]:
+                self.__error(current.T("No layout found for form %(form)s") % \
+                             dict(form=form_uuid))
+            layout_file = open(os.path.join(self.folder,
+                                            "uploads",
+                                            "ocr_meta",
+                                            row["layout_file"]),
+                               "rb")
+            layout_xml = layout_file.read()
+            layout_file.close()
+            layouts[form_uuid] = Storage(revision=row["revision"],
+                                         resource_name=row["resource_name"],
+                                         pages=int(row["pages"]),
+                                         layout_xml=layout_xml)
+        return layouts[form_uuid]
 
     def parse(self, form_uuid, set_uuid, **kwargs):
         """ performs OCR on a given set of pages """
@@ -3982,17 +4260,10 @@ class S3OCRImageParser(object):
 
         self.set_uuid = set_uuid
         db = current.db
-        T = current.T
-        request = self.request
 
         # get metadata of the form
-        metatable = "ocr_meta"
-        query = (db[metatable]["form_uuid"] == form_uuid)
-        row = db(query).select(limitby=(0, 1)).first()
-        revision = row["revision"]
-        resourcename = row["resource_name"]
-        layoutfilename = row["layout_file"]
-        pages = int(row["pages"])
+        layout = self.__getLayout(form_uuid)
+        pages = layout.pages
         is_component = True if len(self.r.resource.components) == 1 else False
 
         # open each page
@@ -4005,7 +4276,7 @@ class S3OCRImageParser(object):
 
             pageimagefile = row["image_file"]
             raw_images[eachpage] =\
-                Image.open(os.path.join(self.r.folder,
+                Image.open(os.path.join(self.folder,
                                         "uploads",
                                         "ocr_payload",
                                         pageimagefile))
@@ -4014,33 +4285,143 @@ class S3OCRImageParser(object):
         for each_img_index in raw_images.keys():
             _debug("Transforming Page %s/%s" % (each_img_index,
                                                 pages))
-            images[each_img_index] = {}
-            images[each_img_index]["image"] =\
-                self.__convertImage2binary(raw_images[each_img_index])
-            images[each_img_index]["markers"] =\
-                self.__getMarkers(images[each_img_index]["image"])
-            images[each_img_index]["orientation"] =\
-                self.__getOrientation(images[each_img_index]["markers"])
-            if images[each_img_index]["orientation"] != 0.0:
-                images[each_img_index]["image"] =\
-                    images[each_img_index]["image"].rotate(images[each_img_index]["orientation"])
-                images[each_img_index]["markers"] =\
-                    self.__getMarkers(images[each_img_index]["image"])
-                images[each_img_index]["orientation"] =\
-                    self.__getOrientation(images[each_img_index]["markers"])
-
-            images[each_img_index]["scalefactor"] =\
-                self.__scaleFactor(images[each_img_index]["markers"])
-
-        # get layout file, convert it to etree
-        layout_file = open(os.path.join(self.r.folder,
-                                        "uploads",
-                                        "ocr_meta",
-                                        layoutfilename),
-                           "rb")
-        layout_xml = layout_file.read()
-        layout_file.close()
-        layout_etree = etree.fromstring(layout_xml)
+            images[each_img_index] = self.transform(raw_images[each_img_index])
+
+        return self.extract(form_uuid, layout, images, is_component)
+
+    def parse_batch(self, form_uuid, source, processes=None):
+        """
+            Performs OCR on a batch of scanned forms, distributing the
+            forms across a pool of worker processes
+
+            @param form_uuid: the form UUID
+            @param source: a zip file or a directory containing the page
+                           images, where the sorted file names give the
+                           sequence of pages (form by form)
+            @param processes: number of worker processes (defaults to
+                              the number of CPUs)
+
+            @returns: list of Storages with the set_uuid and either the
+                      OCR data XML (output) or an error message (error)
+                      for each form
+        """
+
+        db = current.db
+        layout = self.__getLayout(form_uuid)
+        pages = layout.pages
+        is_component = True if len(self.r.resource.components) == 1 else False
+
+        batch_dir = tempfile.mkdtemp(prefix="ocr_batch_")
+        try:
+            # Collect the page images
+            if os.path.isdir(source):
+                files = [os.path.join(source, f)
+                         for f in sorted(os.listdir(source))
+                         if f[f.rfind(".") + 1:].lower() in self.IMAGE_FORMATS]
+            elif zipfile.is_zipfile(source):
+                files = []
+                archive = zipfile.ZipFile(source)
+                for name in sorted(archive.namelist()):
+                    filename = os.path.basename(name)
+                    if filename[filename.rfind(".") + 1:].lower() \
+                       not in self.IMAGE_FORMATS:
+                        continue
+                    path = os.path.join(batch_dir, "%04d_%s" % (len(files),
+                                                                filename))
+                    f = open(path, "wb")
+                    f.write(archive.read(name))
+                    f.close()
+                    files.append(path)
+                archive.close()
+            else:
+                files = []
+            if not files:
+                self.__error(current.T("No page images found"))
+
+            # Store the pages of each form as a set
+            payloadtable = db["ocr_payload"]
+            tasks = []
+            results = []
+            for index in xrange(0, len(files), pages):
+                set_uuid = str(uuid.uuid1())
+                paths = files[index:index + pages]
+                if len(paths) < pages:
+                    results.append(Storage(set_uuid=set_uuid,
+                                           output=None,
+                                           error="insufficient number of pages provided"))
+                    continue
+                for pagenumber, path in enumerate(paths):
+                    f = open(path, "rb")
+                    payloadtable.insert(
+                        image_set_uuid=set_uuid,
+                        image_file=payloadtable["image_file"].store(f,
+                                        os.path.basename(path)),
+                        page_number=pagenumber + 1)
+                    f.close()
+                crop_dir = os.path.join(batch_dir, set_uuid)
+                os.mkdir(crop_dir)
+                tasks.append((self.folder, self.utc_offset, form_uuid,
+                              dict(layout), is_component, set_uuid, paths,
+                              crop_dir))
+            db.commit()
+
+            # OCR the forms in parallel
+            pool = multiprocessing.Pool(processes)
+            try:
+                for result in pool.imap_unordered(s3_ocr_parse_set, tasks):
+                    # Store the field crops for review
+                    self.set_uuid = result["set_uuid"]
+                    for crop in result.pop("crops"):
+                        self.__storeCrop(crop.pop("path"),
+                                         crop.pop("filename"),
+                                         **crop)
+                    results.append(Storage(result))
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+
+        return results
+
+    def transform(self, image):
+        """
+            Binarize a page image and find its markers, orientation and
+            scale factors
+
+            @param image: the page image
+
+            @returns: dict with the transformed image, markers,
+                      orientation and scalefactor
+        """
+
+        page = {}
+        page["image"] = self.__convertImage2binary(image)
+        page["markers"] = self.__getMarkers(page["image"])
+        page["orientation"] = self.__getOrientation(page["markers"])
+        if page["orientation"] != 0.0:
+            page["image"] = page["image"].rotate(page["orientation"])
+            page["markers"] = self.__getMarkers(page["image"])
+            page["orientation"] = self.__getOrientation(page["markers"])
+
+        page["scalefactor"] = self.__scaleFactor(page["markers"])
+        return page
+
+    def extract(self, form_uuid, layout, images, is_component):
+        """
+            Extract the data from the transformed page images
+
+            @param form_uuid: the form UUID
+            @param layout: the form layout (as returned from __getLayout)
+            @param images: the transformed page images {page: transform()}
+            @param is_component: whether the form is for a component
+
+            @returns: the data as S3XML string
+        """
+
+        T = current.T
+        resourcename = layout.resource_name
+        layout_etree = etree.fromstring(layout.layout_xml)
 
         # Data etree
         s3xml_root_etree = etree.Element("s3xml")
@@ -4119,8 +4500,7 @@ class S3OCRImageParser(object):
                                  try:
                                     page_origin = images[comp_page]["markers"]
                                  except(KeyError):
-                                     self.r.error(501,
-                                                  T("insufficient number of pages provided"))
+                                     self.__error(T("insufficient number of pages provided"))
                                  crop_box = (
                                      int(page_origin[0][0]+\
                                              (comp_x*\
@@ -4187,8 +4567,7 @@ class S3OCRImageParser(object):
                                     try:
                                         page_origin = images[comp_page]["markers"]
                                     except(KeyError):
-                                        self.r.error(501,
-                                                     T("insufficient number of pages provided"))
+                                        self.__error(T("insufficient number of pages provided"))
                                     crop_box = (
                                         int(page_origin[0][0]+\
                                                 (comp_x*\
@@ -4297,8 +4676,7 @@ class S3OCRImageParser(object):
                                     try:
                                         page_origin = images[comp_page]["markers"]
                                     except(KeyError):
-                                        self.r.error(501,
-                                                     T("insufficient number of pages provided"))
+                                        self.__error(T("insufficient number of pages provided"))
                                     crop_box = (
                                         int(page_origin[0][0]+\
                                                 (comp_x*\
@@ -4383,7 +4761,7 @@ class S3OCRImageParser(object):
                                                              hh,
                                                              mm),
                                       "%Y-%m-%d %H:%M:%S")
-        utc_offset = current.session.s3.ocr_user_utc_offset
+        utc_offset = self.utc_offset
         try:
             t = utc_offset.split()[1]
             if len(t) == 5:
@@ -4409,8 +4787,6 @@ class S3OCRImageParser(object):
                 **kwargs):
         """ put Tesseract to work, actual OCRing will be done here """
 
-        db = current.db
-        ocr_field_crops = "ocr_field_crops"
         uniqueuuid = uuid.uuid1() # to make it thread safe
 
         resource_table = kwargs.get("resource_table")
@@ -4425,7 +4801,10 @@ class S3OCRImageParser(object):
                                                resourcename,
                                                linenum)
 
-        ocr_temp_dir = os.path.join(self.r.folder, "uploads", "ocr_temp")
+        ocr_temp_dir = os.path.join(self.folder, "uploads", "ocr_temp")
+        if self.crop_dir:
+            # Batch worker: use a private temp dir
+            ocr_temp_dir = os.path.join(self.crop_dir, "ocr_temp")
 
         try:
             os.mkdir(ocr_temp_dir)
@@ -4435,17 +4814,13 @@ class S3OCRImageParser(object):
         if content_type == "optionbox":
             field_value = kwargs.get("field_value")
             imgfilename = "%s.png" % inputfilename[:-3]
-            imgpath = os.path.join(ocr_temp_dir, imgfilename)
+            imgpath = os.path.join(self.crop_dir or ocr_temp_dir, imgfilename)
             image.save(imgpath)
-            imgfile = open(imgpath, "r")
-            db[ocr_field_crops].insert(image_set_uuid=self.set_uuid,
-                                       resource_table=resource_table,
-                                       field_name=field_name,
-                                       image_file=db[ocr_field_crops]["image_file"].store(imgfile,
-                                                                                          imgfilename),
-                                       value=field_value)
-            imgfile.close()
-            os.remove(imgpath)
+            self.__storeCrop(imgpath,
+                             imgfilename,
+                             resource_table=resource_table,
+                             field_name=field_name,
+                             value=field_value)
 
             stat = ImageStat.Stat(image)
             #print resource_table, field_name, field_value
@@ -4464,7 +4839,7 @@ class S3OCRImageParser(object):
                 subprocess.call(["tesseract", inputpath,
                                  os.path.join(ocr_temp_dir, outputfilename)])
             if success != 0:
-                self.r.error(501, ERROR.TESSERACT_ERROR)
+                self.__error(ERROR.TESSERACT_ERROR)
             outputpath = os.path.join(ocr_temp_dir, "%s.txt" % outputfilename)
             outputfile = open(outputpath)
             outputtext = outputfile.read()
@@ -4472,17 +4847,13 @@ class S3OCRImageParser(object):
             output = outputtext.replace("\n", " ")
             os.remove(outputpath)
             imgfilename = "%s.png" % inputfilename[:-3]
-            imgpath = os.path.join(ocr_temp_dir, imgfilename)
+            imgpath = os.path.join(self.crop_dir or ocr_temp_dir, imgfilename)
             image.save(imgpath)
-            imgfile = open(imgpath, "r")
-            db[ocr_field_crops].insert(image_set_uuid=self.set_uuid,
-                                       resource_table=resource_table,
-                                       field_name=field_name,
-                                       image_file=db[ocr_field_crops]["image_file"].store(imgfile,
-                                                                                          imgfilename),
-                                       sequence=field_seq)
-            imgfile.close()
-            os.remove(imgpath)
+            self.__storeCrop(imgpath,
+                             imgfilename,
+                             resource_table=resource_table,
+                             field_name=field_name,
+                             sequence=field_seq)
             os.remove(inputpath)
 
             #print resource_table, field_name, field_seq
@@ -4493,97 +4864,139 @@ class S3OCRImageParser(object):
                 shutil.rmtree(ocr_temp_dir)
             return output
 
+    def __storeCrop(self, path, filename, **data):
+        """
+            Store the image of a field crop for review, or collect it
+            (batch worker, no database access)
+
+            @param path: the path of the crop image file (will be removed)
+            @param filename: the file name
+            @param data: the field data (resource_table, field_name and
+                         value or sequence)
+        """
+
+        if self.crops is not None:
+            crop = Storage(data)
+            crop.update(path=path, filename=filename)
+            self.crops.append(crop)
+            return
+
+        db = current.db
+        ocr_field_crops = "ocr_field_crops"
+        imgfile = open(path, "r")
+        db[ocr_field_crops].insert(image_set_uuid=self.set_uuid,
+                                   image_file=db[ocr_field_crops]["image_file"].store(imgfile,
+                                                                                      filename),
+                                   **data)
+        imgfile.close()
+        os.remove(path)
+
     def __convertImage2binary(self, image, threshold = 180):
         """ Converts the image into binary based on a threshold. here it is 180"""
         image = ImageOps.grayscale(image)
-        image.convert("L")
-
-        width, height = image.size
+        # Image.point maps the pixels through a 256-entry lookup table
+        return image.point(lambda p: 0 if p < threshold else 255)
 
-        for x in xrange(width):
-            for y in xrange(height):
-                if image.getpixel((x,y)) < 180 :
-                    image.putpixel((x,y), 0)
-                else:
-                    image.putpixel((x,y), 255)
-        return image
-
-    def __findRegions(self, im):
+    def __findRegions(self, im, min_area=0):
         """
-        Return the list of regions which are found by the following algorithm.
+        Return the list of regions (4-connected components of black pixels)
+        in the image, which are larger than min_area.
 
-        -----------------------------------------------------------
-        Raster Scanning Algorithm for Connected Component Analysis:
-        -----------------------------------------------------------
+        Uses scipy.ndimage.label where available, otherwise an array-based
+        two-pass union-find over horizontal pixel runs:
 
         On the first pass:
         =================
-        1. Iterate through each element of the data by column, then by row (Raster Scanning)
-        2. If the element is not the background
-            1. Get the neighboring elements of the current element
-            2. If there are no neighbors, uniquely label the current element and continue
-            3. Otherwise, find the neighbor with the smallest label and assign it to the current element
-            4. Store the equivalence between neighboring labels
+        1. Find all runs of black pixels in each row
+        2. Find all pairs of overlapping runs in adjacent rows (these
+           are the equivalences between the runs)
 
         On the second pass:
         ===================
-        1. Iterate through each element of the data by column, then by row
-        2. If the element is not the background
-           1. Relabel the element with the lowest equivalent label
+        1. Merge equivalent runs by repeatedly hooking each run's label to
+           the smallest label of its neighbours and compressing the label
+           paths, until all overlapping runs share the same label
+        2. Compute area and bounding box per label
         ( source: http://en.wikipedia.org/wiki/Connected_Component_Labeling )
         """
 
-        width, height  = im.size
-        ImageOps.grayscale(im)
         im = im.convert("L")
-
-        regions = {}
-        pixel_region = [[0 for y in xrange(height)] for x in xrange(width)]
-        equivalences = {}
-        n_regions = 0
-
-        #first pass. find regions.
-        for x in xrange(width):
-            for y in xrange(height):
-                #look for a black pixel
-                if im.getpixel((x, y)) == 0 : #BLACK
-                    # get the region number from north or west or create new region
-                    region_n = pixel_region[x-1][y] if x > 0 else 0
-                    region_w = pixel_region[x][y-1] if y > 0 else 0
-                    #region_nw = pixel_region[x-1][y-1] if x > 0 and y > 0 else 0
-                    #region_ne = pixel_region[x-1][y+1] if x > 0 else 0
-
-                    max_region = max(region_n, region_w)
-
-                    if max_region > 0:
-                        #a neighbour already has a region, new region is the smallest > 0
-                        new_region = min(filter(lambda i: i > 0, (region_n, region_w)))
-                        #update equivalences
-                        if max_region > new_region:
-                            if max_region in equivalences:
-                                equivalences[max_region].add(new_region)
-                            else:
-                                equivalences[max_region] = set((new_region, ))
-                    else:
-                        n_regions += 1
-                        new_region = n_regions
-
-                    pixel_region[x][y] = new_region
-
-        #Scan image again, assigning all equivalent regions the same region value.
-        for x in xrange(width):
-            for y in xrange(height):
-                r = pixel_region[x][y]
-                if r > 0:
-                    while r in equivalences:
-                        r = min(equivalences[r])
-
-                    if r in regions:
-                        regions[r].add(x, y)
-                    else:
-                        regions[r] = self.__Region(x, y)
-
-        return list(regions.itervalues())
+        black = (numpy.asarray(im) == 0) #BLACK
+
+        regions = []
+        if ndimageImported:
+            pixel_region, n_regions = ndimage.label(black)
+            if not n_regions:
+                return regions
+            areas = numpy.bincount(pixel_region.ravel())
+            for index, box in enumerate(ndimage.find_objects(pixel_region)):
+                if areas[index + 1] <= min_area:
+                    continue
+                y, x = box
+                regions.append(self.__Region(x.start, y.start,
+                                             x.stop - 1, y.stop - 1,
+                                             areas[index + 1]))
+            return regions
+
+        height, width = black.shape
+        W = width + 2
+
+        # First pass: runs of black pixels per row
+        padded = numpy.zeros((height, W), dtype=numpy.int8)
+        padded[:, 1:-1] = black
+        edges = numpy.diff(padded, axis=1)
+        rows, starts = numpy.nonzero(edges == 1)
+        stops = numpy.nonzero(edges == -1)[1] # exclusive
+        n_runs = len(starts)
+        if not n_runs:
+            return regions
+
+        # Runs in the next row which overlap the column range of each run
+        key_start = rows * W + starts
+        key_stop = rows * W + stops
+        lo = numpy.searchsorted(key_stop, (rows + 1) * W + starts, "right")
+        hi = numpy.searchsorted(key_start, (rows + 1) * W + stops, "left")
+        counts = numpy.maximum(hi - lo, 0)
+        run_a = numpy.repeat(numpy.arange(n_runs), counts)
+        offsets = numpy.arange(counts.sum()) - \
+                  numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        run_b = numpy.repeat(lo, counts) + offsets
+
+        # Second pass: union-find by label hooking and path compression
+        labels = numpy.arange(n_runs)
+        while len(run_a):
+            label_a = labels[run_a]
+            label_b = labels[run_b]
+            if (label_a == label_b).all():
+                break
+            smallest = numpy.minimum(label_a, label_b)
+            numpy.minimum.at(labels, label_a, smallest)
+            numpy.minimum.at(labels, label_b, smallest)
+            while True:
+                compressed = labels[labels]
+                if (compressed == labels).all():
+                    break
+                labels = compressed
+
+        roots, labels = numpy.unique(labels, return_inverse=True)
+        n_regions = len(roots)
+        areas = numpy.bincount(labels, weights=stops - starts)
+        min_x = numpy.empty(n_regions, dtype=starts.dtype)
+        min_x.fill(width)
+        numpy.minimum.at(min_x, labels, starts)
+        max_x = numpy.zeros(n_regions, dtype=stops.dtype)
+        numpy.maximum.at(max_x, labels, stops - 1)
+        min_y = numpy.empty(n_regions, dtype=rows.dtype)
+        min_y.fill(height)
+        numpy.minimum.at(min_y, labels, rows)
+        max_y = numpy.zeros(n_regions, dtype=rows.dtype)
+        numpy.maximum.at(max_y, labels, rows)
+
+        for index in numpy.nonzero(areas > min_area)[0]:
+            regions.append(self.__Region(min_x[index], min_y[index],
+                                         max_x[index], max_y[index],
+                                         areas[index]))
+        return regions
 
     def __getOrientation(self, markers):
         """ Returns orientation of the sheet in radians """
@@ -4615,7 +5028,7 @@ class S3OCRImageParser(object):
         centers = {}
         present = 0
 
-        regions = self.__findRegions(image)
+        regions = self.__findRegions(image, min_area=320)
 
         for r in regions:
             if r.area > 320 and r.aspectratio() < 1.5 and r.aspectratio() > 0.67:
@@ -4638,23 +5051,13 @@ class S3OCRImageParser(object):
 
     class __Region():
         """ Self explainatory """
-        def __init__(self, x, y):
-            """ Initialize the region """
-            self._pixels = [(x, y)]
-            self._min_x = x
-            self._max_x = x
-            self._min_y = y
-            self._max_y = y
-            self.area = 1
-
-        def add(self, x, y):
-            """ Add a pixel to the region """
-            self._pixels.append((x, y))
-            self.area += 1
-            self._min_x = min(self._min_x, x)
-            self._max_x = max(self._max_x, x)
-            self._min_y = min(self._min_y, y)
-            self._max_y = max(self._max_y, y)
+        def __init__(self, min_x, min_y, max_x, max_y, area):
+            """ Initialize the region from its bounding box and area """
+            self._min_x = int(min_x)
+            self._max_x = int(max_x)
+            self._min_y = int(min_y)
+            self._max_y = int(max_y)
+            self.area = int(area)
 
         def centroid(self):
             """ Returns the centroid of the bounding box """
@@ -4670,5 +5073,40 @@ class S3OCRImageParser(object):
             length = self._max_y - self._min_y
             return float(width)/float(length)
 
+# =============================================================================
+def s3_ocr_parse_set(task):
+    """
+        Process pool worker for S3OCRImageParser.parse_batch: performs OCR
+        on the page images of one form, without database access
+
+        @param task: tuple (folder, utc_offset, form_uuid, layout,
+                     is_component, set_uuid, paths, crop_dir)
+
+        @returns: dict with set_uuid, output (the data XML), error
+                  and crops (the field crops to store)
+    """
+
+    folder, utc_offset, form_uuid, layout, is_component, \
+        set_uuid, paths, crop_dir = task
+
+    parser = S3OCRImageParser(None, None,
+                              folder=folder,
+                              utc_offset=utc_offset)
+    parser.set_uuid = set_uuid
+    parser.crop_dir = crop_dir
+    parser.crops = []
+
+    result = dict(set_uuid=set_uuid, output=None, error=None)
+    try:
+        images = {}
+        for pagenumber, path in enumerate(paths):
+            images[pagenumber + 1] = parser.transform(Image.open(path))
+        result["output"] = parser.extract(form_uuid, Storage(layout), images,
+                                          is_component)
+    except Exception, e:
+        result["error"] = str(e)
+    result["crops"] = [dict(crop) for crop in parser.crops]
+    return result
+
 # end S3OCRImageParser
 # END -------------------------------------------------------------------------
@@ -64,6 +64,7 @@ from gluon.tools import callback
 import gluon.contrib.simplejson as json
 
 from s3validators import IS_ONE_OF
+from s3utils import s3_table_changed
 from s3xml import S3XML
 from s3model import S3Model, S3RecordLinker
 from s3export import S3Exporter
@@ -1199,6 +1200,7 @@ class S3Request(object):
         # Export the resource
         output = resource.export_xml(stylesheet=stylesheet,
                                      as_json=as_json,
+                                     stream=as_json,
                                      start=start,
                                      limit=limit,
                                      marker=marker,
@@ -2871,6 +2873,9 @@ class S3Resource(object):
         if numrows == 0 and not deletable:
             # No deletable rows found
             manager.error = self.ERROR.INTEGRITY_ERROR
+        elif numrows:
+            # Invalidate caches of data from this table
+            s3_table_changed(self.tablename)
 
         return numrows
 
@@ -3138,7 +3143,8 @@ class S3Resource(object):
                    dereference=True,
                    stylesheet=None,
                    as_json=False,
-                   pretty_print=False, **args):
+                   pretty_print=False,
+                   stream=False, **args):
         """
             Export this resource as S3XML
 
@@ -3153,6 +3159,10 @@ class S3Resource(object):
             @param stylesheet: path to the XSLT stylesheet (if required)
             @param as_json: represent the XML tree as JSON
             @param pretty_print: insert newlines/indentation in the output
+            @param stream: return the JSON as a list of fragments rather
+                           than as string, converting each record as it is
+                           exported rather than building the complete tree
+                           (unless a stylesheet is used)
             @param args: dict of arguments to pass to the XSLT stylesheet
         """
 
@@ -3163,6 +3173,27 @@ class S3Resource(object):
         manager = self.manager
         xml = manager.xml
 
+        # Convert to JSON while exporting: the fragments are collected
+        # here rather than yielded to the response, since the exporter
+        # needs the database, which is closed before the response body
+        # is sent
+        if as_json and stream and stylesheet is None:
+            root = etree.Element(xml.TAG.root)
+            info = Storage()
+            elements = self.__export_elements(root, info,
+                                              start=start,
+                                              limit=limit,
+                                              marker=marker,
+                                              msince=msince,
+                                              show_urls=show_urls,
+                                              dereference=dereference)
+            complete = lambda: self.__complete_tree(root, info,
+                                                    start=start,
+                                                    limit=limit,
+                                                    show_urls=show_urls)
+            return list(xml.streamjson(root, elements, complete,
+                                       pretty_print=pretty_print))
+
         # Export as element tree
         tree = self.export_tree(start=start,
                                 limit=limit,
@@ -3187,7 +3218,9 @@ class S3Resource(object):
         # Convert into string
         # (Content Headers are set by the calling function)
         if tree:
-            if as_json:
+            if as_json and stream:
+                output = xml.iterjson(tree, pretty_print=pretty_print)
+            elif as_json:
                 output = xml.tree2json(tree, pretty_print=pretty_print)
             else:
                 output = xml.tostring(tree, pretty_print=pretty_print)
@@ -3216,6 +3249,53 @@ class S3Resource(object):
 
         """
 
+        root = etree.Element(self.manager.xml.TAG.root)
+        info = Storage()
+        for element in self.__export_elements(root, info,
+                                              start=start,
+                                              limit=limit,
+                                              msince=msince,
+                                              marker=marker,
+                                              skip=skip,
+                                              show_urls=show_urls,
+                                              dereference=dereference):
+            pass
+
+        return self.__complete_tree(root, info,
+                                    start=start,
+                                    limit=limit,
+                                    show_urls=show_urls)
+
+    # -------------------------------------------------------------------------
+    def __export_elements(self,
+                          root,
+                          info,
+                          start=0,
+                          limit=None,
+                          msince=None,
+                          marker=None,
+                          skip=[],
+                          show_urls=True,
+                          dereference=True):
+        """
+            Add the <resource> elements for the records of this resource,
+            and the records they reference, to the root element
+
+            @param root: the root element
+            @param info: Storage to store the number of results (results)
+                         and of exported elements (exported) in
+            @param start: index of the first record to export
+            @param limit: maximum number of records to export
+            @param msince: minimum modification date of the records
+            @param marker: URL of the default marker
+            @param skip: list of fieldnames to skip
+            @param show_urls: show record URLs in the export
+            @param dereference: also export referenced records
+
+            @returns: a generator of the <resource> elements, each
+                      yielded as soon as it has been added
+        """
+
         manager = self.manager
         model = manager.model
         xml = manager.xml
@@ -3235,7 +3315,8 @@ class S3Resource(object):
             self.add_filter(mci_filter)
 
         # Total number of results
-        results = self.count()
+        info.results = self.count()
+        info.exported = 0
 
         # Load slice
         self.load(start=start, limit=limit)
@@ -3265,7 +3346,6 @@ class S3Resource(object):
                 popup_fields = "name"
 
         # Build the tree
-        root = etree.Element(xml.TAG.root)
         export_map = Storage()
         reference_map = []
         for record in self:
@@ -3288,7 +3368,10 @@ class S3Resource(object):
                                           show_urls=show_urls)
 
             if element is None:
-                results -= 1
+                info.results -= 1
+            else:
+                info.exported += 1
+                yield element
 
         # Add referenced resources to the tree
         depth = dereference and manager.MAX_DEPTH or 0
@@ -3356,15 +3439,38 @@ class S3Resource(object):
                     # Mark as referenced element (for XSLT)
                     if element is not None:
                         element.set(xml.ATTRIBUTE.ref, "True")
+                        info.exported += 1
+                        yield element
+
+    # -------------------------------------------------------------------------
+    def __complete_tree(self, root, info, start=None, limit=None,
+                        show_urls=True):
+        """
+            Complete the tree exported by __export_elements
 
-        # Complete the tree
-        return xml.tree(None,
-                        root=root,
-                        domain=manager.domain,
-                        url= show_urls and manager.s3.base_url or None,
-                        results=results,
-                        start=start,
-                        limit=limit)
+            @param root: the root element
+            @param info: the Storage filled in by __export_elements
+            @param start: index of the first record exported
+            @param limit: maximum number of records exported
+            @param show_urls: show record URLs in the export
+        """
+
+        manager = self.manager
+
+        # Elements which have already been converted and removed
+        # from the tree (see S3XML.streamjson) still count for success
+        if info.exported:
+            elements = []
+        else:
+            elements = None
+
+        return manager.xml.tree(elements,
+                                root=root,
+                                domain=manager.domain,
+                                url= show_urls and manager.s3.base_url or None,
+                                results=info.results,
+                                start=start,
+                                limit=limit)
 
     # -------------------------------------------------------------------------
     def __add_resource(self,
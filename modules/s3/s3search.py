@@ -36,6 +36,7 @@
 
 import re
 import sys
+import unicodedata
 import gluon.contrib.simplejson as jsonlib
 import cPickle
 
@@ -50,16 +51,19 @@ from gluon.sqlhtml import CheckboxesWidget, MultipleOptionsWidget, RadioWidget
 from gluon.serializers import json
 
 from s3crud import S3CRUD
+from s3utils import s3_table_version
 from s3validators import *
 
 __all__ = ["S3SearchWidget",
            "S3SearchSimpleWidget",
            "S3SearchMinMaxWidget",
            "S3SearchOptionsWidget",
+           "S3SearchFacets",
            "S3SearchLocationHierarchyWidget",
            "S3SearchLocationWidget",
            "S3SearchSkillsWidget",
            "S3Search",
+           "S3SearchIndex",
            "S3LocationSearch",
            "S3OrganisationSearch",
            "S3PersonSearch",
@@ -327,6 +331,14 @@ class S3SearchSimpleWidget(S3SearchWidget):
 
         # Build search query
         if value and isinstance(value, str):
+
+            # Use the search token index if all fields are indexed
+            if search_field.keys() == [table._tablename]:
+                fieldnames = [f.name for f in search_field[table._tablename]]
+                query = S3SearchIndex.query(table, value, fieldnames)
+                if query is not None:
+                    return master_query[table._tablename] & query
+
             values = value.split()
             squery = None
 
@@ -490,6 +502,103 @@ class S3SearchMinMaxWidget(S3SearchWidget):
             query = None
         return (query)
 
+# =============================================================================
+class S3SearchFacets(object):
+    """
+        Facet engine: finds the distinct values of option fields and
+        their numbers of hits in the current query of a resource, for
+        all fields of a search form at once
+
+        The results are cached in RAM per resource, query and fields,
+        and invalidated by any change in the involved tables.
+    """
+
+    CACHE_TTL = 60 # time-to-live of RAM cache for facet counts
+
+    def __init__(self, resource):
+        """
+            Constructor
+
+            @param resource: the S3Resource
+        """
+
+        self.resource = resource
+
+    # -------------------------------------------------------------------------
+    def count(self, selectors):
+        """
+            Get the distinct values and hit counts of fields
+
+            @param selectors: list of field selectors, either field names
+                              or "kfield$field" for a field in the table
+                              referenced by kfield
+            @returns: dict {selector: [(value, count), ...]}
+        """
+
+        db = current.db
+        resource = self.resource
+        table = resource.table
+
+        fields = []
+        tablenames = [table._tablename]
+        for selector in selectors:
+            if "$" in selector:
+                kfield, fieldname = selector.split("$", 1)
+                if kfield not in table.fields:
+                    continue
+                ktablename = str(table[kfield].type)[10:]
+                if ktablename not in db:
+                    continue
+                ktable = db[ktablename]
+                if fieldname not in ktable.fields:
+                    continue
+                # Count the records of this resource per referenced value
+                join = (table[kfield] == ktable.id)
+                if "deleted" in ktable:
+                    join &= (ktable.deleted != True)
+                fields.append((selector, ktable[fieldname], join))
+                if ktablename not in tablenames:
+                    tablenames.append(ktablename)
+            elif selector in table.fields:
+                fields.append((selector, table[selector], None))
+        if not fields:
+            return {}
+        query = resource.get_query()
+
+        # Any change in the tables invalidates the counts
+        version = [s3_table_version(tablename) for tablename in tablenames]
+
+        key = "S3SearchFacets_%s" % hash((str(table),
+                                          str(query),
+                                          tuple([s for s, f, j in fields]),
+                                          tuple(version)))
+        return current.cache.ram(key,
+                                 lambda: self._count(table, query, fields),
+                                 time_expire=self.CACHE_TTL)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _count(table, query, fields):
+        """
+            Run the facet queries
+
+            @param table: the table of the resource
+            @param query: the resource query
+            @param fields: list of tuples (selector, Field, join query)
+        """
+
+        db = current.db
+
+        facets = {}
+        count = table.id.count()
+        for selector, field, join in fields:
+            q = query & (field != None)
+            if join is not None:
+                q &= join
+            rows = db(q).select(field, count, groupby=field)
+            facets[selector] = [(row[field], row[count]) for row in rows]
+        return facets
+
 # =============================================================================
 class S3SearchOptionsWidget(S3SearchWidget):
     """
@@ -508,6 +617,13 @@ class S3SearchOptionsWidget(S3SearchWidget):
                      displayed in
     """
 
+    facets = None
+
+    # Whether S3Search shall count the options of this widget together
+    # with the other option widgets of the form, otherwise the widget
+    # counts its own (e.g. for options from another resource)
+    shared_facets = True
+
     def _get_reference_resource(self, resource):
         """
             If the field is entered as kfield$field, will search field in the
@@ -533,6 +649,11 @@ class S3SearchOptionsWidget(S3SearchWidget):
             @param vars: the URL GET variables as dict
         """
 
+        selector = self.field[0]
+        facets = self.facets
+        if facets is None:
+            facets = S3SearchFacets(resource).count([selector]).get(selector, [])
+
         resource, field, kfield = self._get_reference_resource(resource)
 
         T = current.T
@@ -544,21 +665,23 @@ class S3SearchOptionsWidget(S3SearchWidget):
         msg = self.attr._no_opts
 
         field_type = str(resource.table[field].type)
+
+        # Unique values of options for that field, with hit counts
+        # (precomputed for all option widgets of the form by S3Search)
+        counts = dict(facets)
         if field_type == "boolean":
-            opt_keys = (True, False)
+            opt_keys = [k for k in (True, False) if counts.get(k)]
         else:
-            # Find unique values of options for that field
-            rows = resource.select(field, groupby = resource.table[field])
-            opt_keys = [row[field] for row in rows if row[field] != None]
-            if opt_keys == []:
-                msg = self.attr._no_opts
-                if msg is None:
-                    msg = T("no options available")
-                if msg:
-                    return SPAN(msg,
-                                _style="color:#AAA; font-style:italic;")
-                else:
-                    return None
+            opt_keys = [k for k, n in facets]
+        if opt_keys == []:
+            msg = self.attr._no_opts
+            if msg is None:
+                msg = T("no options available")
+            if msg:
+                return SPAN(msg,
+                            _style="color:#AAA; font-style:italic;")
+            else:
+                return None
 
         # Always use the represent of the widget, if present
         represent = self.attr.represent
@@ -586,6 +709,10 @@ class S3SearchOptionsWidget(S3SearchWidget):
         else:
             opt_list = [(opt_key, "%s" % opt_key) for opt_key in opt_keys]
 
+        # Show the hit counts
+        opt_list = [(opt_key, "%s (%s)" % (label, counts[opt_key]))
+                    for opt_key, label in opt_list]
+
         # Alphabetise (this will not work as it is converted to a dict),
         # look at IS_IN_SET validator or CheckboxesWidget to ensure
         # that the list opt_list.sort()
@@ -890,6 +1017,9 @@ class S3SearchCredentialsWidget(S3SearchOptionsWidget):
     """
         Options Widge to search for HRMs with specified Credentials
     """
+
+    shared_facets = False
+
     def widget(self, resource, vars):
         manager = current.manager
         c = manager.define_resource("hrm", "credential")
@@ -921,6 +1051,9 @@ class S3SearchSkillsWidget(S3SearchOptionsWidget):
         @ToDo: Provide a filter for level of competency
                - meanwhile at least sort by level of competency
     """
+
+    shared_facets = False
+
     def widget(self, resource, vars):
         manager = current.manager
         c = manager.define_resource("hrm", "competency")
@@ -1164,6 +1297,32 @@ class S3Search(S3CRUD):
                                 _id = "save_search" 
                                 )
         return save_search
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _facets(resource, widgets):
+        """
+            Compute the option facets of all S3SearchOptionsWidgets in a
+            form at once
+
+            @param resource: the resource to search in
+            @param widgets: list of (name, widget) tuples
+        """
+
+        shared = []
+        for name, widget in widgets:
+            if not isinstance(widget, S3SearchOptionsWidget):
+                continue
+            widget.facets = None
+            if widget.shared_facets:
+                shared.append(widget)
+        if not shared:
+            return
+
+        facets = S3SearchFacets(resource).count([w.field[0] for w in shared])
+        for widget in shared:
+            widget.facets = facets.get(widget.field[0], [])
+
     # -------------------------------------------------------------------------
     def search_interactive(self, r, **attr):
         """
@@ -1215,6 +1374,9 @@ class S3Search(S3CRUD):
         else:
             add_link = ""
 
+        # Count the options of all option widgets at once
+        self._facets(resource, self.__simple + self.__advanced)
+
         # Append the simple search form
         if self.__simple:
             simple = True
@@ -1868,6 +2030,7 @@ class S3LocationSearch(S3Search):
         query = None
         fields = []
         field = table.id
+        ranked = None
 
         if _vars.field and _vars.filter and value:
             fieldname = str.lower(_vars.field)
@@ -1942,34 +2105,39 @@ class S3LocationSearch(S3Search):
                 if exclude_field and exclude_value:
                     # Old LocationSelector
                     # Filter out poor-quality data, such as from Ushahidi
-                    query = (field.lower().like("%" + value + "%")) & \
-                            ((table[exclude_field].lower() != exclude_value) | \
-                             (table[exclude_field] == None))
-
-                elif field2:
-                    # New LocationSelector
-                    query = ((field.lower().like("%" + value + "%")) | \
-                             (field2.lower().like("%" + value + "%")))
-
-                else:
-                    # Normal single-field
-                    query = (field.lower().like("%" + value + "%"))
+                    resource.add_filter((table[exclude_field].lower() != exclude_value) | \
+                                        (table[exclude_field] == None))
 
                 if level:
-                    resource.add_filter(query)
                     # New LocationSelector or Autocomplete
                     if isinstance(level, list):
-                        query = (table.level.belongs(level))
+                        resource.add_filter(table.level.belongs(level))
                     elif str.upper(level) == "NULLNONE":
                         level = None
-                        query = (table.level == level)
+                        resource.add_filter(table.level == level)
                     else:
-                        query = (table.level == level)
+                        resource.add_filter(table.level == level)
 
                 if parent:
                     # New LocationSelector
-                    resource.add_filter(query)
-                    query = (table.parent == parent)
+                    resource.add_filter(table.parent == parent)
+
+                fieldnames = [field.name]
+                if field2 and not (exclude_field and exclude_value):
+                    fieldnames.append(field2.name)
+                # Rank the candidates within the filtered resource
+                ranked = S3SearchIndex.search(table, value, fieldnames,
+                                              filter=resource.get_query(),
+                                              limit=min(limit or MAX_SEARCH_RESULTS,
+                                                        MAX_SEARCH_RESULTS))
+                if ranked is None:
+                    if field2 and not (exclude_field and exclude_value):
+                        # New LocationSelector
+                        query = ((field.lower().like("%" + value + "%")) | \
+                                 (field2.lower().like("%" + value + "%")))
+                    else:
+                        # Normal single-field
+                        query = (field.lower().like("%" + value + "%"))
 
             elif filter == "=":
                 if field.type.split(" ")[0] in \
@@ -2012,7 +2180,9 @@ class S3LocationSearch(S3Search):
         resource.add_filter(query)
 
         if filter == "~":
-            if (not limit or limit > MAX_SEARCH_RESULTS) and resource.count() > MAX_SEARCH_RESULTS:
+            # Ranked searches return the top matches only
+            if ranked is None and \
+               (not limit or limit > MAX_SEARCH_RESULTS) and resource.count() > MAX_SEARCH_RESULTS:
                output = json([dict(id="",
                                    name="Search results are over %d. Please input more characters." \
                                    % MAX_SEARCH_RESULTS)])
@@ -2021,11 +2191,15 @@ class S3LocationSearch(S3Search):
                output = json([])
 
         if output is None:
-            output = resource.exporter.json(resource,
-                                            start=0,
-                                            limit=limit,
-                                            fields=fields,
-                                            orderby=field)
+            if ranked is not None:
+                # Best matches first
+                output = S3SearchIndex.export_json(resource, ranked, fields)
+            else:
+                output = resource.exporter.json(resource,
+                                                start=0,
+                                                limit=limit,
+                                                fields=fields,
+                                                orderby=field)
 
         response.headers["Content-Type"] = "application/json"
         return output
@@ -2069,6 +2243,8 @@ class S3OrganisationSearch(S3Search):
 
         filter = _vars.filter
         limit = int(_vars.limit or 0)
+        query = None
+        ranked = None
 
         if filter and value:
 
@@ -2079,14 +2255,20 @@ class S3OrganisationSearch(S3Search):
             fields = [table.id, field, field2]
 
             if filter == "~":
-                # pr_person Autocomplete
-                if " " in value:
-                    value1, value2 = value.split(" ", 1)
-                    query = (field.lower().like("%" + value1 + "%")) & \
-                            (field2.lower().like("%" + value2 + "%"))
-                else:
-                    query = (field.lower().like("%" + value + "%")) | \
-                            (field2.lower().like("%" + value + "%"))
+                ranked = S3SearchIndex.search(table, value,
+                                              [field.name, field2.name],
+                                              filter=resource.get_query(),
+                                              limit=min(limit or MAX_SEARCH_RESULTS,
+                                                        MAX_SEARCH_RESULTS))
+                if ranked is None:
+                    # pr_person Autocomplete
+                    if " " in value:
+                        value1, value2 = value.split(" ", 1)
+                        query = (field.lower().like("%" + value1 + "%")) & \
+                                (field2.lower().like("%" + value2 + "%"))
+                    else:
+                        query = (field.lower().like("%" + value + "%")) | \
+                                (field2.lower().like("%" + value + "%"))
 
             else:
                 output = xml.json_message(False,
@@ -2096,18 +2278,22 @@ class S3OrganisationSearch(S3Search):
 
         resource.add_filter(query)
 
-        if filter == "~":
+        if filter == "~" and ranked is None:
             if (not limit or limit > MAX_SEARCH_RESULTS) and resource.count() > MAX_SEARCH_RESULTS:
                output = json([dict(id="",
                                    name="Search results are over %d. Please input more characters." \
                                    % MAX_SEARCH_RESULTS)])
 
         if output is None:
-            output = resource.exporter.json(resource,
-                                            start=0,
-                                            limit=limit,
-                                            fields=fields,
-                                            orderby=field)
+            if ranked is not None:
+                # Best matches first
+                output = S3SearchIndex.export_json(resource, ranked, fields)
+            else:
+                output = resource.exporter.json(resource,
+                                                start=0,
+                                                limit=limit,
+                                                fields=fields,
+                                                orderby=field)
 
         response.headers["Content-Type"] = "application/json"
         return output
@@ -2150,6 +2336,8 @@ class S3PersonSearch(S3Search):
 
         filter = _vars.filter
         limit = int(_vars.limit or 0)
+        query = None
+        ranked = None
 
         if filter and value:
 
@@ -2161,16 +2349,22 @@ class S3PersonSearch(S3Search):
             fields = [table.id, field, field2, field3]
 
             if filter == "~":
-                # pr_person Autocomplete
-                if " " in value:
-                    value1, value2 = value.split(" ", 1)
-                    query = (field.lower().like("%" + value1 + "%")) & \
-                            (field2.lower().like("%" + value2 + "%")) | \
-                            (field3.lower().like("%" + value2 + "%"))
-                else:
-                    query = ((field.lower().like("%" + value + "%")) | \
-                            (field2.lower().like("%" + value + "%")) | \
-                            (field3.lower().like("%" + value + "%")))
+                ranked = S3SearchIndex.search(table, value,
+                                              [field.name, field2.name, field3.name],
+                                              filter=resource.get_query(),
+                                              limit=min(limit or MAX_SEARCH_RESULTS,
+                                                        MAX_SEARCH_RESULTS))
+                if ranked is None:
+                    # pr_person Autocomplete
+                    if " " in value:
+                        value1, value2 = value.split(" ", 1)
+                        query = (field.lower().like("%" + value1 + "%")) & \
+                                (field2.lower().like("%" + value2 + "%")) | \
+                                (field3.lower().like("%" + value2 + "%"))
+                    else:
+                        query = ((field.lower().like("%" + value + "%")) | \
+                                (field2.lower().like("%" + value + "%")) | \
+                                (field3.lower().like("%" + value + "%")))
 
             else:
                 output = xml.json_message(False,
@@ -2180,18 +2374,22 @@ class S3PersonSearch(S3Search):
 
         resource.add_filter(query)
 
-        if filter == "~":
+        if filter == "~" and ranked is None:
             if (not limit or limit > MAX_SEARCH_RESULTS) and resource.count() > MAX_SEARCH_RESULTS:
                output = json([dict(id="",
                                    name="Search results are over %d. Please input more characters." \
                                    % MAX_SEARCH_RESULTS)])
 
         if output is None:
-            output = resource.exporter.json(resource,
-                                            start=0,
-                                            limit=limit,
-                                            fields=fields,
-                                            orderby=field)
+            if ranked is not None:
+                # Best matches first
+                output = S3SearchIndex.export_json(resource, ranked, fields)
+            else:
+                output = resource.exporter.json(resource,
+                                                start=0,
+                                                limit=limit,
+                                                fields=fields,
+                                                orderby=field)
 
         response.headers["Content-Type"] = "application/json"
         return output
@@ -2290,3 +2488,389 @@ class S3PentitySearch(S3Search):
         return output
 
 # =============================================================================
+class S3SearchIndex(object):
+    """
+        Search token index for autocomplete and simple search
+
+        Holds the normalised (lower-case, accent-folded) word tokens of
+        the configured text fields of a table, to be matched with
+        indexed prefix queries ("token LIKE 'value%'") instead of
+        scanning the table with "field LIKE '%value%'".
+
+        The index is maintained by onaccept/ondelete hooks, so tables
+        must be configured in the model after their other hooks, e.g.:
+
+            s3base.S3SearchIndex.configure("pr_person", "first_name",
+                                           "middle_name", "last_name")
+
+        Location names are indexed by default (see DEFAULTS), and kept
+        up to date by GIS.update_location_tree, which all gis_location
+        writes go through.
+
+        Tables (or fields) which are not configured, or whose tokens
+        have not been built yet, are searched with LIKE as before.
+    """
+
+    TABLENAME = "s3_search_token"
+    TOKEN_LENGTH = 32       # number of characters to index per token
+    MAX_CANDIDATES = 5000   # max number of tokens to rank per search term
+    CHUNK_SIZE = 1000       # number of records per chunk when rebuilding
+
+    SPLIT = re.compile(r"[\W_]+", re.UNICODE)
+
+    # Fields indexed without configuration
+    DEFAULTS = {"gis_location": ("name",)}
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def define_table(cls):
+        """
+            Define the search token table, to be indexed on (tablename,
+            token) and (tablename, record_id) - the indexes are created
+            at 1st_run
+        """
+
+        db = current.db
+        if cls.TABLENAME not in db:
+            table = db.define_table(cls.TABLENAME,
+                                    Field("tablename", length=128,
+                                          notnull=True),
+                                    Field("record_id", "integer",
+                                          notnull=True),
+                                    Field("fieldname", length=128),
+                                    Field("token", length=128,
+                                          notnull=True))
+        else:
+            table = db[cls.TABLENAME]
+        return table
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def configure(cls, tablename, *fieldnames):
+        """
+            Configure a table for token search and add the hooks to
+            maintain the index
+
+            @param tablename: the table name
+            @param fieldnames: the names of the fields to index
+        """
+
+        model = current.manager.model
+        model.configure(tablename, search_index=fieldnames)
+
+        onaccept = lambda form: cls.update(tablename, form.vars.id)
+        ondelete = lambda row: cls.delete(tablename, row.id)
+        for key, hook in (("onaccept", onaccept),
+                          ("create_onaccept", onaccept),
+                          ("update_onaccept", onaccept),
+                          ("ondelete", ondelete)):
+            hooks = model.get_config(tablename, key)
+            if hooks is None:
+                if key != "onaccept" and key != "ondelete":
+                    # Would override onaccept
+                    continue
+                hooks = []
+            elif not isinstance(hooks, (list, tuple)):
+                hooks = [hooks]
+            else:
+                hooks = list(hooks)
+            hooks.append(hook)
+            model.configure(tablename, **{key: hooks})
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def fields(cls, tablename):
+        """
+            Get the names of the indexed fields of a table
+
+            @param tablename: the table name
+        """
+
+        return current.manager.model.get_config(tablename, "search_index",
+                                                cls.DEFAULTS.get(tablename))
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def built(cls, tablename):
+        """
+            Check whether the tokens of a table have been built (by
+            rebuild), otherwise the table is searched with LIKE and
+            record updates are not indexed until it gets rebuilt
+
+            @param tablename: the table name
+        """
+
+        itable = cls.define_table()
+        row = current.db(itable.tablename == tablename).select(itable.id,
+                                                               limitby=(0, 1)).first()
+        return row is not None
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def tokenize(cls, text):
+        """
+            Split a text into normalised tokens: lower-case, without
+            accents, each truncated to TOKEN_LENGTH characters
+
+            @param text: the text
+            @returns: list of unique tokens as utf-8 strings
+        """
+
+        if not text:
+            return []
+        if not isinstance(text, unicode):
+            text = unicode(str(text), "utf-8", "ignore")
+        text = unicodedata.normalize("NFKD", text.lower())
+        text = u"".join([c for c in text if not unicodedata.combining(c)])
+        tokens = []
+        for token in cls.SPLIT.split(text):
+            if token:
+                token = token[:cls.TOKEN_LENGTH].encode("utf-8")
+                if token not in tokens:
+                    tokens.append(token)
+        return tokens
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _tokens(cls, tablename, fieldnames, record):
+        """
+            Get the token table rows for a record
+
+            @param tablename: the table name
+            @param fieldnames: the names of the indexed fields
+            @param record: the record
+        """
+
+        rows = []
+        for fieldname in fieldnames:
+            for token in cls.tokenize(record[fieldname]):
+                rows.append(dict(tablename=tablename,
+                                 record_id=record.id,
+                                 fieldname=fieldname,
+                                 token=token))
+        return rows
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def update(cls, tablename, record_id):
+        """
+            Update the tokens of a record (onaccept hook)
+
+            @param tablename: the table name
+            @param record_id: the record ID
+        """
+
+        db = current.db
+        fieldnames = cls.fields(tablename)
+        if not fieldnames or not record_id or tablename not in db or \
+           not cls.built(tablename):
+            return
+        table = db[tablename]
+        itable = cls.define_table()
+
+        fieldnames = [f for f in fieldnames if f in table.fields]
+        fields = [table.id] + [table[f] for f in fieldnames]
+        record = db(table.id == record_id).select(limitby=(0, 1),
+                                                  *fields).first()
+
+        db((itable.tablename == tablename) &
+           (itable.record_id == record_id)).delete()
+        if record:
+            rows = cls._tokens(tablename, fieldnames, record)
+            if rows:
+                itable.bulk_insert(rows)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def delete(cls, tablename, record_id):
+        """
+            Remove the tokens of a record (ondelete hook)
+
+            @param tablename: the table name
+            @param record_id: the record ID
+        """
+
+        itable = cls.define_table()
+        current.db((itable.tablename == tablename) &
+                   (itable.record_id == record_id)).delete()
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def rebuild(cls, tablename):
+        """
+            Rebuild the tokens for all records of a table, in chunks
+
+            @param tablename: the table name
+        """
+
+        db = current.db
+        fieldnames = cls.fields(tablename)
+        if not fieldnames or tablename not in db:
+            return
+        table = db[tablename]
+        itable = cls.define_table()
+
+        db(itable.tablename == tablename).delete()
+
+        fieldnames = [f for f in fieldnames if f in table.fields]
+        fields = [table.id] + [table[f] for f in fieldnames]
+        query = (table.id > 0)
+        if "deleted" in table:
+            query &= (table.deleted != True)
+        last = 0
+        while True:
+            records = db(query & (table.id > last)).select(orderby=table.id,
+                                                           limitby=(0, cls.CHUNK_SIZE),
+                                                           *fields)
+            if not records:
+                break
+            rows = []
+            for record in records:
+                rows.extend(cls._tokens(tablename, fieldnames, record))
+            if rows:
+                itable.bulk_insert(rows)
+            last = records.last().id
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _indexed(cls, table, fieldnames):
+        """
+            Check whether all fieldnames are indexed for a table, and
+            whether the tokens have been built
+
+            @param table: the table
+            @param fieldnames: the field names
+        """
+
+        tablename = table._tablename
+        indexed = cls.fields(tablename)
+        if not indexed:
+            return False
+        for fieldname in fieldnames:
+            if fieldname not in indexed:
+                return False
+        return cls.built(tablename)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def query(cls, table, value, fieldnames):
+        """
+            Query for all records with tokens in fieldnames starting
+            with each of the words in value
+
+            @param table: the table
+            @param value: the search string
+            @param fieldnames: the names of the fields to search
+            @returns: a query, or None if the fields are not indexed
+        """
+
+        terms = cls.tokenize(value)
+        if not terms or not cls._indexed(table, fieldnames):
+            return None
+
+        db = current.db
+        itable = cls.define_table()
+        base = (itable.tablename == table._tablename) & \
+               (itable.fieldname.belongs(fieldnames))
+        query = None
+        for term in terms:
+            q = table.id.belongs(db(base & (itable.token.like("%s%%" % term))) \
+                                 ._select(itable.record_id))
+            query = query is not None and query & q or q
+        return query
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def search(cls, table, value, fieldnames, filter=None,
+               limit=MAX_SEARCH_RESULTS):
+        """
+            Find the best matching records with tokens in fieldnames
+            starting with each of the words in value. Records matching
+            words exactly rank higher than those matching prefixes only.
+
+            At most MAX_CANDIDATES tokens are considered per word, so the
+            search takes a fixed time even on very large tables. The
+            filter is applied to the candidates, so that the limits never
+            drop records in favour of records which are filtered out later.
+
+            @param table: the table
+            @param value: the search string
+            @param fieldnames: the names of the fields to search
+            @param filter: filter query for the records, e.g. the resource
+                           query (accessibility, deletion status, filters)
+            @param limit: the max number of records to return
+            @returns: list of record IDs, best match first, or None if the
+                      fields are not indexed
+        """
+
+        terms = cls.tokenize(value)
+        if not terms or not cls._indexed(table, fieldnames):
+            return None
+
+        db = current.db
+        itable = cls.define_table()
+        base = (itable.tablename == table._tablename) & \
+               (itable.fieldname.belongs(fieldnames))
+        if filter is not None:
+            base &= (itable.record_id == table.id) & filter
+
+        # Longest (=most selective) terms first
+        terms.sort(key=len, reverse=True)
+        scores = None
+        for term in terms:
+            query = base & (itable.token.like("%s%%" % term))
+            if scores is not None:
+                query &= (itable.record_id.belongs(scores.keys()))
+            # Ordered by token, so exact matches come first
+            rows = db(query).select(itable.record_id,
+                                    itable.token,
+                                    orderby=itable.token,
+                                    limitby=(0, cls.MAX_CANDIDATES))
+            matches = {}
+            for row in rows:
+                score = row.token == term and 2 or 1
+                record_id = row.record_id
+                if score > matches.get(record_id, 0):
+                    matches[record_id] = score
+            if scores is None:
+                scores = matches
+            else:
+                scores = dict([(record_id, scores[record_id] + score)
+                               for record_id, score in matches.items()])
+            if not scores:
+                return []
+
+        # Best score first, then by ID for a stable order
+        ranked = sorted(scores,
+                        key=lambda record_id: (-scores[record_id], record_id))
+        if limit:
+            ranked = ranked[:limit]
+        return ranked
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def export_json(resource, ranked, fields):
+        """
+            Export the ranked records of a resource as JSON, in the
+            order of their rank
+
+            @param resource: the resource
+            @param ranked: the record IDs, best match first (from search)
+            @param fields: the fields to export, must include the ID
+        """
+
+        if not ranked:
+            return json([])
+
+        table = resource.table
+        resource.add_filter(table.id.belongs(ranked))
+        rows = resource.select(*fields)
+
+        rank = dict([(record_id, i) for i, record_id in enumerate(ranked)])
+        records = rows.as_list()
+        records.sort(key=lambda record: rank.get(record["id"]))
+
+        current.response.headers["Content-Type"] = "application/json"
+        return json(records)
+
+# =============================================================================
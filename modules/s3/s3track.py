@@ -30,11 +30,13 @@
 
 """
 
+import heapq
 from gluon import current
-from gluon.dal import Table, Query, Set, Expression, Rows, Row
+from gluon.dal import Table, Query, Set, Expression, Rows, Row, Field
 from datetime import datetime, timedelta
+from xml.sax.saxutils import escape
 
-__all__ = ["S3Tracker"]
+__all__ = ["S3Trackable", "S3Tracker"]
 
 # =============================================================================
 class S3Trackable(object):
@@ -49,6 +51,7 @@ class S3Trackable(object):
 
     LOCATION = "gis_location"   # location tablename
     PRESENCE = "sit_presence"   # presence tablename
+    TRACK = "sit_track"         # track history tablename
 
     def __init__(self, db, trackable, record_id=None, uid=None, rtable=None):
         """
@@ -304,6 +307,7 @@ class S3Trackable(object):
         else:
             data = dict(location_id=location, timestmp=timestmp)
 
+        point = None
         for r in self.records:
             if self.TRACK_ID not in r:
                 # No track ID => set base location
@@ -316,6 +320,14 @@ class S3Trackable(object):
                 data.update({self.TRACK_ID:r[self.TRACK_ID]})
                 ptable.insert(**data)
                 self.__update_timestamp(r[self.TRACK_ID], timestmp)
+                if point is None:
+                    ltable = current.db[self.LOCATION]
+                    query = (ltable.id == location)
+                    point = current.db(query).select(ltable.id,
+                                                     ltable.lat,
+                                                     ltable.lon,
+                                                     limitby=(0, 1)).first()
+                self.__log_track(r[self.TRACK_ID], timestmp, point)
 
 
     # -------------------------------------------------------------------------
@@ -364,6 +376,7 @@ class S3Trackable(object):
                         timestmp=timestmp,
                         interlock=interlock)
             q = ((ptable.deleted == False) & (ptable.timestmp <= timestmp))
+            point = None
             for r in self.records:
                 if self.TRACK_ID not in r:
                     # Cannot check-in a non-trackable
@@ -377,6 +390,14 @@ class S3Trackable(object):
                 data.update({self.TRACK_ID:r[self.TRACK_ID]})
                 ptable.insert(**data)
                 self.__update_timestamp(r[self.TRACK_ID], timestmp)
+                if point is None:
+                    # Position at check-in = position of the host instance
+                    tablename, record_id = interlock.split(",", 1)
+                    host = S3Trackable(current.db, tablename, record_id)
+                    point = host.get_location(timestmp=timestmp)
+                    if isinstance(point, list):
+                        point = point[0]
+                self.__log_track(r[self.TRACK_ID], timestmp, point)
 
 
     # -------------------------------------------------------------------------
@@ -443,8 +464,139 @@ class S3Trackable(object):
                 data.update({self.TRACK_ID:r[self.TRACK_ID]})
                 ptable.insert(**data)
                 self.__update_timestamp(r[self.TRACK_ID], timestmp)
+                self.__log_track(r[self.TRACK_ID], timestmp, location)
 
 
+    # -------------------------------------------------------------------------
+    def get_track(self, start=None, end=None, points=None):
+        """
+            Get the track history of the instance(s) within a time window
+
+            @param start: start of the time window (None for open start)
+            @param end: end of the time window (defaults to current time)
+            @param points: target number of points per track (None for all),
+                           longer tracks get downsampled with Douglas-Peucker
+
+            @returns: a dict {track_id: [(timestmp, lat, lon), ...]}, each
+                      track ordered by timestmp
+        """
+
+        db = current.db
+        ttable = self.define_track_table()
+
+        if end is None:
+            end = datetime.utcnow()
+
+        track_ids = [r[self.TRACK_ID] for r in self.records
+                     if self.TRACK_ID in r and r[self.TRACK_ID]]
+        if not track_ids:
+            return {}
+        if len(track_ids) == 1:
+            query = (ttable[self.TRACK_ID] == track_ids[0])
+        else:
+            query = (ttable[self.TRACK_ID].belongs(track_ids))
+        query = query & (ttable.timestmp <= end)
+        if start is not None:
+            query = query & (ttable.timestmp >= start)
+
+        # Served by the (track_id, timestmp) index
+        rows = db(query).select(ttable[self.TRACK_ID],
+                                ttable.timestmp,
+                                ttable.lat,
+                                ttable.lon,
+                                orderby=ttable[self.TRACK_ID]|ttable.timestmp)
+
+        tracks = dict((track_id, []) for track_id in track_ids)
+        for row in rows:
+            tracks[row[self.TRACK_ID]].append((row.timestmp, row.lat, row.lon))
+
+        if points:
+            for track_id in tracks:
+                tracks[track_id] = self.simplify(tracks[track_id], points)
+        return tracks
+
+    # -------------------------------------------------------------------------
+    def get_track_gpx(self, start=None, end=None, points=None):
+        """
+            Get the track history of the instance(s) as GPX document,
+            e.g. to feed a GPX layer
+
+            @param start: start of the time window (None for open start)
+            @param end: end of the time window (defaults to current time)
+            @param points: target number of points per track (None for all)
+
+            @returns: the GPX document as string
+        """
+
+        tracks = self.get_track(start=start, end=end, points=points)
+
+        output = ['<?xml version="1.0" encoding="UTF-8"?>',
+                  '<gpx version="1.1" creator="Sahana Eden" '
+                  'xmlns="http://www.topografix.com/GPX/1/1">']
+        for track_id in sorted(tracks):
+            output.append("<trk><name>%s</name><trkseg>" % \
+                          escape(str(track_id)))
+            for timestmp, lat, lon in tracks[track_id]:
+                output.append('<trkpt lat="%s" lon="%s"><time>%sZ</time></trkpt>' % \
+                              (lat, lon, timestmp.isoformat()))
+            output.append("</trkseg></trk>")
+        output.append("</gpx>")
+        return "\n".join(output)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def simplify(track, points):
+        """
+            Downsample a track to (at most) the given number of points,
+            using a top-down Douglas-Peucker split: starting from the end
+            points, always keep the point farthest from its current segment
+            until the target is reached. End points are always retained.
+
+            @param track: list of (timestmp, lat, lon) tuples
+            @param points: the target number of points
+
+            @returns: the downsampled list
+        """
+
+        length = len(track)
+        if length <= points:
+            return track
+        if points < 2:
+            points = 2
+
+        def farthest(first, last):
+            t, lat1, lon1 = track[first]
+            t, lat2, lon2 = track[last]
+            dlat = lat2 - lat1
+            dlon = lon2 - lon1
+            norm = dlat * dlat + dlon * dlon
+            dmax = -1
+            index = None
+            for i in xrange(first + 1, last):
+                t, lat, lon = track[i]
+                if norm:
+                    # Squared perpendicular distance to the segment line
+                    d = dlon * (lat - lat1) - dlat * (lon - lon1)
+                    d = d * d / norm
+                else:
+                    d = (lat - lat1) ** 2 + (lon - lon1) ** 2
+                if d > dmax:
+                    dmax = d
+                    index = i
+            return dmax, index
+
+        keep = set([0, length - 1])
+        d, index = farthest(0, length - 1)
+        heap = [(-d, 0, length - 1, index)]
+        while heap and len(keep) < points:
+            d, first, last, index = heapq.heappop(heap)
+            keep.add(index)
+            for a, b in ((first, index), (index, last)):
+                if b - a > 1:
+                    d, i = farthest(a, b)
+                    heapq.heappush(heap, (-d, a, b, i))
+        return [track[i] for i in sorted(keep)]
+
     # -------------------------------------------------------------------------
     def remove_location(self, location=None):
         """
@@ -592,6 +744,54 @@ class S3Trackable(object):
             trackable.update_record(track_timestmp=timestamp)
 
 
+    # -------------------------------------------------------------------------
+    def __log_track(self, track_id, timestmp, location):
+        """
+            Append a position fix to the track history of a trackable
+
+            @param track_id: the trackable ID (super-entity key)
+            @param timestmp: the datetime of the fix
+            @param location: the location record (Row with lat/lon)
+        """
+
+        if not track_id or not isinstance(location, Row):
+            return
+        lat = location.get("lat", None)
+        lon = location.get("lon", None)
+        if lat is None or lon is None:
+            return
+        table = self.define_track_table()
+        data = {self.TRACK_ID: track_id,
+                "timestmp": timestmp,
+                "lat": lat,
+                "lon": lon,
+                "location_id": location.get("id", None)}
+        table.insert(**data)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def define_track_table(cls):
+        """
+            Define the track history table: a compact time-series of
+            position fixes per trackable, to be indexed on (track_id,
+            timestmp) - the index is created at 1st_run
+        """
+
+        db = current.db
+        if cls.TRACK not in db:
+            table = db.define_table(cls.TRACK,
+                                    Field(cls.TRACK_ID, "integer",
+                                          notnull=True),
+                                    Field("timestmp", "datetime",
+                                          notnull=True),
+                                    Field("lat", "double"),
+                                    Field("lon", "double"),
+                                    Field("location_id", "integer"))
+        else:
+            table = db[cls.TRACK]
+        return table
+
+
 # =============================================================================
 class S3Tracker(object):
     """
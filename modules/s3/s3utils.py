@@ -46,6 +46,8 @@ __all__ = ["URL2",
            "s3_filter_staff",
            "s3_fullname",
            "s3_represent_facilities",
+           "s3_table_version",
+           "s3_table_changed",
            "jaro_winkler",
            "jaro_winkler_distance_row",
            "soundex",
@@ -54,6 +56,7 @@ __all__ = ["URL2",
 import sys
 import os
 import re
+import uuid
 import hashlib
 
 from gluon import *
@@ -726,6 +729,33 @@ def soundex(name, len=4):
 
 # =============================================================================
 
+def s3_table_version(tablename):
+    """
+        Get a marker for the current version of the data in a table, to
+        key caches of data derived from the table. The marker is renewed
+        by s3_table_changed() whenever records are created, updated or
+        deleted through S3 (CRUD forms, imports, resource deletes).
+
+        @param tablename: the table name
+    """
+
+    return current.cache.ram("s3_table_version_%s" % tablename,
+                             lambda: uuid.uuid4().hex,
+                             time_expire=None)
+
+# =============================================================================
+
+def s3_table_changed(tablename):
+    """
+        Renew the version marker of a table (see s3_table_version)
+
+        @param tablename: the table name
+    """
+
+    current.cache.ram("s3_table_version_%s" % tablename, None)
+
+# =============================================================================
+
 def docChecksum(docStr):
     """
         Calculate a checksum for a file
@@ -63,6 +63,8 @@ from gluon import current, Field,  IS_MATCH, IS_NOT_IN_DB, IS_IN_SET
 from gluon.validators import Validator
 from gluon.storage import Storage
 
+from s3utils import s3_table_version
+
 def options_sorter(x, y):
     return (str(x[1]).upper() > str(y[1]).upper() and 1) or -1
 
@@ -200,11 +202,17 @@ class IS_ONE_OF_EMPTY(Validator):
             has to return a string, of course). The function will take the
             record as an argument.
 
+            'label_fields' names the fields which a label function reads,
+            so that option labels can be matched in the database (see
+            lookup).
+
             No 'options' method as designed to be called next to an
             Autocomplete field so don't download a large dropdown
             unnecessarily.
     """
 
+    CACHE_TTL = 60 # time-to-live of RAM cache for option sets
+
     def __init__(self,
                  dbset,
                  field,
@@ -220,6 +228,7 @@ class IS_ONE_OF_EMPTY(Validator):
                  zero="",
                  sort=False,
                  _and=None,
+                 label_fields=None,
                 ):
 
         if hasattr(dbset, "define_table"):
@@ -242,6 +251,7 @@ class IS_ONE_OF_EMPTY(Validator):
             fields =[str(f) for f in self.dbset._db[ktable]]
         self.fields = fields
         self.label = label
+        self.label_fields = label_fields
         self.ktable = ktable
         if not kfield or not len(kfield):
             self.kfield = "id"
@@ -285,13 +295,18 @@ class IS_ONE_OF_EMPTY(Validator):
             self.not_filter_opts = not_filter_opts
 
     def build_set(self):
+        """
+            Build the option set (theset, labels) from a projection of
+            the key table. The options are cached in RAM for CACHE_TTL
+            seconds per filter and accessible query, the cache is
+            invalidated by any change in the key table.
+        """
 
         dbset = self.dbset
         db = dbset._db
         if self.ktable in db:
 
             table = db[self.ktable]
-            auth = current.auth
 
             if self.fields == "all":
                 fields = [f for f in table if isinstance(f, Field)]
@@ -301,22 +316,19 @@ class IS_ONE_OF_EMPTY(Validator):
             if db._dbname not in ("gql", "gae"):
                 orderby = self.orderby or reduce(lambda a, b: a|b, fields)
                 groupby = self.groupby
-                # Caching breaks Colorbox dropdown refreshes
-                #dd = dict(orderby=orderby, groupby=groupby, cache=(current.cache.ram, 60))
                 dd = dict(orderby=orderby, groupby=groupby)
-                query = auth.s3_accessible_query("read", table)
-                if "deleted" in table:
-                    query = ((table["deleted"] == False) & query)
+                query = self._query(table, accessible=True)
                 if self.filterby and self.filterby in table:
-                    if self.filter_opts:
-                        query = query & (table[self.filterby].belongs(self.filter_opts))
                     if not self.orderby:
                         dd.update(orderby=table[self.filterby])
                 if self.not_filterby and self.not_filterby in table and self.not_filter_opts:
-                    query = query & (~(table[self.not_filterby].belongs(self.not_filter_opts)))
                     if not self.orderby:
                         dd.update(orderby=table[self.filterby])
-                records = dbset(query).select(*fields, **dd)
+                select = lambda: self._options(table,
+                                               dbset(query).select(*fields, **dd))
+                key = self._cache_key(table, query, fields, dd)
+                (self.theset, self.labels) = current.cache.ram(key, select,
+                                                     time_expire=self.CACHE_TTL)
             else:
                 # Note this does not support filtering.
                 orderby = self.orderby or \
@@ -325,42 +337,147 @@ class IS_ONE_OF_EMPTY(Validator):
                 #dd = dict(orderby=orderby, cache=(current.cache.ram, 60))
                 dd = dict(orderby=orderby)
                 records = dbset.select(db[self.ktable].ALL, **dd)
-            self.theset = [str(r[self.kfield]) for r in records]
-            #labels = []
-            label = self.label
-            try:
-                labels = map(label, records)
-            except TypeError:
-                if isinstance(label, str):
-                    labels = map(lambda r: label % dict(r), records)
-                elif isinstance(label, (list, tuple)):
-                    labels = map(lambda r: \
-                                 " ".join([r[l] for l in label if l in r]),
-                                 records)
-                elif callable(label):
-                    # Is a function
-                    labels = map(label, records)
-                elif "name" in table:
-                    labels = map(lambda r: r.name, records)
-                else:
-                    labels = map(lambda r: r[self.kfield], records)
-            self.labels = labels
+                (self.theset, self.labels) = self._options(table, records)
         else:
             self.theset = None
             self.labels = None
 
+    # -------------------------------------------------------------------------
+    def _query(self, table, accessible=False):
+        """
+            Build the filter query for the key table
+
+            @param table: the key table
+            @param accessible: restrict to records accessible for the
+                               current user
+        """
+
+        query = (table.id > 0)
+        if accessible:
+            query &= current.auth.s3_accessible_query("read", table)
+        if "deleted" in table:
+            query &= (table["deleted"] == False)
+        if self.filterby and self.filterby in table and self.filter_opts:
+            query &= (table[self.filterby].belongs(self.filter_opts))
+        if self.not_filterby and self.not_filterby in table and self.not_filter_opts:
+            query &= (~(table[self.not_filterby].belongs(self.not_filter_opts)))
+        return query
+
+    # -------------------------------------------------------------------------
+    def _cache_key(self, table, query, fields, dd):
+        """
+            Build the RAM cache key for an option set
+
+            @param table: the key table
+            @param query: the filter query
+            @param fields: the fields to select
+            @param dd: the select attributes (orderby, groupby)
+        """
+
+        # Any change in the key table invalidates the option set
+        version = s3_table_version(table._tablename)
+
+        label = self.label
+        if callable(label):
+            # Label functions are redefined per request, so identify them
+            # by their code, and their output can be translated
+            code = getattr(label, "func_code", None)
+            if code is not None:
+                label = (code.co_filename, code.co_firstlineno, code.co_name)
+            else:
+                label = getattr(label, "__name__", str(label))
+            label = (label, current.T.accepted_language)
+
+        dbset_query = getattr(self.dbset, "query", None)
+        return "IS_ONE_OF_EMPTY_%s" % hash((str(query),
+                                            str(dbset_query),
+                                            tuple(map(str, fields)),
+                                            str(dd.get("orderby")),
+                                            str(dd.get("groupby")),
+                                            str(label),
+                                            version))
+
+    # -------------------------------------------------------------------------
+    def _options(self, table, records):
+        """
+            Map a set of key table records into keys and labels
+
+            @param table: the key table
+            @param records: the records
+            @returns: tuple (theset, labels)
+        """
+
+        theset = [str(r[self.kfield]) for r in records]
+        label = self.label
+        try:
+            labels = map(label, records)
+        except TypeError:
+            if isinstance(label, str):
+                labels = map(lambda r: label % dict(r), records)
+            elif isinstance(label, (list, tuple)):
+                labels = map(lambda r: \
+                             " ".join([r[l] for l in label if l in r]),
+                             records)
+            elif callable(label):
+                # Is a function
+                labels = map(label, records)
+            elif "name" in table:
+                labels = map(lambda r: r.name, records)
+            else:
+                labels = map(lambda r: r[self.kfield], records)
+        return (theset, labels)
+
+    # -------------------------------------------------------------------------
+    def lookup(self, text):
+        """
+            Find the keys of all options with labels containing text,
+            with a single LIKE query against the key table
+
+            @param text: the search text (lower case)
+            @returns: a sub-select for the matching keys, or None if the
+                      labels can not be matched in the database (label
+                      functions without label_fields)
+        """
+
+        db = self.dbset._db
+        if self.ktable not in db or db._dbname in ("gql", "gae"):
+            return None
+        table = db[self.ktable]
+
+        label = self.label
+        if self.label_fields:
+            fieldnames = self.label_fields
+        elif isinstance(label, str):
+            fieldnames = regex2.findall(label)
+        elif isinstance(label, (list, tuple)):
+            fieldnames = label
+        else:
+            return None
+        fields = [table[f] for f in fieldnames
+                  if f in table.fields and
+                     str(table[f].type) in ("string", "text")]
+        if not fields:
+            return None
+
+        wildcard = "%%%s%%" % text
+        like = None
+        for field in fields:
+            q = field.lower().like(wildcard)
+            like = like is not None and like | q or q
+        query = self._query(table, accessible=True) & (like)
+        return self.dbset(query)._select(table[self.kfield])
+
     #Removed as we don't want any options downloaded unnecessarily
     #def options(self):
 
     def __call__(self, value):
+        """
+            Validate a value with a single lookup in the key table
+        """
 
         try:
             _table = self.dbset._db[self.ktable]
-            deleted_q = ("deleted" in _table) and (_table["deleted"] == False) or False
-            filter_opts_q = False
-            if self.filterby and self.filterby in _table:
-                if self.filter_opts:
-                    filter_opts_q = _table[self.filterby].belongs(self.filter_opts)
+            kfield = _table[self.kfield]
 
             # For a list field, Web2py now packs elements in "|x|y|" by itself,
             # so that is no longer done here. The unpacking is left in for now,
@@ -386,43 +503,18 @@ class IS_ONE_OF_EMPTY(Validator):
                 else:
                     values = []
 
-                if self.theset:
-                    if not [x for x in values if not x in self.theset]:
-                        return (values, None)
-                    else:
-                        return (value, self.error_message)
-                else:
-                    for v in values:
-                        q = (_table[self.kfield] == v)
-                        query = query is not None and query | q or q
-                    if filter_opts_q != False:
-                        query = query is not None and \
-                                (filter_opts_q & (query)) or filter_opts_q
-                    if deleted_q != False:
-                        query = query is not None and \
-                                (deleted_q & (query)) or deleted_q
-                    if self.dbset(query).count() < 1:
+                keys = set(str(v) for v in values)
+                if keys:
+                    query = self._query(_table, accessible=True) & \
+                            (kfield.belongs(keys))
+                    rows = self.dbset(query).select(kfield, distinct=True)
+                    if keys - set(str(row[kfield]) for row in rows):
                         return (value, self.error_message)
-                    return (values, None)
-            elif self.theset:
-                if value in self.theset:
-                    if self._and:
-                        return self._and(value)
-                    else:
-                        return (value, None)
+                return (values, None)
             else:
-                values = [value]
-                query = None
-                for v in values:
-                    q = (_table[self.kfield] == v)
-                    query = query is not None and query | q or q
-                if filter_opts_q != False:
-                    query = query is not None and \
-                            (filter_opts_q & (query)) or filter_opts_q
-                if deleted_q != False:
-                    query = query is not None and \
-                            (deleted_q & (query)) or deleted_q
-                if self.dbset(query).count():
+                query = self._query(_table, accessible=True) & \
+                        (kfield == value)
+                if self.dbset(query).select(kfield, limitby=(0, 1)):
                     if self._and:
                         return self._and(value)
                     else:
@@ -41,6 +41,7 @@ import sys
 import csv
 import datetime
 import urllib2
+import itertools
 
 from gluon import *
 from gluon.storage import Storage
@@ -308,14 +309,15 @@ class S3XML(S3Codec):
             root.set(self.ATTRIBUTE.domain, self.domain)
         if url:
             root.set(self.ATTRIBUTE.url, current.response.s3.base_url)
+        bounds = current.gis.get_bounds()
         root.set(self.ATTRIBUTE.latmin,
-                 str(current.gis.get_bounds()["min_lat"]))
+                 str(bounds["min_lat"]))
         root.set(self.ATTRIBUTE.latmax,
-                 str(current.gis.get_bounds()["max_lat"]))
+                 str(bounds["max_lat"]))
         root.set(self.ATTRIBUTE.lonmin,
-                 str(current.gis.get_bounds()["min_lon"]))
+                 str(bounds["min_lon"]))
         root.set(self.ATTRIBUTE.lonmax,
-                 str(current.gis.get_bounds()["max_lon"]))
+                 str(bounds["max_lon"]))
         return etree.ElementTree(root)
 
     # -------------------------------------------------------------------------
@@ -1514,23 +1516,301 @@ class S3XML(S3Codec):
             @param pretty_print: provide pretty formatted output
         """
 
+        return "".join(cls.iterjson(tree, pretty_print=pretty_print))
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def iterjson(cls, tree, pretty_print=False):
+        """
+            Converts an element tree into JSON, one child element of the
+            root element at a time, so that large exports can be streamed
+            without holding the complete JSON object in memory
+
+            @param tree: the element tree
+            @param pretty_print: provide pretty formatted output
+
+            @returns: a generator of JSON fragments which, joined together,
+                      give the same JSON as tree2json
+        """
+
+        TAG = cls.TAG
+
         if isinstance(tree, etree._ElementTree):
             root = tree.getroot()
         else:
             root = tree
 
-        if root.tag == cls.TAG.root:
+        if root.tag == TAG.root:
             native = True
         else:
             native = False
 
-        root_dict = cls.__element2json(root, native=native)
+        if root.tag == TAG.list:
+            children = [child for child in root
+                        if isinstance(child.tag, basestring)] # skip comment nodes
+            for fragment in cls.__iterjson_list(children, native,
+                                                pretty_print):
+                yield fragment
+            return
+
+        for fragment in cls.__iterjson_members(root, native, pretty_print):
+            yield fragment
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def streamjson(cls, root, elements, complete, pretty_print=False):
+        """
+            Converts an S3XML tree into JSON while it is being built: the
+            <resource> elements of the first resource are converted (and
+            removed from the tree) one at a time as they are added, so
+            that the complete tree is never held in memory
+
+            @param root: the <s3xml> root element
+            @param elements: iterable which adds the <resource> elements
+                             to the root element, and yields each of them
+            @param complete: function to call after the last element, to
+                             complete the root element (attributes)
+            @param pretty_print: provide pretty formatted output
+
+            @returns: a generator of JSON fragments which, joined together,
+                      give the same JSON as tree2json of the complete tree
+        """
+
+        ATTRIBUTE = cls.ATTRIBUTE
+        PREFIX = cls.PREFIX
+
+        dumps = cls.__jsondumps
+        element2json = cls.__element2json
+
+        first = True
+        resource = None
+        for element in elements:
+            name = element.get(ATTRIBUTE.name)
+            if resource is None:
+                resource = name
+            elif name != resource:
+                # referenced resources stay in the tree
+                continue
+            obj = element2json(element, native=True)
+            root.remove(element)
+            if not obj:
+                continue
+            if first:
+                yield "%s%s: " % (pretty_print and "{\n    " or "{",
+                                  json.dumps("%s_%s" % (PREFIX.resource,
+                                                        resource)))
+                yield pretty_print and "[\n        " or "["
+                first = False
+            else:
+                yield pretty_print and ",\n        " or ", "
+            yield dumps(obj, 2, pretty_print)
+        if not first:
+            yield pretty_print and "\n    ]" or "]"
+
+        complete()
+        for fragment in cls.__iterjson_members(root, True, pretty_print,
+                                               first=first):
+            yield fragment
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def __jsondumps(obj, level=0, pretty_print=False):
+        """
+            JSON representation of an object at a nesting level
+
+            @param obj: the object
+            @param level: the nesting level (for indentation)
+            @param pretty_print: provide pretty formatted output
+        """
+
+        if pretty_print:
+            js = json.dumps(obj, indent=4)
+            indent = "\n" + "    " * level
+            return indent.join([l.rstrip() for l in js.splitlines()])
+        else:
+            return json.dumps(obj)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def __jsonobjects(cls, elements, native):
+        """
+            Convert elements one at a time, skipping empty ones
+
+            @param elements: iterable of elements
+            @param native: convert as S3XML
+        """
+
+        element2json = cls.__element2json
+        for element in elements:
+            obj = element2json(element, native=native)
+            if obj:
+                yield obj
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def __iterjson_list(cls, elements, native, pretty_print, level=0):
+        """
+            Converts elements into a JSON list, one at a time
+
+            @param elements: iterable of elements
+            @param native: convert as S3XML
+            @param pretty_print: provide pretty formatted output
+            @param level: the nesting level of the list
+        """
+
+        dumps = cls.__jsondumps
+
+        first = True
+        for obj in cls.__jsonobjects(elements, native):
+            if first:
+                first = False
+                if pretty_print:
+                    yield "[\n%s" % ("    " * (level + 1))
+                else:
+                    yield "["
+            elif pretty_print:
+                yield ",\n%s" % ("    " * (level + 1))
+            else:
+                yield ", "
+            yield dumps(obj, level + 1, pretty_print)
+        if first:
+            yield "[]"
+        elif pretty_print:
+            yield "\n%s]" % ("    " * level)
+        else:
+            yield "]"
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def __iterjson_members(cls, root, native, pretty_print, first=True):
+        """
+            Converts the child elements, attributes and text of the root
+            element into the members of a JSON object, one child element
+            at a time
+
+            @param root: the root element
+            @param native: convert as S3XML
+            @param pretty_print: provide pretty formatted output
+            @param first: False if members have already been written
+                          (see streamjson)
+        """
+
+        TAG = cls.TAG
+        ATTRIBUTE = cls.ATTRIBUTE
+        PREFIX = cls.PREFIX
+
+        dumps = cls.__jsondumps
+        element2json = cls.__element2json
+        objects = cls.__jsonobjects
+
+        children = [child for child in root
+                    if isinstance(child.tag, basestring)] # skip comment nodes
+
+        # Group the child elements by key (see __element2json)
+        keys = []
+        groups = {}
+        for child in children:
+            tag = child.tag
+            if tag[0] == "{":
+                tag = tag.rsplit("}", 1)[1]
+            collapse = True
+            if native:
+                if tag == TAG.resource:
+                    resource = child.get(ATTRIBUTE.name)
+                    tag = "%s_%s" % (PREFIX.resource, resource)
+                    collapse = False
+                elif tag == TAG.options:
+                    resource = child.get(ATTRIBUTE.resource)
+                    tag = "%s_%s" % (PREFIX.options, resource)
+                elif tag == TAG.reference:
+                    tag = "%s_%s" % (PREFIX.reference,
+                                     child.get(ATTRIBUTE.field))
+                elif tag == TAG.data:
+                    tag = child.get(ATTRIBUTE.field)
+            if tag not in groups:
+                keys.append(tag)
+                groups[tag] = (collapse, [])
+            groups[tag][1].append(child)
+
+        # A root element with nothing but an item or list collapses
+        # into that - convert it as a whole
+        if first and not root.attrib and \
+           (TAG.item in groups or TAG.list in groups):
+            yield dumps(element2json(root, native=native), 0, pretty_print)
+            return
 
         if pretty_print:
-            js = json.dumps(root_dict, indent=4)
-            return "\n".join([l.rstrip() for l in js.splitlines()])
+            separator = ",\n    "
+            opening = "{\n    "
+        else:
+            separator = ", "
+            opening = "{"
+        for key in keys:
+            collapse, elements = groups[key]
+            items = objects(elements, native)
+            try:
+                obj = items.next()
+            except StopIteration:
+                continue
+            if isinstance(obj, list) or not collapse:
+                second = None
+            else:
+                try:
+                    second = items.next()
+                except StopIteration:
+                    second = None
+                else:
+                    collapse = False
+
+            yield "%s%s: " % (first and opening or separator,
+                              json.dumps(key))
+            first = False
+
+            if collapse and not isinstance(obj, list):
+                # Single object
+                yield dumps(obj, 1, pretty_print)
+            else:
+                if pretty_print:
+                    yield "[\n        "
+                else:
+                    yield "["
+                yield dumps(obj, 2, pretty_print)
+                if second is not None:
+                    items = itertools.chain([second], items)
+                for obj in items:
+                    if pretty_print:
+                        yield ",\n        "
+                    else:
+                        yield ", "
+                    yield dumps(obj, 2, pretty_print)
+                if pretty_print:
+                    yield "\n    ]"
+                else:
+                    yield "]"
+
+        values = []
+        attributes = root.attrib
+        for a in attributes:
+            values.append((PREFIX.attribute + a, root.get(a)))
+        if root.text:
+            text = cls.xml_decode(root.text)
+            if first and not values:
+                # Nothing but text
+                yield dumps(text, 0, pretty_print)
+                return
+            values.append((PREFIX.text, text))
+        for key, value in values:
+            yield "%s%s: %s" % (first and opening or separator,
+                                json.dumps(key),
+                                dumps(value, 1, pretty_print))
+            first = False
+
+        if first:
+            yield "{}"
+        elif pretty_print:
+            yield "\n}"
         else:
-            return json.dumps(root_dict)
+            yield "}"
 
     # -------------------------------------------------------------------------
     @classmethod
@@ -141,6 +141,27 @@ if populate > 0:
         field = "last_name"
         db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
 
+        # Location Tracking History
+        table = s3base.S3Trackable.define_track_table()
+        tablename = table._tablename
+        db.executesql("CREATE INDEX %s__idx on %s(track_id, timestmp);" % (tablename, tablename))
+
+        # Search Token Index
+        table = s3base.S3SearchIndex.define_table()
+        tablename = table._tablename
+        if db._dbname == "postgres":
+            # Prefix LIKE can only use a pattern_ops index in non-C locales
+            db.executesql("CREATE INDEX %s__idx on %s(tablename, token varchar_pattern_ops);" % (tablename, tablename))
+        else:
+            db.executesql("CREATE INDEX %s__idx on %s(tablename, token);" % (tablename, tablename))
+        db.executesql("CREATE INDEX %s_record__idx on %s(tablename, record_id);" % (tablename, tablename))
+
+        # Climate Data Portal monthly roll-ups
+        if deployment_settings.has_module("climate"):
+            for tablename in db.tables:
+                if tablename.startswith("climate_") and tablename.endswith("_monthly"):
+                    db.executesql("CREATE INDEX %s__idx on %s(sample_type, time_period, place_id);" % (tablename, tablename))
+
         # Synchronisation
         table = db.sync_setting
         if db(table).isempty():
@@ -1253,6 +1274,8 @@ if populate > 0:
         # Should work for our 3 supported databases: sqlite, MySQL & PostgreSQL
         field = "name"
         db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
+        # Index the imported locations (if configured for token search)
+        s3base.S3SearchIndex.rebuild(tablename)
 
         # Ensure DB population committed when running through shell
         db.commit()